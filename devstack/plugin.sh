@@ -17,6 +17,10 @@ OVS_SWITCH_USER_HOME="$OVS_SWITCH_DATA_DIR/$OVS_SWITCH_USER"
 OVS_SWITCH_KEY_AUTHORIZED_KEYS_FILE="$OVS_SWITCH_USER_HOME/.ssh/authorized_keys"
 OVS_SWITCH_KEY_FILE=${OVS_SWITCH_KEY_FILE:-"$OVS_SWITCH_DATA_DIR/keys/ovs-switch"}
 
+# device backend of the switches on this host, set to "ovs" to configure
+# the local bridges with ovs-vsctl instead of ansible over SSH
+NET_ANSIBLE_LOCAL_SWITCH_BACKEND=${NET_ANSIBLE_LOCAL_SWITCH_BACKEND:-network_runner}
+
 OVS_SWITCH_TEST_BRIDGE="ovsswitch"
 OVS_SWITCH_TEST_PORT="sw-port-01"
 
@@ -127,6 +131,10 @@ function add_ovs_switch_to_ml2_config {
     populate_ml2_config $NET_ANS_SWITCH_INI_FILE $switch_name ansible_ssh_private_key_file=$key_file
     populate_ml2_config $NET_ANS_SWITCH_INI_FILE $switch_name ansible_host=$ip
     populate_ml2_config $NET_ANS_SWITCH_INI_FILE $switch_name manage_vlans=False
+    if [[ "$ip" == "localhost" && "$NET_ANSIBLE_LOCAL_SWITCH_BACKEND" == "ovs" ]]; then
+        populate_ml2_config $NET_ANS_SWITCH_INI_FILE $switch_name backend=ovs
+        populate_ml2_config $NET_ANS_SWITCH_INI_FILE $switch_name root_helper=sudo
+    fi
     if [[ "$switch_mac" != "" ]]; then
         populate_ml2_config $NET_ANS_SWITCH_INI_FILE $switch_name mac=$switch_mac
     fi
@@ -0,0 +1,150 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import abc
+
+from oslo_log import log as logging
+
+from networking_ansible import config
+from networking_ansible import exceptions
+
+CONF = config.CONF
+LOG = logging.getLogger(__name__)
+
+
+class DeviceBackend(object, metaclass=abc.ABCMeta):
+    """Interface of the backends configuring the switches
+
+    A backend is loaded once for all the switches selecting it with the
+    ``backend`` key of their ``[ansible:<host>]`` section.
+
+    :param inventory: {switch_name: switch config} of these switches
+    """
+
+    def __init__(self, inventory):
+        self.inventory = inventory
+
+    @staticmethod
+    def device_timeout(timeout):
+        """Return a timeout of the backend capped by the device timeout"""
+        if CONF.ml2_ansible.device_timeout:
+            return min(timeout, CONF.ml2_ansible.device_timeout)
+        return timeout
+
+    @abc.abstractmethod
+    def create_vlan(self, switch_name, vlan_id, **kwargs):
+        """Create a VLAN on a switch"""
+
+    @abc.abstractmethod
+    def delete_vlan(self, switch_name, vlan_id, **kwargs):
+        """Delete a VLAN from a switch"""
+
+    @abc.abstractmethod
+    def conf_access_port(self, switch_name, port_name, vlan_id, **kwargs):
+        """Configure a switch port as an access port of a VLAN"""
+
+    @abc.abstractmethod
+    def conf_trunk_port(self, switch_name, port_name, vlan_id, trunked_vlans,
+                        **kwargs):
+        """Configure a switch port as a trunk
+
+        :param vlan_id: the native VLAN of the trunk
+        :param trunked_vlans: the tagged VLANs of the trunk
+        """
+
+    @abc.abstractmethod
+    def add_trunk_vlan(self, switch_name, port_name, vlan_id, **kwargs):
+        """Add a tagged VLAN to a trunk port"""
+
+    @abc.abstractmethod
+    def delete_trunk_vlan(self, switch_name, port_name, vlan_id, **kwargs):
+        """Remove a tagged VLAN from a trunk port"""
+
+    @abc.abstractmethod
+    def delete_port(self, switch_name, port_name, **kwargs):
+        """Remove the VLAN configuration of a switch port"""
+
+    def warm_up(self):
+        """Set up what the first device operation would need
+
+        Called once the neutron-server worker started, backends loading
+        something slow on first use override this.
+        """
+
+    def create_vlans(self, switch_name, vlan_ids, **kwargs):
+        """Create several VLANs on a switch
+
+        Backends able to change many VLANs in one device operation
+        override this and delete_vlans with _bulk_or_each. By default the
+        VLANs are created one by one.
+
+        :raises: BulkVlanException with the errors of the failed VLANs
+        """
+        self._bulk_vlans(self.create_vlan, switch_name, vlan_ids, **kwargs)
+
+    def delete_vlans(self, switch_name, vlan_ids, **kwargs):
+        """Delete several VLANs from a switch
+
+        :raises: BulkVlanException with the errors of the failed VLANs
+        """
+        self._bulk_vlans(self.delete_vlan, switch_name, vlan_ids, **kwargs)
+
+    def _bulk_or_each(self, bulk, func, switch_name, vlan_ids, **kwargs):
+        """Change VLANs in one device operation, one by one if it fails
+
+        A failed bulk operation doesn't tell the failed VLANs apart, they
+        are found by changing the VLANs one by one.
+        """
+        try:
+            bulk(switch_name, vlan_ids, **kwargs)
+        except Exception as e:
+            LOG.debug('Changing VLANs {vlans} one by one on switch '
+                      '{switch_name} after a failed bulk operation: '
+                      '{err}'.format(vlans=list(vlan_ids),
+                                     switch_name=switch_name, err=e))
+            self._bulk_vlans(func, switch_name, vlan_ids, **kwargs)
+
+    @staticmethod
+    def _bulk_vlans(func, switch_name, vlan_ids, **kwargs):
+        errors = {}
+        for vlan_id in vlan_ids:
+            try:
+                func(switch_name, vlan_id, **kwargs)
+            except Exception as e:
+                errors[vlan_id] = e
+        if errors:
+            raise exceptions.BulkVlanException(
+                'Failed to change VLANs {} on switch {}'.format(
+                    sorted(errors), switch_name), errors)
+
+    def commit(self, switch_name, operations, **kwargs):
+        """Apply several operations in one commit of a switch
+
+        Backends of switches with a candidate configuration override this
+        to commit once for all the operations. By default the operations
+        are run one by one.
+
+        :param operations: [(operation name, args)]
+        :returns: the exception of every operation that failed, None for
+                  the others
+        """
+        errors = []
+        for operation, args in operations:
+            try:
+                getattr(self, operation)(switch_name, *args, **kwargs)
+                errors.append(None)
+            except Exception as e:
+                errors.append(e)
+        return errors
@@ -0,0 +1,75 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+
+from oslo_log import log as logging
+from stevedore import driver
+
+from networking_ansible.backends import network_runner
+from networking_ansible import constants as c
+from networking_ansible import exceptions
+
+LOG = logging.getLogger(__name__)
+
+
+class BackendManager(object):
+    """Load the device backends selected by the switches
+
+    Switches pick a backend with the ``backend`` key of their section,
+    backends are looked up by name in the networking_ansible.backends
+    entry point namespace. Switches without the key use network-runner.
+    """
+
+    def __init__(self, inventory):
+        switches_by_backend = collections.defaultdict(dict)
+        for switch_name, switch in inventory.items():
+            name = switch.get(c.BACKEND, c.DEFAULT_BACKEND)
+            switches_by_backend[name][switch_name] = switch
+
+        self._backends = {}
+        for name, switches in switches_by_backend.items():
+            backend = self._load(name, switches)
+            for switch_name in switches:
+                self._backends[switch_name] = backend
+            LOG.info('Using device backend %s for switches %s',
+                     name, ', '.join(switches))
+
+    @staticmethod
+    def _load(name, switches):
+        if name == c.DEFAULT_BACKEND:
+            # the default backend is always available
+            return network_runner.NetworkRunnerBackend(switches)
+        try:
+            return driver.DriverManager(c.BACKEND_NAMESPACE, name,
+                                        invoke_on_load=True,
+                                        invoke_args=(switches,)).driver
+        except Exception as e:
+            raise exceptions.NetworkingAnsibleMechException(
+                'Failed to load device backend {name} for switches '
+                '{switches}: {err}'.format(name=name,
+                                           switches=', '.join(switches),
+                                           err=e))
+
+    def get(self, switch_name):
+        return self._backends[switch_name]
+
+    def warm_up(self):
+        """Set up the backends ahead of their first device operation"""
+        warmed = set()
+        for backend in self._backends.values():
+            if id(backend) not in warmed:
+                warmed.add(id(backend))
+                backend.warm_up()
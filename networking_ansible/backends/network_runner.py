@@ -0,0 +1,202 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import functools
+import json
+import os
+import signal
+import sys
+import threading
+
+from network_runner import api as net_runr_api
+from network_runner.models.inventory import Inventory
+from network_runner.models.playbook import Playbook
+from oslo_concurrency import processutils
+
+from networking_ansible.backends import base
+from networking_ansible import config
+from networking_ansible import exceptions
+
+CONF = config.CONF
+
+
+# bulk VLAN operations and the role tasks they run once per VLAN
+_BULK_VLANS = {
+    'create_vlans': net_runr_api.CREATE_VLAN,
+    'delete_vlans': net_runr_api.DELETE_VLAN,
+}
+
+
+def _build_runner(inventory):
+    _inv = Inventory()
+    _inv.deserialize({'all': {'hosts': inventory}})
+    return net_runr_api.NetworkRunner(_inv)
+
+
+def _play_vlans(runner, tasks_from, switch_name, vlan_ids, **kwargs):
+    """Run the role tasks of several VLANs in a single Ansible run"""
+    pb = Playbook()
+    play = pb.new(hosts=switch_name, gather_facts=False)
+    for vlan_id in vlan_ids:
+        task = play.tasks.new(action=net_runr_api.IMPORT_ROLE)
+        task.args = {'name': net_runr_api.NETWORK_RUNNER,
+                     'tasks_from': tasks_from}
+        variables = {'vlan_id': vlan_id}
+        if tasks_from == net_runr_api.CREATE_VLAN:
+            variables['vlan_name'] = None
+        variables.update(kwargs)
+        task.vars = variables
+    return runner.run(pb)
+
+
+def _run_operation(runner, operation, args, kwargs):
+    if operation in _BULK_VLANS:
+        return _play_vlans(runner, _BULK_VLANS[operation], *args, **kwargs)
+    return getattr(runner, operation)(*args, **kwargs)
+
+
+def _kill(process, killed):
+    """Kill a worker process that ran out of time
+
+    The worker leads its own process group. Its Ansible run, started on a
+    pseudo terminal of the worker, gets hung up once the worker is gone.
+    """
+    killed.set()
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        # the worker exited meanwhile
+        pass
+
+
+def main():
+    """Run a single operation sent by NetworkRunnerBackend on stdin"""
+    request = json.load(sys.stdin)
+    try:
+        _run_operation(_build_runner(request['inventory']),
+                       request['operation'], request['args'],
+                       request['kwargs'])
+    except Exception as e:
+        sys.exit(str(e))
+
+
+class NetworkRunnerBackend(base.DeviceBackend):
+    """Configure the switches by running network-runner Ansible roles
+
+    With [ml2_ansible] ansible_worker_pool_size set each role runs in a
+    worker process of its own instead of in the calling neutron-server
+    worker, at most that many at once. The worker only loads the inventory
+    of the switch it configures. A worker whose role runs longer than
+    [ml2_ansible] device_timeout is killed.
+    """
+
+    def __init__(self, inventory):
+        super(NetworkRunnerBackend, self).__init__(inventory)
+        self._net_runr = None
+        self._runner_lock = threading.Lock()
+        self._workers = threading.BoundedSemaphore(
+            CONF.ml2_ansible.ansible_worker_pool_size or 1)
+
+    @property
+    def net_runr(self):
+        # loading the inventory takes a while with many switches, it is
+        # only done when the first operation runs in this process
+        if self._net_runr is None:
+            with self._runner_lock:
+                if self._net_runr is None:
+                    self._net_runr = _build_runner(self.inventory)
+        return self._net_runr
+
+    def warm_up(self):
+        self.net_runr
+
+    def _run(self, operation, *args, **kwargs):
+        if not CONF.ml2_ansible.ansible_worker_pool_size:
+            return _run_operation(self.net_runr, operation, args, kwargs)
+        switch_name = args[0]
+        # the inventory carries the switch credentials, it is only handed
+        # over on stdin
+        request = json.dumps({
+            'inventory': {switch_name: self.inventory[switch_name]},
+            'operation': operation,
+            'args': args,
+            'kwargs': kwargs}, default=list)
+        timeout = CONF.ml2_ansible.device_timeout
+        killed = threading.Event()
+        timers = []
+
+        def _started(process):
+            if timeout:
+                timers.append(threading.Timer(timeout, _kill,
+                                              (process, killed)))
+                timers[0].start()
+
+        with self._workers:
+            try:
+                processutils.execute(sys.executable, '-m', __name__,
+                                     process_input=request,
+                                     preexec_fn=os.setsid,
+                                     on_execute=_started)
+            except processutils.ProcessExecutionError as e:
+                if killed.is_set():
+                    raise exceptions.DeviceCommandException(
+                        '{op} {args} timed out after {timeout} seconds, '
+                        'its Ansible run was killed'.format(
+                            op=operation, args=list(args),
+                            timeout=timeout))
+                raise exceptions.DeviceCommandException(e.stderr)
+            finally:
+                for timer in timers:
+                    timer.cancel()
+
+    def create_vlan(self, switch_name, vlan_id, **kwargs):
+        return self._run('create_vlan', switch_name, vlan_id, **kwargs)
+
+    def delete_vlan(self, switch_name, vlan_id, **kwargs):
+        return self._run('delete_vlan', switch_name, vlan_id, **kwargs)
+
+    def create_vlans(self, switch_name, vlan_ids, **kwargs):
+        """Create the VLANs in a single Ansible run"""
+        self._bulk_or_each(functools.partial(self._run, 'create_vlans'),
+                           self.create_vlan, switch_name, vlan_ids, **kwargs)
+
+    def delete_vlans(self, switch_name, vlan_ids, **kwargs):
+        """Delete the VLANs in a single Ansible run"""
+        self._bulk_or_each(functools.partial(self._run, 'delete_vlans'),
+                           self.delete_vlan, switch_name, vlan_ids, **kwargs)
+
+    def conf_access_port(self, switch_name, port_name, vlan_id, **kwargs):
+        return self._run('conf_access_port', switch_name, port_name,
+                         vlan_id, **kwargs)
+
+    def conf_trunk_port(self, switch_name, port_name, vlan_id, trunked_vlans,
+                        **kwargs):
+        return self._run('conf_trunk_port', switch_name, port_name,
+                         vlan_id, trunked_vlans, **kwargs)
+
+    def add_trunk_vlan(self, switch_name, port_name, vlan_id, **kwargs):
+        return self._run('add_trunk_vlan', switch_name, port_name,
+                         vlan_id, **kwargs)
+
+    def delete_trunk_vlan(self, switch_name, port_name, vlan_id, **kwargs):
+        return self._run('delete_trunk_vlan', switch_name, port_name,
+                         vlan_id, **kwargs)
+
+    def delete_port(self, switch_name, port_name, **kwargs):
+        return self._run('delete_port', switch_name, port_name, **kwargs)
+
+
+if __name__ == '__main__':
+    main()
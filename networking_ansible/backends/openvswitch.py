@@ -0,0 +1,160 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Open vSwitch device operations
+
+Every operation function returns the list of ovs-vsctl operations of one
+device operation, matching the network-runner openvswitch role.
+Operations can be combined into a single ovs-vsctl transaction with
+vsctl().
+"""
+
+from oslo_concurrency import processutils
+from oslo_log import log as logging
+
+from networking_ansible.backends import base
+from networking_ansible import exceptions
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 10
+
+
+def conf_access_port(port_name, vlan_id):
+    return [['set', 'port', port_name, 'vlan_mode=access',
+             'tag={}'.format(vlan_id)],
+            ['clear', 'port', port_name, 'trunks']]
+
+
+def conf_trunk_port(port_name, vlan_id, trunked_vlans):
+    trunks = ','.join(str(v) for v in [vlan_id] + list(trunked_vlans))
+    return [['set', 'port', port_name, 'vlan_mode=native-untagged',
+             'tag={}'.format(vlan_id), 'trunks={}'.format(trunks)]]
+
+
+def add_trunk_vlan(port_name, vlan_id):
+    return [['add', 'port', port_name, 'trunks', str(vlan_id)]]
+
+
+def delete_trunk_vlan(port_name, vlan_id):
+    return [['remove', 'port', port_name, 'trunks', str(vlan_id)]]
+
+
+def delete_port(port_name):
+    return [['clear', 'port', port_name, 'tag', 'trunks', 'vlan_mode']]
+
+
+# the ovs-vsctl operations of the device operations, creating and deleting
+# VLANs doesn't run any
+OPERATIONS = {
+    'conf_access_port': conf_access_port,
+    'conf_trunk_port': conf_trunk_port,
+    'add_trunk_vlan': add_trunk_vlan,
+    'delete_trunk_vlan': delete_trunk_vlan,
+    'delete_port': delete_port,
+}
+
+
+def vsctl(operations, options=()):
+    """Build the argv of an ovs-vsctl transaction running operations"""
+    argv = ['ovs-vsctl'] + list(options)
+    for i, operation in enumerate(operations):
+        if i:
+            argv.append('--')
+        argv.extend(operation)
+    return argv
+
+
+class OvsBackend(base.DeviceBackend):
+    """Configure the Open vSwitch bridges of the local host
+
+    Every device operation is a single ovs-vsctl transaction run against
+    the local ovsdb-server, without SSH or Ansible. The switch name is the
+    bridge name. Optional switch keys are ovsdb_connection, the ovsdb
+    server to connect to, ovs_timeout, the seconds to wait for the
+    database, and root_helper, the command to run ovs-vsctl as root with.
+    [ml2_ansible] device_timeout caps ovs_timeout.
+    """
+
+    def __init__(self, inventory):
+        super(OvsBackend, self).__init__(inventory)
+        self._options = {}
+        for switch_name, switch in inventory.items():
+            options = ['--timeout={}'.format(self.device_timeout(
+                int(switch.get('ovs_timeout', DEFAULT_TIMEOUT))))]
+            if switch.get('ovsdb_connection'):
+                options.append('--db={}'.format(switch['ovsdb_connection']))
+            self._options[switch_name] = options
+
+    def transaction(self, switch_name, operations):
+        """Run ovs-vsctl operations in one transaction"""
+        if not operations:
+            return
+        root_helper = self.inventory[switch_name].get('root_helper')
+        argv = vsctl(operations, self._options[switch_name])
+        try:
+            processutils.execute(*argv,
+                                 run_as_root=bool(root_helper),
+                                 root_helper=root_helper)
+        except processutils.ProcessExecutionError as e:
+            raise exceptions.DeviceCommandException(
+                'ovs-vsctl transaction failed on switch {switch_name}: '
+                '{err}'.format(switch_name=switch_name, err=e.stderr))
+        LOG.debug('Ran ovs-vsctl transaction on switch {switch_name}: '
+                  '{ops}'.format(switch_name=switch_name, ops=operations))
+
+    def commit(self, switch_name, operations, **kwargs):
+        """Run the operations in a single ovs-vsctl transaction
+
+        ovsdb transactions are atomic, when the transaction fails the
+        operations are run one by one to tell the failing ones apart.
+        """
+        vsctl_ops = []
+        for operation, args in operations:
+            if operation in OPERATIONS:
+                vsctl_ops.extend(OPERATIONS[operation](*args))
+        try:
+            self.transaction(switch_name, vsctl_ops)
+        except exceptions.DeviceCommandException as e:
+            LOG.debug('Retrying the operations of a failed transaction one '
+                      'by one on switch {switch_name}: {err}'.format(
+                          switch_name=switch_name, err=e))
+            return super(OvsBackend, self).commit(switch_name, operations,
+                                                  **kwargs)
+        return [None] * len(operations)
+
+    def create_vlan(self, switch_name, vlan_id, **kwargs):
+        # VLANs don't exist on their own on an Open vSwitch bridge
+        pass
+
+    def delete_vlan(self, switch_name, vlan_id, **kwargs):
+        pass
+
+    def conf_access_port(self, switch_name, port_name, vlan_id, **kwargs):
+        self.transaction(switch_name, conf_access_port(port_name, vlan_id))
+
+    def conf_trunk_port(self, switch_name, port_name, vlan_id, trunked_vlans,
+                        **kwargs):
+        self.transaction(switch_name, conf_trunk_port(port_name, vlan_id,
+                                                      trunked_vlans))
+
+    def add_trunk_vlan(self, switch_name, port_name, vlan_id, **kwargs):
+        self.transaction(switch_name, add_trunk_vlan(port_name, vlan_id))
+
+    def delete_trunk_vlan(self, switch_name, port_name, vlan_id, **kwargs):
+        self.transaction(switch_name, delete_trunk_vlan(port_name, vlan_id))
+
+    def delete_port(self, switch_name, port_name, **kwargs):
+        self.transaction(switch_name, delete_port(port_name))
@@ -0,0 +1,334 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import functools
+import re
+import shlex
+import socket
+import threading
+
+from neutron_lib._i18n import _
+from oslo_log import log as logging
+from oslo_utils import importutils
+from oslo_utils import strutils
+
+from networking_ansible.backends import base
+from networking_ansible.backends import openvswitch
+from networking_ansible import exceptions
+
+paramiko = importutils.try_import('paramiko')
+
+LOG = logging.getLogger(__name__)
+
+CONNECT_TIMEOUT = 10
+DEFAULT_COMMAND_TIMEOUT = 30
+
+# port names are written into CLI commands unquoted
+PORT_NAME_RE = re.compile(r'^[\w./:-]+$')
+
+
+class OvsCommands(object):
+    """Commands configuring the ports of an Open vSwitch bridge
+
+    VLANs don't exist on their own on an Open vSwitch bridge, creating and
+    deleting them doesn't run any command.
+    """
+
+    def __init__(self, become=False):
+        self.become = become
+
+    def _vsctl(self, operations):
+        argv = openvswitch.vsctl(operations)
+        if self.become:
+            argv = ['sudo', '-n'] + argv
+        return ' '.join(shlex.quote(arg) for arg in argv)
+
+    def create_vlan(self, vlan_id):
+        return None
+
+    def delete_vlan(self, vlan_id):
+        return None
+
+    def create_vlans(self, vlan_ids):
+        return None
+
+    def delete_vlans(self, vlan_ids):
+        return None
+
+    def conf_access_port(self, port_name, vlan_id):
+        return self._vsctl(openvswitch.conf_access_port(port_name, vlan_id))
+
+    def conf_trunk_port(self, port_name, vlan_id, trunked_vlans):
+        return self._vsctl(openvswitch.conf_trunk_port(port_name, vlan_id,
+                                                       trunked_vlans))
+
+    def add_trunk_vlan(self, port_name, vlan_id):
+        return self._vsctl(openvswitch.add_trunk_vlan(port_name, vlan_id))
+
+    def delete_trunk_vlan(self, port_name, vlan_id):
+        return self._vsctl(openvswitch.delete_trunk_vlan(port_name,
+                                                         vlan_id))
+
+    def delete_port(self, port_name):
+        return self._vsctl(openvswitch.delete_port(port_name))
+
+    def error(self, status, output, err):
+        """Return the error of a failed command, None if it succeeded"""
+        return err if status else None
+
+
+class CliCommands(object):
+    """Configuration commands of switches with an industry standard CLI
+
+    Every device operation is a single exec request entering the
+    configuration mode, running the configuration lines of the operation
+    and leaving the configuration mode. The switch reports failed lines
+    on the output with a leading %.
+    """
+
+    SEPARATOR = ' ; '
+
+    def __init__(self, become=False):
+        self.become = become
+
+    def _config(self, lines):
+        commands = ['enable'] if self.become else []
+        commands.append('configure terminal')
+        commands.extend(lines)
+        commands.append('end')
+        return self.SEPARATOR.join(commands)
+
+    @staticmethod
+    def _interface(port_name):
+        if not PORT_NAME_RE.match(port_name):
+            raise exceptions.DeviceCommandException(
+                _('Invalid switch port name {}').format(port_name))
+        return 'interface {}'.format(port_name)
+
+    def create_vlan(self, vlan_id):
+        return self._config(['vlan {}'.format(vlan_id)])
+
+    def delete_vlan(self, vlan_id):
+        return self._config(['no vlan {}'.format(vlan_id)])
+
+    @staticmethod
+    def _vlan_list(vlan_ids):
+        return ','.join(str(vlan_id) for vlan_id in vlan_ids)
+
+    def create_vlans(self, vlan_ids):
+        return self._config(['vlan {}'.format(self._vlan_list(vlan_ids))])
+
+    def delete_vlans(self, vlan_ids):
+        return self._config(['no vlan {}'.format(
+            self._vlan_list(vlan_ids))])
+
+    def conf_access_port(self, port_name, vlan_id):
+        return self._config([self._interface(port_name),
+                             'switchport mode access',
+                             'switchport access vlan {}'.format(vlan_id)])
+
+    def conf_trunk_port(self, port_name, vlan_id, trunked_vlans):
+        trunks = ','.join(str(v) for v in [vlan_id] + list(trunked_vlans))
+        return self._config([
+            self._interface(port_name),
+            'switchport mode trunk',
+            'switchport trunk native vlan {}'.format(vlan_id),
+            'switchport trunk allowed vlan {}'.format(trunks)])
+
+    def add_trunk_vlan(self, port_name, vlan_id):
+        return self._config([
+            self._interface(port_name),
+            'switchport trunk allowed vlan add {}'.format(vlan_id)])
+
+    def delete_trunk_vlan(self, port_name, vlan_id):
+        return self._config([
+            self._interface(port_name),
+            'switchport trunk allowed vlan remove {}'.format(vlan_id)])
+
+    def delete_port(self, port_name):
+        return self._config([self._interface(port_name),
+                             'no switchport access vlan',
+                             'no switchport trunk native vlan',
+                             'no switchport trunk allowed vlan',
+                             'no switchport mode'])
+
+    def error(self, status, output, err):
+        """Return the error of a failed command, None if it succeeded"""
+        failed = [line.strip() for line in output.splitlines()
+                  if line.lstrip().startswith('%')]
+        if failed:
+            return '\n'.join(failed)
+        # -1 is returned by servers not sending an exit status
+        return err if status > 0 else None
+
+
+class NxosCommands(CliCommands):
+    """Cisco NX-OS, lines of an exec request are separated by ;"""
+
+
+class EosCommands(CliCommands):
+    """Arista EOS, lines of an exec request are separated by newlines"""
+
+    SEPARATOR = '\n'
+
+
+# command sets by ansible_network_os
+PLATFORMS = {
+    'eos': EosCommands,
+    'nxos': NxosCommands,
+    'openvswitch': OvsCommands,
+}
+
+
+class SshBackend(base.DeviceBackend):
+    """Configure the switches with CLI commands over persistent SSH sessions
+
+    Device operations skip Ansible altogether: the commands of the
+    switch's ansible_network_os are run over an SSH connection that is
+    opened on first use and kept open for the following operations. The
+    connection settings are the ansible_* variables of the switch section.
+    [ml2_ansible] device_timeout caps ansible_command_timeout.
+    """
+
+    def __init__(self, inventory):
+        super(SshBackend, self).__init__(inventory)
+        if not paramiko:
+            raise ImportError(_('The ssh device backend requires '
+                                'paramiko'))
+        self._commands = {}
+        self._clients = {}
+        self._locks = {}
+        for switch_name, switch in inventory.items():
+            platform = switch.get('ansible_network_os')
+            if platform not in PLATFORMS:
+                raise ValueError(_('The ssh device backend does not support '
+                                   'ansible_network_os {} of switch '
+                                   '{}').format(platform, switch_name))
+            become = strutils.bool_from_string(switch.get('ansible_become'))
+            self._commands[switch_name] = PLATFORMS[platform](become=become)
+            self._locks[switch_name] = threading.Lock()
+
+    def _connect(self, switch_name):
+        switch = self.inventory[switch_name]
+        client = paramiko.SSHClient()
+        client.load_system_host_keys()
+        if strutils.bool_from_string(
+                switch.get('ansible_host_key_checking', True)):
+            client.set_missing_host_key_policy(paramiko.RejectPolicy())
+        else:
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(
+            switch.get('ansible_host', switch_name),
+            port=int(switch.get('ansible_port', 22)),
+            username=switch.get('ansible_user'),
+            password=switch.get('ansible_ssh_pass',
+                                switch.get('ansible_password')),
+            key_filename=switch.get('ansible_ssh_private_key_file'),
+            timeout=CONNECT_TIMEOUT)
+        LOG.debug('Opened SSH session to switch {}'.format(switch_name))
+        return client
+
+    def _close(self, switch_name):
+        client = self._clients.pop(switch_name, None)
+        if client:
+            client.close()
+
+    def _exec(self, switch_name, command):
+        if switch_name not in self._clients:
+            self._clients[switch_name] = self._connect(switch_name)
+        timeout = self.device_timeout(int(self.inventory[switch_name].get(
+            'ansible_command_timeout', DEFAULT_COMMAND_TIMEOUT)))
+        _, stdout, stderr = self._clients[switch_name].exec_command(
+            command, timeout=timeout)
+        # recv_exit_status() waits as long as the switch keeps the channel
+        # open, the session is dropped when the command doesn't finish
+        # within the channel timeout
+        if not stdout.channel.status_event.wait(timeout):
+            self._close(switch_name)
+            raise exceptions.DeviceCommandException(
+                _('Command {cmd} did not finish on switch {switch_name} '
+                  'within {timeout} seconds').format(cmd=command,
+                                                     switch_name=switch_name,
+                                                     timeout=timeout))
+        status = stdout.channel.recv_exit_status()
+        return (status, stdout.read().decode(errors='replace'),
+                stderr.read().decode(errors='replace'))
+
+    def _run(self, switch_name, operation, *args):
+        commands = self._commands[switch_name]
+        command = getattr(commands, operation)(*args)
+        if command is None:
+            return
+        with self._locks[switch_name]:
+            try:
+                status, output, err = self._exec(switch_name, command)
+            except (paramiko.SSHException, socket.error) as e:
+                # the persistent session may have been dropped by the
+                # switch, reconnect once before giving up
+                LOG.debug('Reconnecting to switch {switch_name} after '
+                          'error: {err}'.format(switch_name=switch_name,
+                                                err=e))
+                self._close(switch_name)
+                try:
+                    status, output, err = self._exec(switch_name, command)
+                except Exception:
+                    self._close(switch_name)
+                    raise
+        error = commands.error(status, output, err)
+        if error is not None:
+            raise exceptions.DeviceCommandException(
+                'Command {cmd} failed on switch {switch_name} with status '
+                '{status}: {err}'.format(cmd=command,
+                                         switch_name=switch_name,
+                                         status=status,
+                                         err=error))
+
+    def create_vlan(self, switch_name, vlan_id, **kwargs):
+        self._run(switch_name, 'create_vlan', vlan_id)
+
+    def delete_vlan(self, switch_name, vlan_id, **kwargs):
+        self._run(switch_name, 'delete_vlan', vlan_id)
+
+    def create_vlans(self, switch_name, vlan_ids, **kwargs):
+        """Create the VLANs with a single VLAN list command"""
+        self._bulk_or_each(
+            functools.partial(self._run_vlans, 'create_vlans'),
+            self.create_vlan, switch_name, vlan_ids)
+
+    def delete_vlans(self, switch_name, vlan_ids, **kwargs):
+        """Delete the VLANs with a single VLAN list command"""
+        self._bulk_or_each(
+            functools.partial(self._run_vlans, 'delete_vlans'),
+            self.delete_vlan, switch_name, vlan_ids)
+
+    def _run_vlans(self, operation, switch_name, vlan_ids, **kwargs):
+        self._run(switch_name, operation, vlan_ids)
+
+    def conf_access_port(self, switch_name, port_name, vlan_id, **kwargs):
+        self._run(switch_name, 'conf_access_port', port_name, vlan_id)
+
+    def conf_trunk_port(self, switch_name, port_name, vlan_id, trunked_vlans,
+                        **kwargs):
+        self._run(switch_name, 'conf_trunk_port', port_name, vlan_id,
+                  trunked_vlans)
+
+    def add_trunk_vlan(self, switch_name, port_name, vlan_id, **kwargs):
+        self._run(switch_name, 'add_trunk_vlan', port_name, vlan_id)
+
+    def delete_trunk_vlan(self, switch_name, port_name, vlan_id, **kwargs):
+        self._run(switch_name, 'delete_trunk_vlan', port_name, vlan_id)
+
+    def delete_port(self, switch_name, port_name, **kwargs):
+        self._run(switch_name, 'delete_port', port_name)
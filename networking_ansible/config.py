@@ -13,18 +13,202 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import functools
+import re
+
 from oslo_config import cfg
 from oslo_config import types
 from oslo_log import log as logging
 
 from networking_ansible import constants as c
+from networking_ansible import exceptions
 CONF = cfg.CONF
 LOG = logging.getLogger(__name__)
 
+# [domain:]bus:device[.function]
+PCI_SLOT_RE = re.compile(r'^(?:[0-9a-fA-F]{4}:)?[0-9a-fA-F]{2}:'
+                         r'[0-9a-fA-F]{2}(?:\.[0-7])?$')
+# bus and device as returned by parse_pci_slot, after a domain other than
+# 0000
+PCI_BUS_RE = re.compile(r'^(?:[0-9a-fA-F]{4})?[0-9a-fA-F]{4}$')
+PCI_SLOT_CACHE_SIZE = 4096
+
 anet_opts = [
     cfg.StrOpt('coordination_uri',
                default='etcd://127.0.0.1:2379',
-               help="backend to use for tooz coordination")
+               help="backend to use for tooz coordination"),
+    cfg.StrOpt('coordination_proxy_socket',
+               help="Unix socket of the local coordination proxy started "
+                    "with networking-ansible-coordination-proxy. When set, "
+                    "the workers take the switch locks through the proxy, "
+                    "which holds the only coordination backend session of "
+                    "the controller and hands locks to the next local "
+                    "worker first, instead of each worker joining the "
+                    "backend."),
+    cfg.StrOpt('desired_state_uri',
+               help="etcd endpoint, like http://127.0.0.1:2379, keeping "
+                    "the desired state of the switches. When set, the "
+                    "driver publishes the device operations as versioned "
+                    "desired state of the switch objects and the worker "
+                    "owning each switch watches it and converges the "
+                    "switch. Requires etcd3gw and switch_partitioning."),
+    cfg.IntOpt('desired_state_resync_interval',
+               default=60,
+               min=1,
+               help="Interval in seconds between the resyncs of the "
+                    "desired state, which apply the changes missed while "
+                    "no worker was watching and retry the failed ones."),
+    cfg.IntOpt('vlan_gc_interval',
+               default=0,
+               min=0,
+               help="Interval in seconds between runs of the VLAN garbage "
+                    "collector. When set, VLANs of deleted networks are "
+                    "removed from the switches in one batch per switch "
+                    "instead of on every network delete. 0 disables the "
+                    "collector and VLANs are removed immediately."),
+    cfg.IntOpt('vlan_gc_grace_period',
+               default=300,
+               min=0,
+               help="Time in seconds a VLAN has to stay unused before the "
+                    "garbage collector removes it from the switches."),
+    cfg.BoolOpt('switch_partitioning',
+                default=False,
+                help="Partition the switches across the live neutron-server "
+                     "workers with a consistent hash ring kept in the "
+                     "coordination backend. Port operations are sent over "
+                     "RPC to the worker owning the switch so that a switch "
+                     "is driven by a single worker at a time."),
+    cfg.IntOpt('partition_refresh_interval',
+               default=10,
+               min=1,
+               help="Interval in seconds between checks for workers joining "
+                    "or leaving the switch partitioning group."),
+    cfg.IntOpt('partition_rpc_timeout',
+               default=300,
+               min=1,
+               help="Time in seconds to wait for the worker owning a switch "
+                    "to complete a port operation before running it "
+                    "locally."),
+    cfg.BoolOpt('switch_queues',
+                default=False,
+                help="Queue the operations of every switch to a single "
+                     "consumer per neutron-server worker. The consumer runs "
+                     "the queued operations in order and takes the switch "
+                     "lock once per batch instead of once per operation."),
+    cfg.IntOpt('switch_queue_batch_size',
+               default=20,
+               min=1,
+               help="Maximum number of queued operations run on a switch "
+                    "under a single acquisition of the switch lock."),
+    cfg.IntOpt('switch_queue_aging_interval',
+               default=30,
+               min=0,
+               help="Queued switch operations run by priority: port binds "
+                    "first, then port updates, deletes and cleanup and "
+                    "finally background work. An operation is raised by "
+                    "one priority class for every interval of this many "
+                    "seconds it has been waiting so that lower priority "
+                    "work is not starved. 0 disables the aging."),
+    cfg.FloatOpt('vlan_batch_window',
+                 default=0,
+                 min=0,
+                 help="Seconds during which the VLAN creations and "
+                      "deletions of networks are collected per switch and "
+                      "then applied with a single multi-VLAN device "
+                      "operation under one switch lock. 0 changes the VLAN "
+                      "of every network on its own."),
+    cfg.FloatOpt('provisioning_batch_window',
+                 default=0,
+                 min=0,
+                 help="Seconds during which bound baremetal ports are "
+                      "collected before their provisioning blocks are "
+                      "removed in a single DB transaction. 0 completes "
+                      "the provisioning of every port on its own."),
+    cfg.IntOpt('switch_health_interval',
+               default=0,
+               min=0,
+               help="Interval in seconds between the reachability probes "
+                    "of the switches, a TCP connection to their management "
+                    "address reading the SSH banner. Operations on a switch "
+                    "failing its probes fail right away instead of waiting "
+                    "for the device timeout. 0 disables the probes."),
+    cfg.FloatOpt('switch_health_timeout',
+                 default=5.0,
+                 min=0.1,
+                 help="Seconds a switch has to accept the connection and "
+                      "send its SSH banner to pass a reachability probe."),
+    cfg.FloatOpt('lock_timeout',
+                 default=0,
+                 min=0,
+                 help="Seconds to wait for the lock of a switch before the "
+                      "operation fails. Operations of the switch queues "
+                      "stay queued and are retried. 0 waits forever."),
+    cfg.IntOpt('device_timeout',
+               default=0,
+               min=0,
+               help="Seconds a device operation configuring a switch may "
+                    "take. With the network-runner backend, the worker "
+                    "process running the Ansible run is killed together "
+                    "with it once it expires and the operation fails, "
+                    "which is only enforced with ansible_worker_pool_size. "
+                    "It caps the command timeout of the ssh backend and "
+                    "the ovs-vsctl timeout of the ovs backend. 0 disables "
+                    "the timeout."),
+    cfg.FloatOpt('hook_timeout',
+                 default=0,
+                 min=0,
+                 help="Seconds a network, port or trunk hook may wait for "
+                      "switch locks, switch queues and batched VLAN "
+                      "changes overall. The hook fails once they are used "
+                      "up, operations it queued that didn't start yet are "
+                      "dropped. 0 disables the budget."),
+    cfg.FloatOpt('adaptive_rate_latency_threshold',
+                 default=20.0,
+                 min=0,
+                 help="Device operations on switches with adaptive_rate "
+                      "enabled that take longer than this many seconds, or "
+                      "fail, halve the switch's operation rate. Healthy "
+                      "operations raise it back up to its rate_limit. "
+                      "Like rate_limit, the rate is tracked per "
+                      "neutron-server worker."),
+    cfg.BoolOpt('topology_index',
+                default=False,
+                help="Keep the static segments of the networks in "
+                     "memory, updated from the network and segment "
+                     "callbacks, instead of reading them from the DB for "
+                     "every port operation."),
+    cfg.BoolOpt('revision_tracking',
+                default=False,
+                help="Remember the port revision last applied to every "
+                     "switch port and skip port operations for revisions "
+                     "that are already applied, such as retried callbacks. "
+                     "Revisions are tracked per neutron-server worker, "
+                     "enable switch_partitioning to have a single worker "
+                     "track a switch. Operations published to the desired "
+                     "state store are not tracked."),
+    cfg.IntOpt('ansible_worker_pool_size',
+               default=0,
+               min=0,
+               help="Number of worker processes per neutron-server worker "
+                    "running network-runner Ansible roles at once. Each "
+                    "role runs in a process of its own that only loads "
+                    "the inventory of its switch. 0 runs the roles in the "
+                    "neutron-server worker itself."),
+    cfg.IntOpt('device_thread_pool_size',
+               default=0,
+               min=0,
+               help="Number of native threads running device operations "
+                    "so that slow switches don't block the eventlet hub of "
+                    "the neutron-server worker. Switch lock waits are also "
+                    "done without blocking the hub when set. 0 runs device "
+                    "operations in the calling greenthread."),
+    cfg.BoolOpt('lazy_startup',
+                default=False,
+                help="Connect to the coordination backend and load the "
+                     "switch inventory in the background once the "
+                     "neutron-server worker started instead of while the "
+                     "driver is initialized. Operations needing them before "
+                     "the warm-up finished set them up on first use."),
 ]
 
 cfg.CONF.register_opts(anet_opts, group='ml2_ansible')
@@ -108,5 +292,41 @@ class Config(object):
                 if 'mac' in dev_cfg:
                     self.mac_map[dev_cfg['mac'].upper()] = dev_id
 
+        self.sriov_port_mappings = build_sriov_index(self.port_mappings)
+
         LOG.info('Ansible Host List: %s', ', '.join(self.inventory))
         LOG.debug('Ansible Port Mappings: %s', self.port_mappings)
+
+
+@functools.lru_cache(maxsize=PCI_SLOT_CACHE_SIZE)
+def parse_pci_slot(pci_slot):
+    """Return the PCI bus of a PCI slot as used in the port mappings
+
+    The PCI slot 0000:03:00.1 is mapped as {HOST_ID}-0300.
+
+    :param pci_slot: the pci_slot of a port's binding profile
+    :raises: PciSlotInvalidException if the PCI slot is missing or malformed
+    """
+    if not isinstance(pci_slot, str) or not PCI_SLOT_RE.match(pci_slot):
+        raise exceptions.PciSlotInvalidException(
+            'Invalid PCI slot {!r} in port binding profile'.format(pci_slot))
+    pci_bus = pci_slot.split('.')[0]
+    pci_bus = pci_bus.replace('0000:', '')
+    return pci_bus.replace(':', '')
+
+
+def build_sriov_index(port_mappings):
+    """Index the SR-IOV port mappings by host and PCI bus
+
+    SR-IOV mappings are keyed {HOST_ID}-{PCI_BUS}. Host names can contain
+    dashes too, every mapping whose key ends with a dash and a PCI bus as
+    returned by parse_pci_slot is indexed.
+
+    :returns: {(host_id, pci_bus): [(switch_name, port_name)]}
+    """
+    index = {}
+    for key, mappings in port_mappings.items():
+        host_id, sep, pci_bus = key.rpartition('-')
+        if sep and host_id and PCI_BUS_RE.match(pci_bus):
+            index[(host_id, pci_bus)] = mappings
+    return index
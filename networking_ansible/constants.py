@@ -28,8 +28,33 @@ SUPPORTED_OWNERS = (BAREMETAL_NONE, COMPUTE_NOVA)
 SUPPORTED_TYPES = (portbindings.VNIC_BAREMETAL,
                    portbindings.VNIC_NORMAL,
                    portbindings.VNIC_DIRECT)
+# port fields whose changes can require reconfiguring a switch, the
+# binding profile holds the local link information and the PCI slot
+SWITCH_RELEVANT_PORT_FIELDS = ('network_id',
+                               DEVICE_OWNER,
+                               portbindings.HOST_ID,
+                               portbindings.VNIC_TYPE,
+                               portbindings.VIF_TYPE,
+                               portbindings.PROFILE)
 
 # values that will be cast to Bool in the conf process
-BOOLEANS = ['manage_vlans', 'stp_edge']
+BOOLEANS = ['manage_vlans', 'stp_edge', 'adaptive_rate']
 # values that will be rolled into a separate dict and passed to network_runner
 EXTRA_PARAMS = ['stp_edge']
+# inventory key selecting the device backend of a switch
+BACKEND = 'backend'
+DEFAULT_BACKEND = 'network_runner'
+BACKEND_NAMESPACE = 'networking_ansible.backends'
+# inventory key naming the physical network of a switch, ports on overlay
+# networks get a dynamic VLAN segment of that physical network on the switch
+SWITCH_PHYSNET = 'physnet'
+OVERLAY_NETWORK_TYPES = ('vxlan', 'geneve')
+# inventory key setting the seconds the switch queue waits for more
+# operations to join a commit of the switch
+COMMIT_WINDOW = 'commit_window'
+
+# priority classes of queued switch operations, lower values run first
+PRIORITY_BIND = 0
+PRIORITY_UPDATE = 1
+PRIORITY_DELETE = 2
+PRIORITY_BACKGROUND = 3
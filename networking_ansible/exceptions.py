@@ -30,3 +30,43 @@ class LocalLinkInfoMissingException(exceptions.NeutronException):
 
     def __init__(self, message):
         super(LocalLinkInfoMissingException, self).__init__(stdout=message)
+
+
+class DeviceCommandException(exceptions.NeutronException):
+    message = _('%(stdout)s')
+
+    def __init__(self, message):
+        super(DeviceCommandException, self).__init__(stdout=message)
+
+
+class BulkVlanException(DeviceCommandException):
+    """Some VLANs of a bulk VLAN operation failed
+
+    :param errors: {vlan_id: exception} of the failed VLANs
+    """
+
+    def __init__(self, message, errors):
+        super(BulkVlanException, self).__init__(message)
+        self.errors = errors
+
+
+class PciSlotInvalidException(exceptions.NeutronException):
+    message = _('%(stdout)s')
+
+    def __init__(self, message):
+        super(PciSlotInvalidException, self).__init__(stdout=message)
+
+
+class CoordinationProxyException(exceptions.NeutronException):
+    message = _('%(stdout)s')
+
+    def __init__(self, message):
+        super(CoordinationProxyException, self).__init__(stdout=message)
+
+
+class DeadlineExceededException(exceptions.NeutronException):
+    """A lock, device or hook timeout expired"""
+    message = _('%(stdout)s')
+
+    def __init__(self, message):
+        super(DeadlineExceededException, self).__init__(stdout=message)
@@ -0,0 +1,305 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import itertools
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+from neutron_lib._i18n import _
+from oslo_log import log as logging
+
+from networking_ansible import config
+from networking_ansible import exceptions
+
+LOG = logging.getLogger(__name__)
+CONF = config.CONF
+
+# a distributed lock is handed from one local worker to the next at most
+# this many times in a row before it is given back to the backend, so the
+# other controllers get their turn
+MAX_LOCAL_HANDOVERS = 16
+
+
+class _LockState(object):
+    def __init__(self):
+        # the connection holding the lock on this controller
+        self.holder = None
+        self.waiters = 0
+        self.handovers = 0
+        # the backend lock while this controller holds it
+        self.distributed = None
+
+
+class LockTable(object):
+    """Locks of one controller on top of the coordination backend
+
+    Workers of the controller wait for a lock locally first. The first one
+    takes the backend lock, which is then handed directly to the next local
+    waiter on release instead of being given back to the backend, up to
+    MAX_LOCAL_HANDOVERS times in a row.
+    """
+
+    def __init__(self, coordinator):
+        self.coordinator = coordinator
+        # {lock name: _LockState}
+        self._locks = {}
+        self._cond = threading.Condition()
+
+    def acquire(self, name, owner, blocking=True):
+        """Acquire a lock for a connection
+
+        :param blocking: wait for the lock, or the seconds to wait for it
+        """
+        deadline = None
+        if blocking is not True and blocking is not False:
+            deadline = time.monotonic() + blocking
+        with self._cond:
+            state = self._locks.setdefault(name, _LockState())
+            if state.holder is not None and not blocking:
+                return False
+            state.waiters += 1
+            try:
+                while state.holder is not None:
+                    if deadline is None:
+                        self._cond.wait()
+                        continue
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        break
+                    self._cond.wait(left)
+            finally:
+                state.waiters -= 1
+            # timed out, the lock is still held
+            if state.holder is not None:
+                return False
+            state.holder = owner
+
+        # only the holder touches the backend lock
+        if state.distributed is None:
+            if deadline is not None:
+                blocking = max(deadline - time.monotonic(), 0)
+            lock = self.coordinator.get_lock(name)
+            try:
+                acquired = lock.acquire(blocking=blocking)
+            except Exception:
+                self._release_local(name, state)
+                raise
+            if not acquired:
+                self._release_local(name, state)
+                return False
+            state.distributed = lock
+            state.handovers = 0
+        return True
+
+    def release(self, name, owner):
+        with self._cond:
+            state = self._locks.get(name)
+            if state is None or state.holder != owner:
+                return False
+            state.holder = None
+            distributed = None
+            if state.waiters and state.handovers < MAX_LOCAL_HANDOVERS:
+                state.handovers += 1
+            else:
+                distributed = state.distributed
+                state.distributed = None
+                if not state.waiters:
+                    del self._locks[name]
+            self._cond.notify_all()
+
+        if distributed is not None:
+            distributed.release()
+        return True
+
+    def release_all(self, owner):
+        """Release the locks of a connection that went away"""
+        with self._cond:
+            names = [name for name, state in self._locks.items()
+                     if state.holder == owner]
+        for name in names:
+            LOG.warning('Releasing lock {} of a disconnected '
+                        'worker'.format(name))
+            self.release(name, owner)
+
+    def _release_local(self, name, state):
+        with self._cond:
+            state.holder = None
+            if not state.waiters and self._locks.get(name) is state:
+                del self._locks[name]
+            self._cond.notify_all()
+
+
+class _ProxyRequestHandler(socketserver.StreamRequestHandler):
+    """Serve the lock requests of one worker connection
+
+    Requests and replies are JSON documents, one per line.
+    """
+
+    def setup(self):
+        super(_ProxyRequestHandler, self).setup()
+        self.owner = next(self.server.owners)
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode('utf-8'))
+                reply = {'result': self._dispatch(request)}
+            except Exception as e:
+                LOG.error('Failed to serve coordination proxy request, '
+                          'reason: {}'.format(e))
+                reply = {'error': str(e)}
+            self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+    def finish(self):
+        try:
+            super(_ProxyRequestHandler, self).finish()
+        finally:
+            self.server.locks.release_all(self.owner)
+
+    def _dispatch(self, request):
+        if request['op'] == 'acquire':
+            return self.server.locks.acquire(request['name'], self.owner,
+                                             request.get('blocking', True))
+        if request['op'] == 'release':
+            return self.server.locks.release(request['name'], self.owner)
+        raise ValueError(_('Unknown operation {}').format(request['op']))
+
+
+class CoordinationProxy(socketserver.ThreadingMixIn,
+                        socketserver.UnixStreamServer):
+    """Grant the switch locks to the workers of a controller
+
+    The proxy holds the only coordination backend session of the
+    controller, the workers request locks over a Unix socket. A lock held
+    by a worker whose connection goes away is released.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, coordinator, socket_path):
+        self.locks = LockTable(coordinator)
+        self.owners = itertools.count()
+        # a socket left behind by a previous run prevents the bind
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        socketserver.UnixStreamServer.__init__(self, socket_path,
+                                               _ProxyRequestHandler)
+        os.chmod(socket_path, 0o660)
+
+
+class ProxyLock(object):
+    """Lock granted by the coordination proxy
+
+    Every acquisition uses its own connection so a worker dying while
+    holding the lock releases it.
+    """
+
+    def __init__(self, socket_path, name):
+        self.socket_path = socket_path
+        self.name = name
+        self._sock = None
+        self._rfile = None
+
+    def _call(self, op, **kwargs):
+        request = dict(kwargs, op=op, name=self.name)
+        self._sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        line = self._rfile.readline()
+        if not line:
+            raise exceptions.CoordinationProxyException(
+                'Coordination proxy closed the connection')
+        reply = json.loads(line.decode('utf-8'))
+        if 'error' in reply:
+            raise exceptions.CoordinationProxyException(reply['error'])
+        return reply['result']
+
+    def _close(self):
+        self._rfile.close()
+        self._sock.close()
+        self._sock = None
+        self._rfile = None
+
+    def acquire(self, blocking=True):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except socket.error as e:
+            sock.close()
+            raise exceptions.CoordinationProxyException(
+                'Failed to connect to the coordination proxy at {}: '
+                '{}'.format(self.socket_path, e))
+        self._sock = sock
+        self._rfile = sock.makefile('rb')
+        try:
+            acquired = self._call('acquire', blocking=blocking)
+        except Exception:
+            self._close()
+            raise
+        if not acquired:
+            self._close()
+        return acquired
+
+    def release(self):
+        try:
+            return self._call('release')
+        finally:
+            self._close()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class ProxyClient(object):
+    """Hand out the locks of the local coordination proxy"""
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+
+    def get_lock(self, name):
+        return ProxyLock(self.socket_path, name)
+
+
+def main():
+    # imported here, the driver itself doesn't depend on them being set up
+    from neutron.common import config as common_config
+    from tooz import coordination
+
+    common_config.init(sys.argv[1:])
+    common_config.setup_logging()
+    socket_path = CONF.ml2_ansible.coordination_proxy_socket
+    if not socket_path:
+        sys.exit('[ml2_ansible] coordination_proxy_socket is not set')
+
+    member_id = '{}-proxy'.format(CONF.host)
+    coordinator = coordination.get_coordinator(
+        CONF.ml2_ansible.coordination_uri, member_id)
+    coordinator.start(start_heart=True)
+    server = CoordinationProxy(coordinator, socket_path)
+    LOG.info('Ansible ML2 coordination proxy listening on {}'.format(
+        socket_path))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        coordinator.stop()
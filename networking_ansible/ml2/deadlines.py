@@ -0,0 +1,113 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import contextlib
+import functools
+import threading
+import time
+
+from oslo_log import log as logging
+
+from networking_ansible import config
+from networking_ansible import exceptions
+
+LOG = logging.getLogger(__name__)
+CONF = config.CONF
+
+_local = threading.local()
+
+
+def deadline():
+    """Return the deadline of the current thread, time.monotonic() based"""
+    return getattr(_local, 'deadline', None)
+
+
+@contextlib.contextmanager
+def until(when):
+    """Run the operations within against a deadline
+
+    A deadline already set for the thread is only ever shortened, so a
+    hook called from another hook keeps the budget of the outer one.
+    """
+    previous = deadline()
+    if when is not None and (previous is None or when < previous):
+        _local.deadline = when
+    try:
+        yield
+    finally:
+        _local.deadline = previous
+
+
+def budget(seconds):
+    """Run the operations within against a budget of seconds, if any"""
+    return until(time.monotonic() + seconds if seconds else None)
+
+
+def hook(func):
+    """Run a driver hook within the [ml2_ansible] hook_timeout budget"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with budget(CONF.ml2_ansible.hook_timeout):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def timeout(limit=None, what='the operation'):
+    """Return the seconds an operation may wait
+
+    :param limit: the timeout of the operation itself, if any
+    :returns: the smaller of limit and the time left until the deadline of
+              the thread, None when there is neither
+    :raises: DeadlineExceededException when the deadline passed already
+    """
+    when = deadline()
+    if when is None:
+        return limit or None
+    left = when - time.monotonic()
+    if left <= 0:
+        raise exceptions.DeadlineExceededException(
+            'Hook budget of {budget} seconds exhausted before '
+            '{what}'.format(budget=CONF.ml2_ansible.hook_timeout, what=what))
+    return min(left, limit) if limit else left
+
+
+class TimedLock(object):
+    """Switch lock acquired within the lock timeout and the deadline
+
+    :param lock: the lock, its acquire() taking the seconds to wait as
+                 blocking argument like the tooz locks
+    :param limit: seconds to wait for the lock, 0 or None waits as long as
+                  the deadline of the thread allows
+    """
+
+    def __init__(self, lock, limit, switch_name):
+        self._lock = lock
+        self.limit = limit
+        self.switch_name = switch_name
+
+    def __enter__(self):
+        what = 'acquiring the lock of switch {}'.format(self.switch_name)
+        seconds = timeout(self.limit, what)
+        if seconds is None:
+            self._lock.acquire(blocking=True)
+            return self
+        if not self._lock.acquire(blocking=seconds):
+            raise exceptions.DeadlineExceededException(
+                'Timed out after {seconds:.1f} seconds {what}'.format(
+                    seconds=seconds, what=what))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._lock.release()
@@ -0,0 +1,300 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import base64
+import collections
+import json
+import threading
+import time
+from urllib import parse
+
+from neutron_lib._i18n import _
+from oslo_log import log as logging
+from oslo_service import loopingcall
+from oslo_utils import importutils
+
+from networking_ansible import constants as c
+
+etcd3gw = importutils.try_import('etcd3gw')
+
+LOG = logging.getLogger(__name__)
+
+PREFIX = '/networking-ansible/'
+DESIRED_PREFIX = PREFIX + 'desired/'
+APPLIED_PREFIX = PREFIX + 'applied/'
+# a broken watch is set up again after this many seconds
+WATCH_RETRY_INTERVAL = 5
+
+# the switch object an operation configures, a later operation on the same
+# object replaces the desired state of an earlier one
+_OBJECTS = {
+    'create_vlan': lambda args: 'vlan/{}'.format(args[0]),
+    'delete_vlan': lambda args: 'vlan/{}'.format(args[0]),
+    'conf_access_port': lambda args: 'port/{}'.format(args[0]),
+    'conf_trunk_port': lambda args: 'port/{}'.format(args[0]),
+    'delete_port': lambda args: 'port/{}'.format(args[0]),
+    'add_trunk_vlan': lambda args: 'trunk_vlan/{}/{}'.format(args[1],
+                                                             args[0]),
+    'delete_trunk_vlan': lambda args: 'trunk_vlan/{}/{}'.format(args[1],
+                                                                args[0]),
+}
+
+# bulk operations are published as the operation of each of their objects
+_BULK = {
+    'create_vlans': 'create_vlan',
+    'delete_vlans': 'delete_vlan',
+}
+
+# operations removing their object, once applied the object has no desired
+# state left to keep
+_REMOVALS = ('delete_vlan', 'delete_port', 'delete_trunk_vlan')
+
+_Entry = collections.namedtuple('_Entry',
+                                'revision key operation args')
+
+
+def _to_str(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+def _b64(value):
+    return base64.b64encode(value.encode('utf-8')).decode('utf-8')
+
+
+class DesiredStateStore(object):
+    """Desired state of the switches kept in etcd
+
+    Every switch object, a VLAN, a switch port or a VLAN trunked on a
+    switch port, has a key under ``desired/<switch>/`` holding the device
+    operation that brings it to its desired state. Removing an object is
+    desired state too, its key is deleted once the removal was applied. The
+    etcd revision of a key is its version, the revision last applied to a
+    switch is kept under ``applied/<switch>``.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def from_uri(cls, uri):
+        if not etcd3gw:
+            raise ImportError(_('The desired state store requires '
+                                'etcd3gw'))
+        url = parse.urlparse(uri)
+        return cls(etcd3gw.client(host=url.hostname,
+                                  port=url.port or 2379,
+                                  protocol=url.scheme or 'http'))
+
+    @staticmethod
+    def _switch_prefix(switch_name):
+        return '{}{}/'.format(DESIRED_PREFIX, switch_name)
+
+    def publish(self, switch_name, operation, *args):
+        """Record a device operation as the desired state of its object"""
+        if operation in _BULK:
+            for vlan_id in args[0]:
+                self.publish(switch_name, _BULK[operation], vlan_id,
+                             *args[1:])
+            return
+        key = self._switch_prefix(switch_name) + _OBJECTS[operation](args)
+        self.client.put(key, json.dumps({'operation': operation,
+                                         'args': list(args)}))
+
+    def desired(self, switch_name):
+        """Return the desired state of a switch in revision order"""
+        return sorted(self._entry(value, meta) for value, meta in
+                      self.client.get_prefix(self._switch_prefix(switch_name)))
+
+    def applied_revision(self, switch_name):
+        values = self.client.get(APPLIED_PREFIX + switch_name)
+        return int(values[0]) if values else 0
+
+    def record_applied(self, switch_name, revision):
+        self.client.put(APPLIED_PREFIX + switch_name, str(revision))
+
+    def compact(self, entries):
+        """Delete the keys of applied removals
+
+        A key is only deleted while it still holds the applied revision, a
+        newer desired state published meanwhile is kept.
+        """
+        for entry in entries:
+            if entry.operation not in _REMOVALS:
+                continue
+            key = _b64(entry.key)
+            self.client.transaction({
+                'compare': [{'key': key,
+                             'result': 'EQUAL',
+                             'target': 'MOD',
+                             'mod_revision': entry.revision}],
+                'success': [{'request_delete_range': {'key': key}}],
+                'failure': []})
+
+    def watch(self):
+        """Watch every switch's desired state
+
+        :returns: an iterator of (switch_name, entry) and a function
+                  cancelling the watch
+        """
+        events, cancel = self.client.watch_prefix(DESIRED_PREFIX)
+
+        def changes():
+            for event in events:
+                # keys of applied removals are deleted by the converger
+                if event.get('type') == 'DELETE':
+                    continue
+                entry = self._entry(event['kv']['value'], event['kv'])
+                switch_name = entry.key[len(DESIRED_PREFIX):].split('/')[0]
+                yield switch_name, entry
+
+        return changes(), cancel
+
+    @staticmethod
+    def _entry(value, meta):
+        state = json.loads(_to_str(value))
+        return _Entry(int(meta['mod_revision']), _to_str(meta['key']),
+                      state['operation'], tuple(state['args']))
+
+
+class SwitchConverger(object):
+    """Converge the switches to their desired state
+
+    Every worker watches the desired state of all the switches and applies
+    the changes of the switches it owns with switch partitioning. Changes
+    are applied under the switch lock, in revision order, and only when
+    they are newer than the revision already applied to the switch. The
+    applied revision doesn't move past a change that failed, the change and
+    the ones after it are applied again by the next resync.
+
+    A periodic resync applies the changes missed while no worker was
+    watching and retries the ones that failed.
+    """
+
+    def __init__(self, driver, store, resync_interval):
+        self.driver = driver
+        self.store = store
+        self.resync_interval = resync_interval
+        # switches whose last convergence stopped at a failed change
+        self._behind = set()
+        self._cancel = None
+        self._stopped = False
+        self._loop = None
+
+    def start(self):
+        self._stopped = False
+        thread = threading.Thread(target=self._watch,
+                                  name='desired-state-watch')
+        thread.daemon = True
+        thread.start()
+        self._loop = loopingcall.FixedIntervalLoopingCall(self.resync)
+        self._loop.start(interval=self.resync_interval,
+                         initial_delay=self.resync_interval,
+                         stop_on_exception=False)
+        LOG.debug('Desired state converger started with a resync interval '
+                  'of %s seconds', self.resync_interval)
+
+    def stop(self):
+        self._stopped = True
+        if self._loop:
+            self._loop.stop()
+            self._loop = None
+        if self._cancel:
+            self._cancel()
+            self._cancel = None
+
+    def _watch(self):
+        while not self._stopped:
+            try:
+                changes, self._cancel = self.store.watch()
+                # changes made before the watch started are picked up by
+                # a resync
+                self.resync()
+                for switch_name, entry in changes:
+                    # applying only the new change to a switch behind a
+                    # failed one would move past the failed change
+                    if switch_name in self._behind:
+                        self.converge(switch_name,
+                                      self.store.desired(switch_name))
+                    else:
+                        self.converge(switch_name, [entry])
+            except Exception as e:
+                LOG.error('Desired state watch failed, reason: '
+                          '{}'.format(e))
+            if not self._stopped:
+                time.sleep(WATCH_RETRY_INTERVAL)
+
+    def resync(self):
+        for switch_name in self.driver.ml2config.inventory:
+            try:
+                self.converge(switch_name, self.store.desired(switch_name))
+            except Exception as e:
+                LOG.error('Failed to resync switch {switch_name}, reason: '
+                          '{err}'.format(switch_name=switch_name, err=e))
+
+    def converge(self, switch_name, entries):
+        """Apply the desired state entries not yet applied to a switch"""
+        if switch_name not in self.driver.ml2config.inventory:
+            return
+        partitioner = self.driver.partitioner
+        if partitioner is None or not partitioner.owns(switch_name):
+            return
+        if self.driver._run_switch_locked(switch_name,
+                                          self._converge_locked,
+                                          switch_name, entries,
+                                          priority=c.PRIORITY_BACKGROUND):
+            self._behind.discard(switch_name)
+        else:
+            self._behind.add(switch_name)
+
+    def _converge_locked(self, switch_name, entries):
+        """Apply entries in revision order up to the first failure
+
+        :returns: whether every entry was applied
+        """
+        applied = self.store.applied_revision(switch_name)
+        last = applied
+        done = []
+        for entry in sorted(entries):
+            if entry.revision <= applied:
+                continue
+            try:
+                self.driver._run_device_call(switch_name, entry.operation,
+                                             *entry.args)
+                LOG.debug('Applied {op} {args} on switch {switch_name} at '
+                          'revision {rev}'.format(op=entry.operation,
+                                                  args=list(entry.args),
+                                                  switch_name=switch_name,
+                                                  rev=entry.revision))
+            except Exception as e:
+                # later changes may depend on this one, they are all
+                # retried by the next resync unless it is replaced before
+                LOG.error('Failed to apply {op} {args} on switch '
+                          '{switch_name}, reason: {err}'.format(
+                              op=entry.operation,
+                              args=list(entry.args),
+                              switch_name=switch_name,
+                              err=e))
+                converged = False
+                break
+            last = entry.revision
+            done.append(entry)
+        else:
+            converged = True
+        if last > applied:
+            self.store.record_applied(switch_name, last)
+            self.store.compact(done)
+        return converged
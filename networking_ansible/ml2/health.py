@@ -0,0 +1,142 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from concurrent import futures
+import socket
+import threading
+import time
+
+from oslo_log import log as logging
+from oslo_service import loopingcall
+
+from networking_ansible import constants as c
+
+LOG = logging.getLogger(__name__)
+
+# a switch is unhealthy after this many failed probes in a row
+FAILURE_THRESHOLD = 2
+# switches probed at the same time
+MAX_PROBES = 32
+# backends configuring a local bridge, there is nothing to reach
+LOCAL_BACKENDS = ('ovs',)
+
+
+class SwitchState(object):
+    def __init__(self):
+        self.healthy = True
+        self.failures = 0
+        self.latency = None
+        self.checked_at = None
+        self.error = None
+
+
+class SwitchHealth(object):
+    """Reachability of the switches probed in the background
+
+    Every interval, a TCP connection is opened to the management address
+    of every switch, ansible_host and ansible_port of its section, and the
+    SSH banner is read. A switch becomes unhealthy after FAILURE_THRESHOLD
+    failed probes in a row and healthy again on the first successful one.
+    Switches not probed yet are considered healthy.
+    """
+
+    def __init__(self, inventory, interval, timeout):
+        self.interval = interval
+        self.timeout = timeout
+        self._targets = {}
+        for switch_name, switch in inventory.items():
+            if switch.get(c.BACKEND) in LOCAL_BACKENDS:
+                continue
+            self._targets[switch_name] = (
+                switch.get('ansible_host', switch_name),
+                int(switch.get('ansible_port', 22)))
+        self._states = {name: SwitchState() for name in self._targets}
+        self._lock = threading.Lock()
+        self._loop = None
+
+    def start(self):
+        self._loop = loopingcall.FixedIntervalLoopingCall(self.probe_all)
+        self._loop.start(interval=self.interval, stop_on_exception=False)
+        LOG.debug('Switch health prober started with an interval of %s '
+                  'seconds', self.interval)
+
+    def stop(self):
+        if self._loop:
+            self._loop.stop()
+            self._loop = None
+
+    def is_healthy(self, switch_name):
+        with self._lock:
+            state = self._states.get(switch_name)
+            return state is None or state.healthy
+
+    def state(self, switch_name):
+        """Return the health, latency and last error of a switch"""
+        with self._lock:
+            state = self._states.get(switch_name)
+            if state is None:
+                return None
+            return {'healthy': state.healthy,
+                    'latency': state.latency,
+                    'checked_at': state.checked_at,
+                    'error': state.error}
+
+    def probe_all(self):
+        if not self._targets:
+            return
+        workers = min(MAX_PROBES, len(self._targets))
+        with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for switch_name in self._targets:
+                executor.submit(self.probe, switch_name)
+
+    def probe(self, switch_name):
+        host, port = self._targets[switch_name]
+        start = time.monotonic()
+        try:
+            with socket.create_connection((host, port),
+                                          timeout=self.timeout) as sock:
+                # a switch whose SSH daemon hangs accepts connections
+                # without sending its banner
+                if not sock.recv(256):
+                    raise socket.error('connection closed before the SSH '
+                                       'banner')
+        except socket.error as e:
+            self._record(switch_name, error=str(e) or type(e).__name__)
+            return False
+        self._record(switch_name, latency=time.monotonic() - start)
+        return True
+
+    def _record(self, switch_name, latency=None, error=None):
+        with self._lock:
+            state = self._states[switch_name]
+            was_healthy = state.healthy
+            state.checked_at = time.time()
+            state.error = error
+            if error is None:
+                state.failures = 0
+                state.latency = latency
+                state.healthy = True
+            else:
+                state.failures += 1
+                state.latency = None
+                if state.failures >= FAILURE_THRESHOLD:
+                    state.healthy = False
+            healthy = state.healthy
+        if healthy and not was_healthy:
+            LOG.info('Switch {} is reachable again'.format(switch_name))
+        elif was_healthy and not healthy:
+            LOG.warning('Switch {switch_name} is unreachable, its operations '
+                        'fail until it answers again: {err}'.format(
+                            switch_name=switch_name, err=error))
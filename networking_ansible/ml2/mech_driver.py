@@ -14,32 +14,58 @@
 #    under the License.
 
 
+import collections
+from concurrent import futures
+import contextlib
+import functools
 import os
+import threading
 
 from neutron.db import provisioning_blocks
 from neutron.objects.network import Network
 from neutron.objects.network import NetworkSegment
 from neutron.objects.ports import Port
+from neutron.objects.ports import PortBindingLevel
 from neutron.objects.trunk import Trunk
 from neutron.plugins.ml2.common import exceptions as ml2_exc
 from neutron_lib.api.definitions import portbindings
 from neutron_lib.api.definitions import provider_net
+from neutron_lib.callbacks import events
+from neutron_lib.callbacks import registry
 from neutron_lib.callbacks import resources
 from neutron_lib.plugins.ml2 import api as ml2api
 from oslo_config import cfg
 from oslo_log import log as logging
+import oslo_messaging
 
+from networking_ansible.backends import manager as backend_manager
 from networking_ansible import config
 from networking_ansible import constants as c
 from networking_ansible import exceptions
+from networking_ansible.ml2 import coordination_proxy
+from networking_ansible.ml2 import deadlines
+from networking_ansible.ml2 import desired_state
+from networking_ansible.ml2 import health
+from networking_ansible.ml2 import object_cache
+from networking_ansible.ml2 import partitioner
+from networking_ansible.ml2 import provisioning
+from networking_ansible.ml2 import revisions
+from networking_ansible.ml2 import rpc
+from networking_ansible.ml2 import switch_queue
+from networking_ansible.ml2 import thread_pool
+from networking_ansible.ml2 import throttle
+from networking_ansible.ml2 import topology
 from networking_ansible.ml2 import trunk_driver
+from networking_ansible.ml2 import vlan_batch
+from networking_ansible.ml2 import vlan_gc
 
-from network_runner import api as net_runr_api
-from network_runner.models.inventory import Inventory
 
 from tooz import coordination
 
 LOG = logging.getLogger(__name__)
+
+# marks a port that was not read before taking the switch lock
+_NOT_PREFETCHED = object()
 CONF = config.CONF
 
 
@@ -55,11 +81,18 @@ class AnsibleMechanismDriver(ml2api.MechanismDriver):
         # Get ML2 config
         self.ml2config = config.Config()
 
-        # Build a network runner inventory object
-        # and instatiate network runner
-        _inv = Inventory()
-        _inv.deserialize({'all': {'hosts': self.ml2config.inventory}})
-        self.net_runr = net_runr_api.NetworkRunner(_inv)
+        # the backends and the coordinator are set up on first use
+        self._backends_ready = False
+        self._coordinator = None
+        self._coordinator_pid = None
+        self._startup_lock = threading.Lock()
+
+        # switch locks are either taken through the coordination proxy of
+        # the controller or from this worker's own coordinator
+        self.coordination_proxy = None
+        if CONF.ml2_ansible.coordination_proxy_socket:
+            self.coordination_proxy = coordination_proxy.ProxyClient(
+                CONF.ml2_ansible.coordination_proxy_socket)
 
         # build the custom params and extra params dict.
         # this holds kwargs per host to pass to network runner
@@ -73,19 +106,362 @@ class AnsibleMechanismDriver(ml2api.MechanismDriver):
                         key = key[len(c.CUSTOM_PARAM_PREFIX):]
                     self.kwargs[host_name][key] = val
 
-        self.coordinator = coordination.get_coordinator(
-            cfg.CONF.ml2_ansible.coordination_uri,
-            '{}-{}'.format(CONF.host, os.getpid()))
+        # the backends pushing the configuration to the switches
+        self.backends = backend_manager.BackendManager(
+            self.ml2config.inventory)
+
+        # device operations are rate limited per switch when the switch's
+        # section sets a rate_limit
+        self.throttles = throttle.Throttles(
+            self.ml2config.inventory,
+            CONF.ml2_ansible.adaptive_rate_latency_threshold)
+
+        # device operations and switch lock waits can be kept off the
+        # eventlet hub
+        self.device_pool = None
+        if CONF.ml2_ansible.device_thread_pool_size:
+            self.device_pool = thread_pool.DeviceThreadPool(
+                CONF.ml2_ansible.device_thread_pool_size)
+
+        if CONF.ml2_ansible.device_timeout and \
+                not CONF.ml2_ansible.ansible_worker_pool_size:
+            LOG.warning('Ignoring device_timeout without '
+                        'ansible_worker_pool_size, the Ansible roles running '
+                        'in the neutron-server worker cannot be killed')
+
+        # the connections are either set up right away or warmed up in the
+        # background once the worker started
+        if CONF.ml2_ansible.lazy_startup:
+            registry.subscribe(self._warm_up,
+                               resources.PROCESS,
+                               events.AFTER_INIT)
+        else:
+            # the coordinator is only needed for partitioning when the
+            # switch locks come from the proxy
+            if not self.coordination_proxy:
+                self._start_coordinator()
+            self._warm_up_backends()
+
+        # operations on a switch are either serialized by the switch lock
+        # alone or queued to a per switch actor taking the lock per batch
+        self.switch_queues = None
+        if CONF.ml2_ansible.switch_queues:
+            self.switch_queues = switch_queue.SwitchQueues(
+                self._get_timed_switch_lock,
+                CONF.ml2_ansible.switch_queue_batch_size,
+                CONF.ml2_ansible.switch_queue_aging_interval,
+                self._get_committer)
+        # device operations of the switches aggregating commits are staged
+        # by the switch queue
+        self._staged = threading.local()
+        if not self.switch_queues:
+            for switch_name, switch in self.ml2config.inventory.items():
+                if switch.get(c.COMMIT_WINDOW):
+                    LOG.warning('Ignoring commit_window on switch {} '
+                                'without switch_queues'.format(switch_name))
+
+        # switches are partitioned across the workers once they are forked
+        self.partitioner = None
+        self.switch_rpc = None
+        if CONF.ml2_ansible.switch_partitioning:
+            registry.subscribe(self._start_partitioning,
+                               resources.PROCESS,
+                               events.AFTER_INIT)
+
+        # VLANs of deleted networks are either removed right away or
+        # collected periodically in one batch per switch
+        self.vlan_gc = None
+        if CONF.ml2_ansible.vlan_gc_interval:
+            self.vlan_gc = vlan_gc.VlanGarbageCollector(
+                self,
+                CONF.ml2_ansible.vlan_gc_interval,
+                CONF.ml2_ansible.vlan_gc_grace_period)
+            # a looping call started before the workers are forked doesn't
+            # survive in them
+            registry.subscribe(self._start_vlan_gc,
+                               resources.PROCESS,
+                               events.AFTER_INIT)
+
+        # device operations are either run right away or published as the
+        # desired state of the switches and applied by the converger
+        self.desired_state = None
+        self.converger = None
+        if CONF.ml2_ansible.desired_state_uri and \
+                not CONF.ml2_ansible.switch_partitioning:
+            LOG.warning('Ignoring desired_state_uri without '
+                        'switch_partitioning, every worker would converge '
+                        'every switch')
+        elif CONF.ml2_ansible.desired_state_uri:
+            self.desired_state = desired_state.DesiredStateStore.from_uri(
+                CONF.ml2_ansible.desired_state_uri)
+            registry.subscribe(self._start_converger,
+                               resources.PROCESS,
+                               events.AFTER_INIT)
+
+        # the VLANs of networks changed around the same time are created
+        # and deleted in bulk
+        self.vlan_batcher = None
+        if CONF.ml2_ansible.vlan_batch_window:
+            self.vlan_batcher = vlan_batch.VlanBatcher(
+                self, CONF.ml2_ansible.vlan_batch_window)
+
+        # the provisioning blocks of bound ports are either completed right
+        # away or in batches
+        self.provisioning = None
+        if CONF.ml2_ansible.provisioning_batch_window:
+            self.provisioning = provisioning.ProvisioningBatcher(
+                CONF.ml2_ansible.provisioning_batch_window)
+
+        # operations on switches the prober can't reach fail right away
+        self.switch_health = None
+        if CONF.ml2_ansible.switch_health_interval:
+            self.switch_health = health.SwitchHealth(
+                self.ml2config.inventory,
+                CONF.ml2_ansible.switch_health_interval,
+                CONF.ml2_ansible.switch_health_timeout)
+            registry.subscribe(self._start_health_prober,
+                               resources.PROCESS,
+                               events.AFTER_INIT)
+
+        # port revisions already applied to the switch ports are skipped
+        self.revisions = None
+        if CONF.ml2_ansible.revision_tracking:
+            self.revisions = revisions.AppliedRevisions()
+
+        # the segments of the networks are kept in memory
+        self.topology = None
+        if CONF.ml2_ansible.topology_index:
+            self.topology = topology.TopologyIndex()
+            self.topology.subscribe()
+
+        self.trunk_driver = trunk_driver.NetAnsibleTrunkDriver.create(self)
+
+    @property
+    def coordinator(self):
+        if self._coordinator is None:
+            with self._startup_lock:
+                if self._coordinator is None:
+                    self._start_coordinator()
+        return self._coordinator
+
+    def is_ready(self):
+        """Return whether the coordinator and the backends are set up"""
+        if self.coordination_proxy is None and self._coordinator is None:
+            return False
+        return self._backends_ready
+
+    def _set_up(self):
+        """Set up the coordinator and the backends if they aren't yet"""
+        if not self.coordination_proxy:
+            self.coordinator
+        if not self._backends_ready:
+            self._warm_up_backends()
+
+    def _warm_up_backends(self):
+        with self._startup_lock:
+            if not self._backends_ready:
+                self.backends.warm_up()
+                self._backends_ready = True
+
+    def _start_coordinator(self):
+        member_id = '{}-{}'.format(CONF.host, os.getpid())
+        coordinator = coordination.get_coordinator(
+            cfg.CONF.ml2_ansible.coordination_uri, member_id)
 
         # the heartbeat will have the default timeout of 30 seconds
         # that can be changed per-driver. Both Redis and etcd drivers
         # use 30 second timeouts.
-        self.coordinator.start(start_heart=True)
+        coordinator.start(start_heart=True)
+        self.member_id = member_id
+        self._coordinator_pid = os.getpid()
+        self._coordinator = coordinator
         LOG.debug("Ansible ML2 coordination started via uri %s",
                   cfg.CONF.ml2_ansible.coordination_uri)
 
-        self.trunk_driver = trunk_driver.NetAnsibleTrunkDriver.create(self)
+    def _warm_up(self, resource, event, trigger, payload=None):
+        if self.is_ready():
+            return
+        thread = threading.Thread(target=self._warm_up_connections,
+                                  name='ansible-ml2-warm-up')
+        thread.daemon = True
+        thread.start()
+
+    def _warm_up_connections(self):
+        try:
+            self._set_up()
+        except Exception as e:
+            # the next operation needing them tries again
+            LOG.warning('Failed to warm up the Ansible ML2 driver, '
+                        'reason: {}'.format(e))
+            return
+        LOG.info('Ansible ML2 driver ready')
+
+    def _start_partitioning(self, resource, event, trigger, payload=None):
+        # every worker needs its own group member, a coordinator inherited
+        # from the parent process would share the parent's member id
+        with self._startup_lock:
+            if self._coordinator_pid != os.getpid():
+                self._start_coordinator()
+
+        self.partitioner = partitioner.SwitchPartitioner(
+            self.coordinator,
+            self.member_id,
+            CONF.ml2_ansible.partition_refresh_interval)
+        self.partitioner.start()
+        self._rpc_conn = rpc.start_server(self, self.partitioner.member_id)
+        self.switch_rpc = rpc.SwitchOpsRpcApi()
+
+    def _start_vlan_gc(self, resource, event, trigger, payload=None):
+        self.vlan_gc.start()
+
+    def _start_converger(self, resource, event, trigger, payload=None):
+        self.converger = desired_state.SwitchConverger(
+            self, self.desired_state,
+            CONF.ml2_ansible.desired_state_resync_interval)
+        self.converger.start()
+
+    def _start_health_prober(self, resource, event, trigger, payload=None):
+        self.switch_health.start()
+
+    def _check_switch_health(self, switch_name):
+        if self.switch_health and \
+                not self.switch_health.is_healthy(switch_name):
+            state = self.switch_health.state(switch_name)
+            raise exceptions.NetworkingAnsibleMechException(
+                'Switch {switch_name} is unreachable: {err}'.format(
+                    switch_name=switch_name, err=state['error']))
+
+    def _switch_owner(self, switch_name):
+        """Return the member owning a switch if it is not this worker"""
+        if not self.partitioner or self.partitioner.owns(switch_name):
+            return None
+        return self.partitioner.owner(switch_name)
+
+    def _switch_locked(self, switch_name, func, *args,
+                       priority=c.PRIORITY_UPDATE, **kwargs):
+        """Run a switch operation while holding the switch's lock
 
+        With a desired state store the operation only publishes desired
+        state, it runs right away and the converger takes the lock to
+        apply it.
+        """
+        if self.desired_state:
+            return func(*args, **kwargs)
+        return self._run_switch_locked(switch_name, func, *args,
+                                       priority=priority, **kwargs)
+
+    def _run_switch_locked(self, switch_name, func, *args,
+                           priority=c.PRIORITY_UPDATE, **kwargs):
+        """Run a switch operation while holding the switch's lock
+
+        The priority class is only honored by the switch queues, the
+        switch lock itself is granted first come first served.
+        Operations on a switch known to be unreachable fail right away.
+        Waiting for the queue or the lock is bounded by the lock timeout
+        and the budget of the hook.
+        """
+        self._check_switch_health(switch_name)
+        if not self.is_ready():
+            # the operation came before the warm-up finished, or the
+            # warm-up failed
+            self._set_up()
+        if self.switch_queues:
+            what = 'the queued operation on switch {}'.format(switch_name)
+            try:
+                return self.switch_queues.run(
+                    switch_name, priority, func, *args,
+                    timeout=deadlines.timeout(what=what), **kwargs)
+            except futures.TimeoutError:
+                raise exceptions.DeadlineExceededException(
+                    'Hook budget of {budget} seconds exhausted waiting for '
+                    '{what}'.format(budget=CONF.ml2_ansible.hook_timeout,
+                                    what=what))
+
+        lock = self._get_timed_switch_lock(switch_name)
+        with lock:
+            return func(*args, **kwargs)
+
+    def _get_committer(self, switch_name):
+        """Return the committer of a switch aggregating commits, if any"""
+        window = self.ml2config.inventory[switch_name].get(c.COMMIT_WINDOW)
+        if not window:
+            return None
+        try:
+            window = float(window)
+            if window < 0:
+                raise ValueError()
+        except ValueError:
+            LOG.error('Invalid commit_window {} on switch {}, its commits '
+                      'will not be aggregated'.format(window, switch_name))
+            return None
+        return switch_queue.Committer(
+            window,
+            functools.partial(self._staging, switch_name),
+            self._commit_staged)
+
+    @contextlib.contextmanager
+    def _staging(self, switch_name):
+        self._staged.switch_name = switch_name
+        self._staged.ops = []
+        try:
+            yield self._staged.ops
+        finally:
+            self._staged.ops = None
+
+    def _commit_staged(self, switch_name, staged):
+        """Apply staged device operations in one commit of a switch"""
+        func = self.backends.get(switch_name).commit
+        if self.device_pool:
+            func = functools.partial(self.device_pool.execute, func)
+        errors = self.throttles.call(switch_name, func, switch_name, staged,
+                                     **self.kwargs[switch_name])
+        for (operation, args), err in zip(staged, errors):
+            if err is not None:
+                LOG.error('Failed to {op} {args} in a commit on ansible '
+                          'host {host}, reason: {err}'.format(
+                              op=operation, args=list(args),
+                              host=switch_name, err=err))
+        return [exceptions.NetworkingAnsibleMechException(err)
+                if err is not None else None for err in errors]
+
+    def _get_switch_lock(self, switch_name):
+        if self.coordination_proxy:
+            lock = self.coordination_proxy.get_lock(switch_name)
+        else:
+            lock = self.coordinator.get_lock(switch_name)
+        if self.device_pool:
+            return self.device_pool.lock(lock)
+        return lock
+
+    def _get_timed_switch_lock(self, switch_name):
+        """Return the switch lock acquired within the lock timeout"""
+        return deadlines.TimedLock(self._get_switch_lock(switch_name),
+                                   CONF.ml2_ansible.lock_timeout,
+                                   switch_name)
+
+    def _device_call(self, switch_name, operation, *args):
+        """Run an operation on a switch or publish it as desired state"""
+        if self.desired_state:
+            self.desired_state.publish(switch_name, operation, *args)
+            return None
+        if self._staging_for(switch_name):
+            self._staged.ops.append((operation, args))
+            return None
+        return self._run_device_call(switch_name, operation, *args)
+
+    def _run_device_call(self, switch_name, operation, *args):
+        """Run an operation on a switch through its device backend
+
+        The operation runs within the switch's rate limit and gets the
+        switch's extra and custom parameters.
+        """
+        func = getattr(self.backends.get(switch_name), operation)
+        if self.device_pool:
+            func = functools.partial(self.device_pool.execute, func)
+        return self.throttles.call(switch_name, func, switch_name, *args,
+                                   **self.kwargs[switch_name])
+
+    @deadlines.hook
     def create_network_postcommit(self, context):
         """Create a network.
 
@@ -103,6 +479,9 @@ class AnsibleMechanismDriver(ml2api.MechanismDriver):
         # TODO(michchap): we should be able to do each switch in parallel
         # if it becomes a performance issue. switch topology might also
         # open up options for filtering.
+        cache = object_cache.ObjectCache(context._plugin_context)
+        batched = []
+        routed = []
         for host_name in self.ml2config.inventory:
             host = self.ml2config.inventory[host_name]
             if host.get('manage_vlans', True):
@@ -112,54 +491,96 @@ class AnsibleMechanismDriver(ml2api.MechanismDriver):
                 provider_type = network[provider_net.NETWORK_TYPE]
                 segmentation_id = network[provider_net.SEGMENTATION_ID]
 
-                lock = self.coordinator.get_lock(host_name)
-                with lock:
-                    if provider_type == 'vlan' and segmentation_id:
-
-                        # re-request network info in case it's stale
-                        net = Network.get_object(context._plugin_context,
-                                                 id=network_id)
-                        LOG.debug('network create object: {}'.format(net))
-
-                        # network was since deleted by user and we can discard
-                        # this request
-                        if not net:
-                            return
-
-                        # check the vlan for this request is still associated
-                        # with this network. We don't currently allow updating
-                        # the segment on a network - it's disallowed at the
-                        # neutron level for provider networks - but that could
-                        # change in the future
-                        s_ids = [s.segmentation_id for s in net.segments]
-                        if segmentation_id not in s_ids:
-                            return
-
-                        # Create VLAN on the switch
-                        try:
-                            self.net_runr.create_vlan(
-                                host_name,
-                                segmentation_id,
-                                **self.kwargs[host_name])
-                            LOG.info('Network {net_id}, segmentation '
-                                     '{seg} has been added on '
-                                     'ansible host {host}'.format(
-                                         net_id=network['id'],
-                                         seg=segmentation_id,
-                                         host=host_name))
-
-                        except Exception as e:
-                            # TODO(radez) I don't think there is a message
-                            #             returned from ansible runner's
-                            #             exceptions
-                            LOG.error('Failed to create network {net_id} '
-                                      'on ansible host: {host}, '
-                                      'reason: {err}'.format(
-                                          net_id=network_id,
-                                          host=host_name,
-                                          err=e))
-                            raise exceptions.NetworkingAnsibleMechException(e)
+                if provider_type == 'vlan' and segmentation_id:
+                    # switches owned by another worker are changed by
+                    # their owner once the local switches are done
+                    if self._switch_owner(host_name) is not None:
+                        routed.append(host_name)
+                        continue
+
+                    if self.vlan_batcher:
+                        batched.append(self.vlan_batcher.submit(
+                            host_name, vlan_batch.CREATE, network_id,
+                            segmentation_id))
+                        continue
+
+                    # the network or its segment is gone, this is the same
+                    # for every switch so the request can be discarded
+                    if not self._switch_locked(host_name, self._create_vlan,
+                                               context._plugin_context,
+                                               host_name, network_id,
+                                               segmentation_id,
+                                               cache=cache):
+                        return
+        self._wait_batched(batched)
+
+        for host_name in routed:
+            if not self._change_vlan_on_owner(
+                    context._plugin_context, host_name, vlan_batch.CREATE,
+                    context.current['id'],
+                    context.current[provider_net.SEGMENTATION_ID]):
+                return
+
+    def _wait_batched(self, batched):
+        """Wait for the batched VLAN changes of a network"""
+        errors = []
+        for future in batched:
+            try:
+                future.result(deadlines.timeout(what='the batched VLANs'))
+            except futures.TimeoutError:
+                errors.append(exceptions.DeadlineExceededException(
+                    'Hook budget of {} seconds exhausted waiting for the '
+                    'batched VLANs'.format(CONF.ml2_ansible.hook_timeout)))
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            raise errors[0]
+
+    def _create_vlan(self, db, host_name, network_id, segmentation_id,
+                     cache=None):
+        cache = cache or object_cache.ObjectCache(db)
+        # re-request network info in case it's stale
+        net = cache.get_object(Network, id=network_id)
+        LOG.debug('network create object: {}'.format(net))
+
+        # network was since deleted by user and we can discard
+        # this request
+        if not net:
+            return False
+
+        # check the vlan for this request is still associated
+        # with this network. We don't currently allow updating
+        # the segment on a network - it's disallowed at the
+        # neutron level for provider networks - but that could
+        # change in the future
+        s_ids = [s.segmentation_id for s in net.segments]
+        if segmentation_id not in s_ids:
+            return False
+
+        # Create VLAN on the switch
+        try:
+            self._device_call(host_name, 'create_vlan', segmentation_id)
+            LOG.info('Network {net_id}, segmentation '
+                     '{seg} has been added on '
+                     'ansible host {host}'.format(
+                         net_id=network_id,
+                         seg=segmentation_id,
+                         host=host_name))
+            return True
+
+        except Exception as e:
+            # TODO(radez) I don't think there is a message
+            #             returned from ansible runner's
+            #             exceptions
+            LOG.error('Failed to create network {net_id} '
+                      'on ansible host: {host}, '
+                      'reason: {err}'.format(
+                          net_id=network_id,
+                          host=host_name,
+                          err=e))
+            raise exceptions.NetworkingAnsibleMechException(e)
 
+    @deadlines.hook
     def delete_network_postcommit(self, context):
         """Delete a network.
 
@@ -175,6 +596,9 @@ class AnsibleMechanismDriver(ml2api.MechanismDriver):
 
         # assuming all hosts
         # TODO(radez): can we filter by physnets?
+        cache = object_cache.ObjectCache(context._plugin_context)
+        batched = []
+        routed = []
         for host_name in self.ml2config.inventory:
             host = self.ml2config.inventory[host_name]
 
@@ -185,47 +609,119 @@ class AnsibleMechanismDriver(ml2api.MechanismDriver):
 
             if provider_type == 'vlan' and segmentation_id:
                 if host.get('manage_vlans', True):
-                    lock = self.coordinator.get_lock(host_name)
-                    with lock:
-                        # Find out if this segment is active.
-                        # We need to find out if this segment is being used
-                        # by another network before deleting it from the switch
-                        # since reordering could mean that a vlan is recycled
-                        # by the time this request is satisfied. Getting
-                        # the current network is not enough
-                        db = context._plugin_context
-
-                        segments = NetworkSegment.get_objects(
-                            db, segmentation_id=segmentation_id)
-
-                        for segment in segments:
-                            if segment.segmentation_id == segmentation_id and \
-                               segment.physical_network == physnet and \
-                               segment.network_type == 'vlan':
-                                LOG.debug('Not deleting segment {} from {}'
-                                          'because it was recreated'.format(
-                                              segmentation_id, physnet))
-                                return
-
-                        # Delete VLAN on the switch
-                        try:
-                            self.net_runr.delete_vlan(
-                                host_name,
-                                segmentation_id,
-                                **self.kwargs[host_name])
-                            LOG.info('Network {net_id} has been deleted on '
-                                     'ansible host {host}'.format(
-                                         net_id=network['id'],
-                                         host=host_name))
-
-                        except Exception as e:
-                            LOG.error('Failed to delete network {net} '
-                                      'on ansible host: {host}, '
-                                      'reason: {err}'.format(net=network['id'],
-                                                             host=host_name,
-                                                             err=e))
-                            raise exceptions.NetworkingAnsibleMechException(e)
+                    if self.vlan_gc:
+                        # the garbage collector checks if the VLAN is
+                        # still in use right before removing it
+                        self.vlan_gc.schedule(host_name, segmentation_id,
+                                              physnet)
+                        continue
+
+                    if self._switch_owner(host_name) is not None:
+                        routed.append(host_name)
+                        continue
+
+                    if self.vlan_batcher:
+                        batched.append(self.vlan_batcher.submit(
+                            host_name, vlan_batch.DELETE, network['id'],
+                            segmentation_id, physnet))
+                        continue
+
+                    # the segment was recreated, this is the same for
+                    # every switch so the request can be discarded
+                    if not self._switch_locked(host_name, self._delete_vlan,
+                                               context._plugin_context,
+                                               host_name, network['id'],
+                                               segmentation_id, physnet,
+                                               priority=c.PRIORITY_DELETE,
+                                               cache=cache):
+                        return
+        self._wait_batched(batched)
+
+        network = context.current
+        for host_name in routed:
+            if not self._change_vlan_on_owner(
+                    context._plugin_context, host_name, vlan_batch.DELETE,
+                    network['id'], network[provider_net.SEGMENTATION_ID],
+                    network[provider_net.PHYSICAL_NETWORK]):
+                return
+
+    def _change_vlan(self, db, switch_name, action, network_id,
+                     segmentation_id, physnet=None, cache=None):
+        """Create or delete the VLAN of a network on an owned switch
+
+        :returns: False when the network or its segment changed meanwhile
+                  and there was nothing to do
+        """
+        if self.vlan_batcher:
+            future = self.vlan_batcher.submit(switch_name, action,
+                                              network_id, segmentation_id,
+                                              physnet)
+            self._wait_batched([future])
+            return future.result()
+        if action == vlan_batch.CREATE:
+            return self._switch_locked(switch_name, self._create_vlan, db,
+                                       switch_name, network_id,
+                                       segmentation_id, cache=cache)
+        return self._switch_locked(switch_name, self._delete_vlan, db,
+                                   switch_name, network_id, segmentation_id,
+                                   physnet, priority=c.PRIORITY_DELETE,
+                                   cache=cache)
+
+    def _change_vlan_on_owner(self, db, switch_name, action, network_id,
+                              segmentation_id, physnet=None):
+        local = functools.partial(self._change_vlan, db, switch_name,
+                                  action, network_id, segmentation_id,
+                                  physnet)
+        owner = self._switch_owner(switch_name)
+        if owner is None:
+            return local()
+        return self._call_owner(
+            owner, switch_name,
+            'VLAN {} of network {}'.format(action, network_id),
+            functools.partial(self.switch_rpc.change_vlan, db, owner,
+                              switch_name, action, network_id,
+                              segmentation_id, physnet=physnet),
+            local)
+
+    def _delete_vlan(self, db, host_name, network_id, segmentation_id,
+                     physnet, cache=None):
+        cache = cache or object_cache.ObjectCache(db)
+        # Find out if this segment is active.
+        # We need to find out if this segment is being used
+        # by another network before deleting it from the switch
+        # since reordering could mean that a vlan is recycled
+        # by the time this request is satisfied. Getting
+        # the current network is not enough
+        segments = cache.get_objects(NetworkSegment,
+                                     segmentation_id=segmentation_id)
+
+        for segment in segments:
+            if segment.segmentation_id == segmentation_id and \
+               segment.physical_network == physnet and \
+               segment.network_type == 'vlan':
+                LOG.debug('Not deleting segment {} from {}'
+                          'because it was recreated'.format(
+                              segmentation_id, physnet))
+                return False
+
+        # Delete VLAN on the switch
+        try:
+            self._device_call(host_name, 'delete_vlan', segmentation_id)
+            LOG.info('Network {net_id} has been deleted on '
+                     'ansible host {host}'.format(
+                         net_id=network_id,
+                         host=host_name))
+            return True
+
+        except Exception as e:
+            LOG.error('Failed to delete network {net} '
+                      'on ansible host: {host}, '
+                      'reason: {err}'.format(net=network_id,
+                                             host=host_name,
+                                             err=e))
+            raise exceptions.NetworkingAnsibleMechException(e)
 
+    @deadlines.hook
     def update_port_postcommit(self, context):
         """Update a port.
 
@@ -241,53 +737,57 @@ class AnsibleMechanismDriver(ml2api.MechanismDriver):
         state. It is up to the mechanism driver to ignore state or
         state changes that it does not know or care about.
         """
+        cache = object_cache.ObjectCache(context._plugin_context)
         # Handle VM ports
         if self._is_port_normal(context.current):
+            if not self._is_switch_relevant_update(context.current,
+                                                   context.original):
+                LOG.debug('Skipping update of port {} without switch '
+                          'relevant changes'.format(context.current['id']))
+                return
             port = context.current
             network = context.network.current
             mappings, segmentation_id = self.get_switch_meta(port, network)
-
-            for switch_name, switch_port in mappings:
-                LOG.debug('Ensuring Updated port {switch_port} on network '
-                          '{network} {switch_name} to vlan: '
-                          '{segmentation_id}'.format(
-                              switch_port=switch_port,
-                              network=network,
-                              switch_name=switch_name,
-                              segmentation_id=segmentation_id))
-
-                self.ensure_port(port, context._plugin_context,
-                                 switch_name, switch_port,
-                                 network[provider_net.PHYSICAL_NETWORK],
-                                 context,
-                                 segmentation_id)
+            segmentation_id = self._bound_segmentation_id(
+                context.bottom_bound_segment, segmentation_id)
+
+            self._ensure_links(port, context._plugin_context, mappings,
+                               network[provider_net.PHYSICAL_NETWORK],
+                               context,
+                               segmentation_id,
+                               cache=cache)
+            # the port may have moved away from a dynamic segment
+            self._release_dynamic_segment(
+                context, context.original_top_bound_segment,
+                context.original_bottom_bound_segment)
         # Baremetal Operations
         elif self._is_port_bound(context.current):
             port = context.current
-            provisioning_blocks.provisioning_complete(
-                context._plugin_context, port['id'], resources.PORT,
-                c.NETWORKING_ENTITY)
+            if self.provisioning:
+                self.provisioning.complete(port['id'])
+            else:
+                provisioning_blocks.provisioning_complete(
+                    context._plugin_context, port['id'], resources.PORT,
+                    c.NETWORKING_ENTITY)
 
         elif self._is_port_bound(context.original):
             port = context.original
             network = context.network.current
             mappings, segmentation_id = self.get_switch_meta(port, network)
-
-            for switch_name, switch_port in mappings:
-                LOG.debug('Ensuring Updated port {switch_port} on network '
-                          '{network} {switch_name} to vlan: '
-                          '{segmentation_id}'.format(
-                              switch_port=switch_port,
-                              network=network,
-                              switch_name=switch_name,
-                              segmentation_id=segmentation_id))
-
-                self.ensure_port(port, context._plugin_context,
-                                 switch_name, switch_port,
-                                 network[provider_net.PHYSICAL_NETWORK],
-                                 context,
-                                 segmentation_id)
-
+            segmentation_id = self._bound_segmentation_id(
+                context.original_bottom_bound_segment, segmentation_id)
+
+            self._ensure_links(port, context._plugin_context, mappings,
+                               network[provider_net.PHYSICAL_NETWORK],
+                               context,
+                               segmentation_id,
+                               priority=c.PRIORITY_DELETE,
+                               cache=cache)
+            self._release_dynamic_segment(
+                context, context.original_top_bound_segment,
+                context.original_bottom_bound_segment)
+
+    @deadlines.hook
     def delete_port_postcommit(self, context):
         """Delete a port.
 
@@ -305,20 +805,19 @@ class AnsibleMechanismDriver(ml2api.MechanismDriver):
 
         if self._is_port_bound(context.current):
 
+            cache = object_cache.ObjectCache(context._plugin_context)
             mappings, segmentation_id = self.get_switch_meta(port, network)
-
-            for switch_name, switch_port in mappings:
-                LOG.debug('Ensuring Deleted port {switch_port} on '
-                          '{switch_name} to vlan: {segmentation_id}'.format(
-                              switch_port=switch_port,
-                              switch_name=switch_name,
-                              segmentation_id=segmentation_id))
-
-                self.ensure_port(port, context._plugin_context,
-                                 switch_name, switch_port,
-                                 network[provider_net.PHYSICAL_NETWORK],
-                                 context,
-                                 segmentation_id, delete=True)
+            segmentation_id = self._bound_segmentation_id(
+                context.bottom_bound_segment, segmentation_id)
+
+            self._ensure_links(port, context._plugin_context, mappings,
+                               network[provider_net.PHYSICAL_NETWORK],
+                               context,
+                               segmentation_id, delete=True,
+                               cache=cache)
+            self._release_dynamic_segment(context,
+                                          context.top_bound_segment,
+                                          context.bottom_bound_segment)
 
     def bind_port(self, context):
         """Attempt to bind a port.
@@ -376,23 +875,132 @@ class AnsibleMechanismDriver(ml2api.MechanismDriver):
             return
 
         mappings, segmentation_id = self.get_switch_meta(port, network)
+        physnet = network[provider_net.PHYSICAL_NETWORK]
+
+        # switches with a physnet are bound to the VLAN segment of their
+        # physical network, overlay networks get a dynamic one
+        physnets = {self._switch_physnet(switch_name)
+                    for switch_name, switch_port in mappings}
+        if len(physnets) > 1:
+            LOG.error('Port {port_id} is linked to switches of different '
+                      'physical networks {physnets}, not binding '
+                      'it'.format(port_id=port['id'],
+                                  physnets=sorted(physnets, key=str)))
+            return
+        if physnets and None not in physnets:
+            physnet = physnets.pop()
+            segment = self._vlan_segment(context.segments_to_bind, physnet)
+            if not segment:
+                self._continue_binding(context, physnet)
+                return
+            segmentation_id = segment[ml2api.SEGMENTATION_ID]
 
-        for switch_name, switch_port in mappings:
-
-            LOG.debug('Plugging in port {switch_port} on '
-                      '{switch_name} to vlan: {segmentation_id}'.format(
-                          switch_port=switch_port,
-                          switch_name=switch_name,
-                          segmentation_id=segmentation_id))
+        cache = object_cache.ObjectCache(context._plugin_context)
 
+        # a single block covers all the links of the port
+        if mappings:
             provisioning_blocks.add_provisioning_component(
                 context._plugin_context, port['id'], resources.PORT,
                 c.NETWORKING_ENTITY)
 
-            self.ensure_port(port, context._plugin_context,
-                             switch_name, switch_port,
-                             network[provider_net.PHYSICAL_NETWORK], context,
-                             segmentation_id)
+        # the port is only bound once all of its links are configured
+        self._ensure_links(port, context._plugin_context, mappings,
+                           physnet, context,
+                           segmentation_id, priority=c.PRIORITY_BIND,
+                           cache=cache)
+
+    def _switch_physnet(self, switch_name):
+        """Return the physical network of a switch, None if unset"""
+        switch = self.ml2config.inventory.get(switch_name, {})
+        return switch.get(c.SWITCH_PHYSNET)
+
+    @staticmethod
+    def _vlan_segment(segments, physnet):
+        for segment in segments:
+            if segment.get(ml2api.NETWORK_TYPE) == 'vlan' and \
+               segment.get(ml2api.PHYSICAL_NETWORK) == physnet:
+                return segment
+        return None
+
+    @staticmethod
+    def _continue_binding(context, physnet):
+        """Bind an overlay segment to a dynamic VLAN segment
+
+        The next binding level binds the port to the VLAN segment of the
+        switch's physical network allocated for the port's network.
+        """
+        port_id = context.current['id']
+        for segment in context.segments_to_bind:
+            if segment.get(ml2api.NETWORK_TYPE) not in \
+                    c.OVERLAY_NETWORK_TYPES:
+                continue
+            dynamic = context.allocate_dynamic_segment(
+                {ml2api.NETWORK_TYPE: 'vlan',
+                 ml2api.PHYSICAL_NETWORK: physnet})
+            if not dynamic:
+                LOG.error('Failed to allocate a VLAN segment of physical '
+                          'network {physnet} for port {port_id}'.format(
+                              physnet=physnet, port_id=port_id))
+                return
+            LOG.debug('Continuing binding of port {port_id} with VLAN '
+                      '{seg} of physical network {physnet}'.format(
+                          port_id=port_id,
+                          seg=dynamic[ml2api.SEGMENTATION_ID],
+                          physnet=physnet))
+            context.continue_binding(segment[ml2api.ID], [dynamic])
+            return
+        LOG.debug('Port {port_id} has no segment on physical network '
+                  '{physnet} to bind'.format(port_id=port_id,
+                                             physnet=physnet))
+
+    @staticmethod
+    def _bound_segmentation_id(segment, segmentation_id):
+        """Return the VLAN of the segment a port is bound to
+
+        :param segment: the bottom bound segment of the port
+        :param segmentation_id: the VLAN of the network, used when the port
+                                isn't bound to a VLAN segment
+        """
+        if segment and segment.get(ml2api.NETWORK_TYPE) == 'vlan':
+            return segment[ml2api.SEGMENTATION_ID]
+        return segmentation_id
+
+    def _release_dynamic_segment(self, context, top_segment, segment):
+        """Release a dynamic VLAN segment no port is bound to anymore
+
+        The VLAN is removed from the switches of the segment's physical
+        network like the VLAN of a deleted network.
+        """
+        if not segment or not top_segment or \
+           segment[ml2api.ID] == top_segment[ml2api.ID]:
+            return
+        physnet = segment.get(ml2api.PHYSICAL_NETWORK)
+        switches = [name for name in self.ml2config.inventory
+                    if self._switch_physnet(name) == physnet]
+        if not switches:
+            return
+
+        db = context._plugin_context
+        if PortBindingLevel.objects_exist(db, segment_id=segment[ml2api.ID]):
+            return
+        segmentation_id = segment[ml2api.SEGMENTATION_ID]
+        network_id = context.network.current['id']
+        LOG.debug('Releasing VLAN {seg} of physical network {physnet} of '
+                  'network {net_id}'.format(seg=segmentation_id,
+                                            physnet=physnet,
+                                            net_id=network_id))
+        context.release_dynamic_segment(segment[ml2api.ID])
+
+        for switch_name in switches:
+            if not self.ml2config.inventory[switch_name].get('manage_vlans',
+                                                             True):
+                continue
+            if self.vlan_gc:
+                self.vlan_gc.schedule(switch_name, segmentation_id, physnet)
+                continue
+            self._switch_locked(switch_name, self._delete_vlan, db,
+                                switch_name, network_id, segmentation_id,
+                                physnet, priority=c.PRIORITY_DELETE)
 
     def get_switch_meta(self, port, network=None):
         '''
@@ -417,32 +1025,44 @@ class AnsibleMechanismDriver(ml2api.MechanismDriver):
                   'binding:profile'.format(port_id=port['id'])
             LOG.debug(msg)
             raise exceptions.LocalLinkInfoMissingException(msg)
-        switch_mac = local_link_info[0].get('switch_id', '').upper()
-        switch_name = local_link_info[0].get('switch_info')
-        switch_port = local_link_info[0].get('port_id')
-        # fill in the switch name if mac exists but name is not defined
-        # this provides support for introspection when the switch's mac is
-        # also provided in the ML2 conf for ansible-networking
-        if not switch_name and switch_mac in self.ml2config.mac_map:
-            switch_name = self.ml2config.mac_map[switch_mac]
+        # every link of a bonded port, each member of a port group is
+        # configured like a single link
+        mappings = []
+        for link in local_link_info:
+            switch_mac = link.get('switch_id', '').upper()
+            switch_name = link.get('switch_info')
+            switch_port = link.get('port_id')
+            # fill in the switch name if mac exists but name is not defined
+            # this provides support for introspection when the switch's mac
+            # is also provided in the ML2 conf for ansible-networking
+            if not switch_name and switch_mac in self.ml2config.mac_map:
+                switch_name = self.ml2config.mac_map[switch_mac]
+            LOG.debug('Local Link Info:: name: {} mac: {} port: {}'.format(
+                switch_name, switch_mac, switch_port))
+            if (switch_name, switch_port) not in mappings:
+                mappings.append((switch_name, switch_port))
         segmentation_id = network.get(provider_net.SEGMENTATION_ID, '')
-        LOG.debug('Local Link Info:: name: {} mac: {} port: {}'.format(
-            switch_name, switch_mac, switch_port))
-        return [(switch_name, switch_port)], segmentation_id
+        return mappings, segmentation_id
 
     def _switch_meta_from_port_host_id(self, port, network=None):
         network = network or {}
         # TODO What do we do if there is not a mapping available?
         #      should we fail in some way?
         host_id = port[portbindings.HOST_ID]
-        # if type direct get the pci address and append to host_id
+        # if type direct look up the host's pci bus
         if AnsibleMechanismDriver._is_port_direct(port):
-            host_id = self._build_sriov_host_id(port, host_id)
-        LOG.debug('Host-ID lookup: {}'.format(host_id))
-        mappings = self.ml2config.port_mappings.get(host_id, [])
+            pci_bus = self._get_pci_bus(port)
+            LOG.debug('Host-ID lookup: {} PCI bus: {}'.format(host_id,
+                                                              pci_bus))
+            mappings = self.ml2config.sriov_port_mappings.get(
+                (host_id, pci_bus), [])
+        else:
+            LOG.debug('Host-ID lookup: {}'.format(host_id))
+            mappings = self.ml2config.port_mappings.get(host_id, [])
         segmentation_id = network.get(provider_net.SEGMENTATION_ID, '')
         return mappings, segmentation_id
 
+    @deadlines.hook
     def ensure_subports(self, port_id, db):
         # set the correct state on port in the case where it has subports.
 
@@ -458,26 +1078,57 @@ class AnsibleMechanismDriver(ml2api.MechanismDriver):
         # get switch info
         mappings, segmentation_id = self.get_switch_meta(port)
 
+        # the subports change the trunk config without a new port revision
+        self._forget_applied(port_id)
+
+        cache = object_cache.ObjectCache(db)
         for switch_name, switch_port in mappings:
-            # lock switch
-            lock = self.coordinator.get_lock(switch_name)
-            with lock:
-                # get updated port from db
-                updated_port = Port.get_object(db, id=port_id)
-                if updated_port:
-                    self._set_port_state(updated_port, db,
-                                         switch_name, switch_port)
-                    return
-                else:
-                    # port delete operation will take care of deletion
-                    LOG.debug('Discarding attempt to ensure subports on a port'
-                              ' {} that was deleted after lock '
-                              'acquisition'.format(port_id))
-                    return
+            local = functools.partial(self._switch_locked, switch_name,
+                                      self._ensure_subports_locked, port_id,
+                                      db, switch_name, switch_port,
+                                      cache=cache, prefetched=port)
+            owner = self._switch_owner(switch_name)
+            if owner is None:
+                local()
+                continue
+            self._call_owner(
+                owner, switch_name, 'subports of port {}'.format(port_id),
+                functools.partial(self.switch_rpc.ensure_subports, db,
+                                  owner, port_id, switch_name, switch_port),
+                local)
+
+    def _ensure_subports(self, port_id, db, switch_name, switch_port):
+        """Ensure the subports of a port on a switch owned by this worker"""
+        return self._switch_locked(switch_name,
+                                   self._ensure_subports_locked, port_id,
+                                   db, switch_name, switch_port)
+
+    def _ensure_subports_locked(self, port_id, db, switch_name, switch_port,
+                                cache=None, prefetched=_NOT_PREFETCHED):
+        # get updated port from db
+        updated_port = self._current_port(db, port_id, prefetched)
+        if updated_port:
+            self._set_port_state(updated_port, db,
+                                 switch_name, switch_port, cache=cache)
+        else:
+            # port delete operation will take care of deletion
+            LOG.debug('Discarding attempt to ensure subports on a port'
+                      ' {} that was deleted after lock '
+                      'acquisition'.format(port_id))
 
     def ensure_port(self, port, db, switch_name,
                     switch_port, physnet, port_context,
-                    segmentation_id, delete=False):
+                    segmentation_id, delete=False, priority=None,
+                    cache=None):
+        """Ensure the state of a port on a switch port
+
+        :param priority: the priority class of the operation, defaults to
+                         a port update or a port delete
+        :param cache: the ObjectCache of the calling hook
+        """
+        if priority is None:
+            priority = c.PRIORITY_DELETE if delete else c.PRIORITY_UPDATE
+
         LOG.debug('Ensuring state of port {port_id} '
                   'with mac addr {mac} '
                   'on switch {switch_name} '
@@ -490,7 +1141,7 @@ class AnsibleMechanismDriver(ml2api.MechanismDriver):
                                                  physnet=physnet,
                                                  db=db))
 
-        if not self.net_runr.has_host(switch_name):
+        if switch_name not in self.ml2config.inventory:
             raise ml2_exc.MechanismDriverError('NetAnsible: couldnt find '
                                                'switch_name {} in network '
                                                'runner inventory while '
@@ -498,111 +1149,331 @@ class AnsibleMechanismDriver(ml2api.MechanismDriver):
                                                '{}'.format(switch_name,
                                                            port['id']))
 
-        # get dlock for the switch we're working with
-        lock = self.coordinator.get_lock(switch_name)
-        with lock:
-            # port = get the port from the db
-            updated_port = Port.get_object(db, id=port['id'])
-
-            if self._is_port_normal(port):
-                # OVS handles the port binding for the VM. There's no awareness
-                # that the compute node port is being configured in openstack.
-                # By the time we get the port object it's already been handled
-                # by OVS so we can't detect if it's being deleted by its state.
-                # We have to rely on the hook that's called to indicate
-                # whether to do an update or delete. Since ensure port handles
-                # both the delete flag needs to be passed for VM ports.
-                if delete:
-                    # Get active ports on this port's network
-                    # We should not delete the vlan from the compute node's
-                    # trunk if there are other ports still using the vlan
-                    active_ports = Port.get_objects(
-                        db,
-                        network_id=port['network_id'],
-                        device_owner=c.COMPUTE_NOVA)
-
-                    LOG.debug('Active Ports: {}'.format(active_ports))
-
-                    # Get_objects can't filter by binding:host_id so we use a
-                    # python filter function to finish filtering the ports by
-                    # compute host_id
-                    def active_port_filter(db_port):
-                        for binding in db_port.bindings:
-                            host_id = port[portbindings.HOST_ID]
-                            if AnsibleMechanismDriver._is_port_direct(port):
-                                host_id = self._build_sriov_host_id(
-                                    port, host_id)
-                                db_network = Network.get_object(
-                                    db, id=db_port['network_id'])
-                                mappings, db_segid = self.get_switch_meta(
-                                    db_port, db_network)
-                                # first mapping, should be only one for DIRECT
-                                # port from (switch_name, switch_port) tuple
-                                db_switchport = mappings[0][1]
-                                if db_switchport == switch_port \
-                                    and db_segid == segmentation_id \
-                                    and db_port['id'] != port['id']:
-                                    return True
-                            else:
-                                if binding['host'] == host_id \
-                                    and db_port['id'] != port['id']:
-                                    return True
-                        # Default to false
-                        return False
-
-                    active_ports = list(filter(active_port_filter,
-                                               active_ports))
-                    LOG.debug('Filtered Active Ports: {}'.format(active_ports))
-
-                    # If there are other VM's active ports on this port's
-                    # network we will skip removing the vlan from the
-                    # compute node's trunk port
-                    if not active_ports:
-                        self.net_runr.delete_trunk_vlan(
-                            switch_name,
-                            switch_port,
-                            segmentation_id,
-                            **self.kwargs[switch_name])
-                    else:
-                        LOG.info('Skip removing Segmentation ID {} from '
-                                 'compute host {}. There are {} other '
-                                 'active ports using the VLAN.'.format(
-                                     segmentation_id,
-                                     port[portbindings.HOST_ID],
-                                     len(active_ports)))
+        owner = self._switch_owner(switch_name)
+        if owner:
+            applied = self._ensure_port_on_owner(
+                owner, port, db, switch_name, switch_port, physnet,
+                segmentation_id, delete, priority, cache=cache)
+        else:
+            applied = self._ensure_port(port, db, switch_name, switch_port,
+                                        physnet, segmentation_id, delete,
+                                        priority, cache=cache)
+
+        if applied and port_context:
+            self._set_binding(port_context, segmentation_id)
+        return applied
+
+    def _ensure_links(self, port, db, mappings, physnet, port_context,
+                      segmentation_id, **kwargs):
+        """Ensure the state of a port on all of its switch ports
 
+        The links on different switches are configured concurrently, the
+        links on one switch one after the other. The port is bound once
+        every link was configured, a failure on any link fails the whole
+        operation after the other links finished.
+
+        :param kwargs: passed to ensure_port
+        """
+        action = 'removal' if kwargs.get('delete') else 'configuration'
+        for switch_name, switch_port in mappings:
+            LOG.debug('Ensuring {action} of port {port_id} on switch port '
+                      '{switch_port} of {switch_name} with vlan '
+                      '{segmentation_id}'.format(
+                          action=action, port_id=port['id'],
+                          switch_port=switch_port, switch_name=switch_name,
+                          segmentation_id=segmentation_id))
+        if not mappings:
+            return False
+        if len(mappings) == 1:
+            switch_name, switch_port = mappings[0]
+            return self.ensure_port(port, db, switch_name, switch_port,
+                                    physnet, port_context, segmentation_id,
+                                    **kwargs)
+
+        links = collections.OrderedDict()
+        for switch_name, switch_port in mappings:
+            links.setdefault(switch_name, []).append(switch_port)
+
+        deadline = deadlines.deadline()
+
+        def ensure_switch_links(switch_name, switch_ports):
+            # the links run on threads of their own, they share the
+            # deadline of the hook
+            with deadlines.until(deadline):
+                return [self.ensure_port(port, db, switch_name, switch_port,
+                                         physnet, None, segmentation_id,
+                                         **kwargs)
+                        for switch_port in switch_ports]
+
+        errors = []
+        applied = True
+        with futures.ThreadPoolExecutor(max_workers=len(links)) as executor:
+            jobs = [(switch_name,
+                     executor.submit(ensure_switch_links, switch_name,
+                                     switch_ports))
+                    for switch_name, switch_ports in links.items()]
+        for switch_name, job in jobs:
+            try:
+                applied = all(job.result()) and applied
+            except Exception as e:
+                LOG.error('Failed to ensure port {port_id} on switch '
+                          '{switch_name}, reason: {err}'.format(
+                              port_id=port['id'],
+                              switch_name=switch_name,
+                              err=e))
+                errors.append(e)
+        if errors:
+            raise errors[0]
+
+        if applied and port_context:
+            self._set_binding(port_context, segmentation_id)
+        return applied
+
+    @staticmethod
+    def _set_binding(port_context, segmentation_id):
+        segments = port_context.segments_to_bind
+        if not segments:
+            return
+        # bind the segment the switch ports were configured with
+        segment = next((s for s in segments
+                        if s.get(ml2api.SEGMENTATION_ID) == segmentation_id),
+                       segments[0])
+        port_context.set_binding(segment[ml2api.ID],
+                                 portbindings.VIF_TYPE_OTHER,
+                                 {})
+
+    def _ensure_port_on_owner(self, owner, port, db, switch_name,
+                              switch_port, physnet, segmentation_id, delete,
+                              priority, cache=None):
+        local = functools.partial(self._ensure_port, port, db, switch_name,
+                                  switch_port, physnet, segmentation_id,
+                                  delete, priority, cache=cache)
+        if owner is None:
+            return local()
+        return self._call_owner(
+            owner, switch_name, 'port {} operation'.format(port['id']),
+            functools.partial(self.switch_rpc.ensure_port, db, owner, port,
+                              switch_name, switch_port, physnet,
+                              segmentation_id, delete=delete,
+                              priority=priority),
+            local)
+
+    def _call_owner(self, owner, switch_name, what, remote, local):
+        """Run a switch operation on the worker owning the switch
+
+        Callers check for an owner first, the switch RPC client only exists
+        with switch partitioning.
+
+        :param remote: sends the operation to the owner
+        :param local: runs the operation in this worker, when this worker
+                      owns the switch or the owner doesn't answer
+        """
+        LOG.debug('Routing {what} on switch {switch_name} to its owner '
+                  '{owner}'.format(what=what, switch_name=switch_name,
+                                   owner=owner))
+        try:
+            return remote()
+        except oslo_messaging.MessagingTimeout:
+            # the owner may have left the group since the ring was last
+            # refreshed, the switch lock keeps running it here safe
+            LOG.warning('Owner {owner} of switch {switch_name} did not '
+                        'answer, running the {what} locally'.format(
+                            owner=owner, switch_name=switch_name,
+                            what=what))
+            return local()
+        except oslo_messaging.RemoteError as e:
+            raise exceptions.NetworkingAnsibleMechException(e.value)
+
+    def _ensure_port(self, port, db, switch_name, switch_port, physnet,
+                     segmentation_id, delete=False,
+                     priority=c.PRIORITY_UPDATE, cache=None):
+        """Apply a port operation on a switch
+
+        :returns: True if a baremetal port was configured and can be bound
+        """
+        cache = cache or object_cache.ObjectCache(db)
+
+        # read what the operation needs before waiting for the switch lock,
+        # only a cheap check that the port didn't change is left for the
+        # critical section
+        prefetched = _NOT_PREFETCHED
+        if self._is_port_normal(port):
+            configure = not delete and not self._is_applied(
+                port, switch_name, switch_port)
+        else:
+            prefetched = Port.get_object(db, id=port['id'])
+            configure = self._get_port_lli(prefetched) and not \
+                self._is_applied(prefetched, switch_name, switch_port)
+        if configure:
+            # only setting the port state reads the network
+            self._prefetch_network(port['network_id'], cache)
+
+        return self._switch_locked(switch_name, self._ensure_port_locked,
+                                   port, db, switch_name, switch_port,
+                                   physnet, segmentation_id, delete,
+                                   priority=priority, cache=cache,
+                                   prefetched=prefetched)
+
+    def _prefetch_network(self, network_id, cache):
+        if self._indexed_segments(network_id) is None:
+            cache.get_object(Network, id=network_id)
+
+    @staticmethod
+    def _current_port(db, port_id, prefetched=_NOT_PREFETCHED):
+        """Return the port as it currently is in the DB
+
+        A port read before taking the switch lock is still current when a
+        port with its revision exists, which is cheaper to check than to
+        read the port again.
+        """
+        if prefetched is None:
+            if not Port.objects_exist(db, id=port_id):
+                return None
+        elif prefetched is not _NOT_PREFETCHED:
+            if Port.objects_exist(db, id=port_id,
+                                  revision_number=prefetched.revision_number):
+                return prefetched
+        return Port.get_object(db, id=port_id)
+
+    def _ensure_port_locked(self, port, db, switch_name, switch_port,
+                            physnet, segmentation_id, delete, cache=None,
+                            prefetched=_NOT_PREFETCHED):
+        cache = cache or object_cache.ObjectCache(db)
+
+        if self._is_port_normal(port):
+            # OVS handles the port binding for the VM. There's no awareness
+            # that the compute node port is being configured in openstack.
+            # By the time we get the port object it's already been handled
+            # by OVS so we can't detect if it's being deleted by its state.
+            # We have to rely on the hook that's called to indicate
+            # whether to do an update or delete. Since ensure port handles
+            # both the delete flag needs to be passed for VM ports.
+            if delete:
+                # Get active ports on this port's network
+                # We should not delete the vlan from the compute node's
+                # trunk if there are other ports still using the vlan
+                active_ports = cache.get_objects(
+                    Port,
+                    network_id=port['network_id'],
+                    device_owner=c.COMPUTE_NOVA)
+
+                LOG.debug('Active Ports: {}'.format(active_ports))
+
+                # Get_objects can't filter by binding:host_id so we use a
+                # python filter function to finish filtering the ports by
+                # compute host_id
+                def active_port_filter(db_port):
+                    for binding in db_port.bindings:
+                        host_id = port[portbindings.HOST_ID]
+                        if AnsibleMechanismDriver._is_port_direct(port):
+                            db_network = cache.get_object(
+                                Network, id=db_port['network_id'])
+                            mappings, db_segid = self.get_switch_meta(
+                                db_port, db_network)
+                            # first mapping, should be only one for DIRECT
+                            # port from (switch_name, switch_port) tuple
+                            db_switchport = mappings[0][1]
+                            if db_switchport == switch_port \
+                                and db_segid == segmentation_id \
+                                and db_port['id'] != port['id']:
+                                return True
+                        else:
+                            if binding['host'] == host_id \
+                                and db_port['id'] != port['id']:
+                                return True
+                    # Default to false
+                    return False
+
+                active_ports = list(filter(active_port_filter,
+                                           active_ports))
+                LOG.debug('Filtered Active Ports: {}'.format(active_ports))
+
+                # If there are other VM's active ports on this port's
+                # network we will skip removing the vlan from the
+                # compute node's trunk port
+                if not active_ports:
+                    self._device_call(switch_name, 'delete_trunk_vlan',
+                                      switch_port, segmentation_id)
                 else:
-                    self._set_port_state(port, db, switch_name, switch_port)
+                    LOG.info('Skip removing Segmentation ID {} from '
+                             'compute host {}. There are {} other '
+                             'active ports using the VLAN.'.format(
+                                 segmentation_id,
+                                 port[portbindings.HOST_ID],
+                                 len(active_ports)))
+                self._forget_applied(port['id'], switch_name, switch_port)
+
+            elif not self._is_applied(port, switch_name, switch_port):
+                self._set_port_state(port, db, switch_name, switch_port,
+                                     cache=cache)
+                self._record_applied(port, switch_name, switch_port)
 
-                return
+            return
+
+        # port = get the port from the db
+        updated_port = self._current_port(db, port['id'], prefetched)
 
-            # if baremetal port exists and is bound to a port
-            elif self._get_port_lli(updated_port):
+        # if baremetal port exists and is bound to a port
+        if self._get_port_lli(updated_port):
 
-                if self._set_port_state(updated_port, db,
-                                        switch_name, switch_port):
-                    if port_context and port_context.segments_to_bind:
-                        segments = port_context.segments_to_bind
-                        port_context.set_binding(segments[0][ml2api.ID],
-                                                 portbindings.VIF_TYPE_OTHER,
-                                                 {})
-                    return
+            if self._is_applied(updated_port, switch_name, switch_port):
+                return True
+            applied = self._set_port_state(updated_port, db,
+                                           switch_name, switch_port,
+                                           cache=cache)
+            self._record_applied(updated_port, switch_name, switch_port)
+            return applied
 
+        else:
+            # if the port doesn't exist, we have a mac+switch, we can look
+            # up whether the port needs to be deleted on the switch
+            if self._is_deleted_port_in_use(physnet,
+                                            port['mac_address'], db):
+                LOG.debug('Port {port_id} was deleted, but its switch'
+                          'port {sp} is now in use by another port, '
+                          'discarding request to delete'.format(
+                              port_id=port['id'],
+                              sp=switch_port))
             else:
-                # if the port doesn't exist, we have a mac+switch, we can look
-                # up whether the port needs to be deleted on the switch
-                if self._is_deleted_port_in_use(physnet,
-                                                port['mac_address'], db):
-                    LOG.debug('Port {port_id} was deleted, but its switch'
-                              'port {sp} is now in use by another port, '
-                              'discarding request to delete'.format(
-                                  port_id=port['id'],
-                                  sp=switch_port))
-                    return
-                else:
-                    self._delete_switch_port(switch_name, switch_port)
+                self._delete_switch_port(switch_name, switch_port)
+            self._forget_applied(port['id'], switch_name, switch_port)
+
+    def _is_applied(self, port, switch_name, switch_port):
+        if not self.revisions:
+            return False
+        if self.revisions.is_applied(port['id'], switch_name, switch_port,
+                                     port['revision_number']):
+            LOG.debug('Revision {rev} of port {port_id} is already applied '
+                      'to switch port {sp} on {switch_name}'.format(
+                          rev=port['revision_number'],
+                          port_id=port['id'],
+                          sp=switch_port,
+                          switch_name=switch_name))
+            return True
+        return False
 
-    def _set_port_state(self, port, db, switch_name, switch_port):
+    def _staging_for(self, switch_name):
+        """Whether device operations on a switch are staged for a commit"""
+        if getattr(self._staged, 'ops', None) is None:
+            return False
+        return self._staged.switch_name == switch_name
+
+    def _record_applied(self, port, switch_name, switch_port):
+        # staged operations only run with the commit, which may still
+        # fail, and published ones once the converger gets to them, so
+        # their revision is applied again next time instead
+        if self.revisions and not self.desired_state and \
+                not self._staging_for(switch_name):
+            self.revisions.record(port['id'], switch_name, switch_port,
+                                  port['revision_number'])
+
+    def _forget_applied(self, port_id, switch_name=None, switch_port=None):
+        if self.revisions:
+            self.revisions.forget(port_id, switch_name, switch_port)
+
+    def _set_port_state(self, port, db, switch_name, switch_port,
+                        cache=None):
+        cache = cache or object_cache.ObjectCache(db)
         if not port:
             # error
             raise ml2_exc.MechanismDriverError('Null port passed to '
@@ -616,44 +1487,49 @@ class AnsibleMechanismDriver(ml2api.MechanismDriver):
                                                'state'.format(switch_name,
                                                               switch_port))
 
-        if not self.net_runr.has_host(switch_name):
+        if switch_name not in self.ml2config.inventory:
             raise ml2_exc.MechanismDriverError('NetAnsible: couldnt find '
                                                'switch_name {} in '
                                                'inventory'.format(
                                                    switch_name))
 
-        network = Network.get_object(db, id=port['network_id'])
-        if not network:
-            raise ml2_exc.MechanismDriverError('NetAnsible: couldnt find '
-                                               'network for port '
-                                               '{}'.format(port.id))
+        segments = self._indexed_segments(port['network_id'])
+        if segments is None:
+            network = cache.get_object(Network, id=port['network_id'])
+            if not network:
+                raise ml2_exc.MechanismDriverError('NetAnsible: couldnt '
+                                                   'find network for port '
+                                                   '{}'.format(port.id))
+            segments = self._index_network(network)
 
-        trunk = Trunk.get_object(db, port_id=port['id'])
+        trunk = cache.get_object(Trunk, port_id=port['id'])
 
-        segmentation_id = network.segments[0].segmentation_id
+        segment = self._switch_segment(db, port['network_id'], segments,
+                                       switch_name)
+        segmentation_id = segment.segmentation_id
         # Assign port to network
         try:
+            # only the first segment's VLAN was created with the network
+            if segment is not segments[0] and \
+               self.ml2config.inventory[switch_name].get('manage_vlans',
+                                                         True):
+                self._device_call(switch_name, 'create_vlan',
+                                  segmentation_id)
+
             if trunk:
                 sub_ports = trunk.sub_ports
                 trunked_vlans = [sp.segmentation_id for sp in sub_ports]
-                self.net_runr.conf_trunk_port(switch_name,
-                                              switch_port,
-                                              segmentation_id,
-                                              trunked_vlans,
-                                              **self.kwargs[switch_name])
+                self._device_call(switch_name, 'conf_trunk_port',
+                                  switch_port, segmentation_id,
+                                  trunked_vlans)
 
             elif self._is_port_normal(port):
-                self.net_runr.add_trunk_vlan(switch_name,
-                                             switch_port,
-                                             segmentation_id,
-                                             **self.kwargs[switch_name])
+                self._device_call(switch_name, 'add_trunk_vlan',
+                                  switch_port, segmentation_id)
 
             else:
-                self.net_runr.conf_access_port(
-                    switch_name,
-                    switch_port,
-                    segmentation_id,
-                    **self.kwargs[switch_name])
+                self._device_call(switch_name, 'conf_access_port',
+                                  switch_port, segmentation_id)
 
             LOG.info('Port {neutron_port} has been plugged into '
                      'switch port {sp} on device {switch_name}'.format(
@@ -671,6 +1547,27 @@ class AnsibleMechanismDriver(ml2api.MechanismDriver):
                           exc=e))
             raise exceptions.NetworkingAnsibleMechException(e)
 
+    def _switch_segment(self, db, network_id, segments, switch_name):
+        """Return the segment of a network to configure on a switch
+
+        A switch with a physnet gets the VLAN segment of its physical
+        network, the first segment of the network otherwise.
+        """
+        physnet = self._switch_physnet(switch_name)
+        if not physnet:
+            return segments[0]
+        for segment in segments:
+            if segment.network_type == 'vlan' and \
+               segment.physical_network == physnet:
+                return segment
+        # dynamic segments can be allocated after the network was read
+        dynamic = NetworkSegment.get_objects(db, network_id=network_id,
+                                             network_type='vlan',
+                                             physical_network=physnet)
+        if dynamic:
+            return dynamic[0]
+        return segments[0]
+
     def _delete_switch_port(self, switch_name, switch_port):
         # we want to delete the physical port on the switch
         # provided since it's no longer in use
@@ -678,9 +1575,7 @@ class AnsibleMechanismDriver(ml2api.MechanismDriver):
                   'on {switch_name}'.format(switch_port=switch_port,
                                             switch_name=switch_name))
         try:
-            self.net_runr.delete_port(switch_name,
-                                      switch_port,
-                                      **self.kwargs[switch_name])
+            self._device_call(switch_name, 'delete_port', switch_port)
             LOG.info('Unplugged port {switch_port} '
                      'on {switch_name}'.format(switch_port=switch_port,
                                                switch_name=switch_name))
@@ -723,14 +1618,33 @@ class AnsibleMechanismDriver(ml2api.MechanismDriver):
             if port.bindings:
                 lli = self._get_port_lli(port)
                 if lli:
-                    net = Network.get_object(db, id=port.network_id)
-                    if net:
-                        for seg in net.segments:
-                            if seg.physical_network == physnet and \
-                               seg.network_type == 'vlan':
-                                return True
+                    segments = self._indexed_segments(port.network_id)
+                    indexed = segments is not None
+                    if not indexed:
+                        net = Network.get_object(db, id=port.network_id)
+                        segments = self._index_network(net) if net else []
+                    for seg in segments:
+                        if seg.physical_network == physnet and \
+                           seg.network_type == 'vlan':
+                            return True
+                    # the index has no dynamic segments
+                    if indexed and NetworkSegment.objects_exist(
+                            db, network_id=port.network_id,
+                            network_type='vlan', physical_network=physnet):
+                        return True
         return False
 
+    def _indexed_segments(self, network_id):
+        if not self.topology:
+            return None
+        return self.topology.segments(network_id)
+
+    def _index_network(self, network):
+        """Return the segments of a network read from the DB"""
+        if not self.topology:
+            return network.segments
+        return self.topology.add_network(network)
+
     @staticmethod
     def _is_port_supported(port):
         """Return whether a port is supported by this driver.
@@ -764,6 +1678,22 @@ class AnsibleMechanismDriver(ml2api.MechanismDriver):
         device_owner = port[c.DEVICE_OWNER]
         return device_owner == c.COMPUTE_NOVA
 
+    @staticmethod
+    def _is_switch_relevant_update(current, original):
+        """Return whether a port update can change the switch config.
+
+        Updates to fields like the name, security groups or QoS policy
+        never need to reach a switch.
+
+        :param current: The port after the update
+        :param original: The port before the update
+        :returns: Whether any switch relevant field changed
+        """
+        if not original:
+            return True
+        return any(current.get(field, None) != original.get(field, None)
+                   for field in c.SWITCH_RELEVANT_PORT_FIELDS)
+
     def _is_port_direct(port):
         """Return whether a port is type direct
 
@@ -816,10 +1746,6 @@ class AnsibleMechanismDriver(ml2api.MechanismDriver):
         return local_link_info
 
     @staticmethod
-    def _build_sriov_host_id(port, host_id):
-        profile = port.get(portbindings.PROFILE, {})
-        pci_slot = profile.get('pci_slot')
-        pci_slot = pci_slot.split('.')[0]
-        pci_slot = pci_slot.replace('0000:', '')
-        pci_slot = pci_slot.replace(':', '')
-        return '{}-{}'.format(host_id, pci_slot)
+    def _get_pci_bus(port):
+        profile = port.get(portbindings.PROFILE, {}) or {}
+        return config.parse_pci_slot(profile.get('pci_slot'))
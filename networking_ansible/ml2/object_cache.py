@@ -0,0 +1,47 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+
+class ObjectCache(object):
+    """Read-through identity map of the objects one hook invocation reads
+
+    Hooks run the same lookups for every switch or mapping they handle. A
+    cache is created when a hook starts and passed down so that every
+    lookup hits the DB once per hook invocation. Results, including
+    missing objects, are cached by object type and lookup arguments.
+
+    Port re-reads made to check that a port is still current are not
+    meant to go through the cache.
+    """
+
+    def __init__(self, context):
+        self.context = context
+        self._objects = {}
+
+    @staticmethod
+    def _key(cls, kind, kwargs):
+        return cls.__name__, kind, tuple(sorted(kwargs.items()))
+
+    def get_object(self, cls, **kwargs):
+        key = self._key(cls, 'object', kwargs)
+        if key not in self._objects:
+            self._objects[key] = cls.get_object(self.context, **kwargs)
+        return self._objects[key]
+
+    def get_objects(self, cls, **kwargs):
+        key = self._key(cls, 'objects', kwargs)
+        if key not in self._objects:
+            self._objects[key] = cls.get_objects(self.context, **kwargs)
+        return self._objects[key]
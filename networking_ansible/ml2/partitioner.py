@@ -0,0 +1,88 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from oslo_log import log as logging
+from oslo_service import loopingcall
+
+LOG = logging.getLogger(__name__)
+
+GROUP_ID = 'networking-ansible-switches'
+
+
+def _to_str(member_id):
+    if isinstance(member_id, bytes):
+        return member_id.decode('utf-8')
+    return member_id
+
+
+class SwitchPartitioner(object):
+    """Assign every switch to one live coordination group member
+
+    Members join a tooz partitioned group which places them on a consistent
+    hash ring. A switch is owned by the member its name hashes to, so only
+    a fraction of the switches move when a member joins or leaves the group.
+    Membership changes are picked up by running the coordinator watchers
+    periodically.
+    """
+
+    def __init__(self, coordinator, member_id, interval):
+        self.coordinator = coordinator
+        self.member_id = _to_str(member_id)
+        self.interval = interval
+        self._partitioner = None
+        self._loop = None
+
+    def start(self):
+        self._partitioner = self.coordinator.join_partitioned_group(GROUP_ID)
+        self._loop = loopingcall.FixedIntervalLoopingCall(self.refresh)
+        self._loop.start(interval=self.interval,
+                         initial_delay=self.interval,
+                         stop_on_exception=False)
+        LOG.info('Joined switch partitioning group %(group)s as %(member)s',
+                 {'group': GROUP_ID, 'member': self.member_id})
+
+    def stop(self):
+        if self._loop:
+            self._loop.stop()
+            self._loop = None
+        if self._partitioner:
+            self.coordinator.leave_partitioned_group(self._partitioner)
+            self._partitioner = None
+
+    def refresh(self):
+        """Rebalance the hash ring on membership changes"""
+        self.coordinator.run_watchers()
+
+    def owner(self, switch_name):
+        """Return the member id owning a switch
+
+        :param switch_name: the name of the switch
+        :returns: the owning member id or None if partitioning isn't running
+        """
+        if not self._partitioner:
+            return None
+        members = self._partitioner.members_for_object(switch_name)
+        if not members:
+            return None
+        return _to_str(next(iter(members)))
+
+    def owns(self, switch_name):
+        """Return whether this member owns a switch
+
+        Switches are considered owned by everyone until the partitioner has
+        joined the group so that operations are never left without an owner.
+        """
+        owner = self.owner(switch_name)
+        return owner is None or owner == self.member_id
@@ -0,0 +1,130 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+
+from neutron.db import models_v2
+from neutron.db import provisioning_blocks
+from neutron.objects import provisioning_blocks as pb_obj
+from neutron_lib.callbacks import events
+from neutron_lib.callbacks import registry
+from neutron_lib.callbacks import resources
+from neutron_lib import context as n_context
+from neutron_lib.db import api as db_api
+from oslo_log import log as logging
+
+from networking_ansible import constants as c
+
+LOG = logging.getLogger(__name__)
+
+
+class ProvisioningBatcher(object):
+    """Complete the provisioning blocks of many ports at once
+
+    Ports whose switch configuration is done are collected for a short
+    window. The provisioning blocks of all of them are then removed in a
+    single DB transaction instead of one transaction per port. Once it is
+    committed, the ports left without any block are found with a single
+    query and their completion is published. Like neutron's
+    provisioning_complete, the check runs outside of the transaction,
+    whose snapshot could still show blocks another entity removed
+    meanwhile and leave the port down.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def complete(self, port_id):
+        """Queue the completion of a port's provisioning block"""
+        with self._lock:
+            first = not self._pending
+            self._pending.add(port_id)
+        if first:
+            timer = threading.Timer(self.window, self.flush)
+            timer.daemon = True
+            timer.start()
+
+    def flush(self):
+        with self._lock:
+            port_ids = sorted(self._pending)
+            self._pending.clear()
+        if not port_ids:
+            return
+
+        context = n_context.get_admin_context()
+        try:
+            attr_ids = self._remove_blocks(context, port_ids)
+            completed = self._unblocked(context, attr_ids)
+        except Exception as e:
+            LOG.error('Failed to remove the provisioning blocks of ports '
+                      '{ports}, reason: {err}'.format(ports=port_ids, err=e))
+            # completing the ports one by one removes the blocks left behind
+            self._complete_each(context, port_ids)
+            return
+
+        for port_id in completed:
+            try:
+                registry.publish(resources.PORT,
+                                 provisioning_blocks.PROVISIONING_COMPLETE,
+                                 c.NETWORKING_ENTITY,
+                                 payload=events.DBEventPayload(
+                                     context, resource_id=port_id))
+            except Exception as e:
+                LOG.error('Failed to complete the provisioning of port '
+                          '{port_id}, reason: {err}'.format(port_id=port_id,
+                                                            err=e))
+        LOG.debug('Completed the provisioning of {} of {} ports'.format(
+            len(completed), len(port_ids)))
+
+    @staticmethod
+    def _remove_blocks(context, port_ids):
+        """Remove the blocks of ports
+
+        :returns: {standard_attr_id: port_id} of the ports still existing
+        """
+        with db_api.CONTEXT_WRITER.using(context):
+            query = context.session.query(models_v2.Port.standard_attr_id,
+                                          models_v2.Port.id)
+            attr_ids = dict(query.filter(models_v2.Port.id.in_(port_ids)))
+            if attr_ids:
+                pb_obj.ProvisioningBlock.delete_objects(
+                    context, entity=c.NETWORKING_ENTITY,
+                    standard_attr_id=list(attr_ids))
+        return attr_ids
+
+    @staticmethod
+    def _unblocked(context, attr_ids):
+        """Return the ports without any provisioning block left"""
+        if not attr_ids:
+            return []
+        blocked = {block.standard_attr_id for block in
+                   pb_obj.ProvisioningBlock.get_objects(
+                       context, standard_attr_id=list(attr_ids))}
+        return sorted(port_id for attr_id, port_id in attr_ids.items()
+                      if attr_id not in blocked)
+
+    @staticmethod
+    def _complete_each(context, port_ids):
+        """Complete the provisioning of ports one transaction at a time"""
+        for port_id in port_ids:
+            try:
+                provisioning_blocks.provisioning_complete(
+                    context, port_id, resources.PORT, c.NETWORKING_ENTITY)
+            except Exception as e:
+                LOG.error('Failed to complete the provisioning of port '
+                          '{port_id}, reason: {err}'.format(port_id=port_id,
+                                                            err=e))
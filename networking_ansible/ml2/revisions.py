@@ -0,0 +1,61 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import threading
+
+# the least recently applied switch ports are forgotten past this size
+MAX_ENTRIES = 65536
+
+
+class AppliedRevisions(object):
+    """Last port revision applied to every switch port by this process
+
+    A port operation whose revision is not newer than the one already
+    applied to the same switch port has nothing left to change on the
+    switch. Revisions are only recorded once the switch was configured.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        # {(port_id, switch_name, switch_port): revision_number}
+        self._applied = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_applied(self, port_id, switch_name, switch_port, revision):
+        if revision is None:
+            return False
+        with self._lock:
+            applied = self._applied.get((port_id, switch_name, switch_port))
+        return applied is not None and revision <= applied
+
+    def record(self, port_id, switch_name, switch_port, revision):
+        if revision is None:
+            return
+        key = (port_id, switch_name, switch_port)
+        with self._lock:
+            self._applied[key] = max(revision, self._applied.get(key, 0))
+            self._applied.move_to_end(key)
+            while len(self._applied) > self.max_entries:
+                self._applied.popitem(last=False)
+
+    def forget(self, port_id, switch_name=None, switch_port=None):
+        """Forget a switch port of a port or, by default, all of them"""
+        with self._lock:
+            for key in list(self._applied):
+                if key[0] == port_id and \
+                        switch_name in (None, key[1]) and \
+                        switch_port in (None, key[2]):
+                    del self._applied[key]
@@ -0,0 +1,131 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from neutron_lib import rpc as n_rpc
+from oslo_log import log as logging
+import oslo_messaging
+
+from networking_ansible import config
+from networking_ansible import constants as c
+
+LOG = logging.getLogger(__name__)
+CONF = config.CONF
+
+TOPIC = 'networking_ansible_switch'
+
+
+def topic_for(member_id):
+    """Return the RPC topic a partitioning group member consumes"""
+    return '{}.{}'.format(TOPIC, member_id)
+
+
+class SwitchOpsRpcApi(object):
+    """Client side of the switch operations RPC API
+
+    API version history:
+        1.0 - Initial version.
+    """
+
+    def __init__(self):
+        target = oslo_messaging.Target(topic=TOPIC, version='1.0')
+        self.client = n_rpc.get_client(target)
+
+    def _prepare(self, member_id):
+        return self.client.prepare(
+            version='1.0',
+            topic=topic_for(member_id),
+            timeout=CONF.ml2_ansible.partition_rpc_timeout)
+
+    def ensure_port(self, context, member_id, port, switch_name,
+                    switch_port, physnet, segmentation_id, delete=False,
+                    priority=c.PRIORITY_UPDATE):
+        cctxt = self._prepare(member_id)
+        return cctxt.call(context, 'ensure_port',
+                          port=port,
+                          switch_name=switch_name,
+                          switch_port=switch_port,
+                          physnet=physnet,
+                          segmentation_id=segmentation_id,
+                          delete=delete,
+                          priority=priority)
+
+    def change_vlan(self, context, member_id, switch_name, action,
+                    network_id, segmentation_id, physnet=None):
+        cctxt = self._prepare(member_id)
+        return cctxt.call(context, 'change_vlan',
+                          switch_name=switch_name,
+                          action=action,
+                          network_id=network_id,
+                          segmentation_id=segmentation_id,
+                          physnet=physnet)
+
+    def ensure_subports(self, context, member_id, port_id, switch_name,
+                        switch_port):
+        cctxt = self._prepare(member_id)
+        return cctxt.call(context, 'ensure_subports',
+                          port_id=port_id,
+                          switch_name=switch_name,
+                          switch_port=switch_port)
+
+
+class SwitchOpsRpcCallback(object):
+    """Server side of the switch operations RPC API
+
+    Runs the operations sent by other workers for the switches owned by
+    this worker.
+    """
+
+    target = oslo_messaging.Target(version='1.0')
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def ensure_port(self, context, port, switch_name, switch_port, physnet,
+                    segmentation_id, delete=False,
+                    priority=c.PRIORITY_UPDATE):
+        LOG.debug('Running routed port operation for port {port_id} on '
+                  'switch {switch_name}'.format(port_id=port['id'],
+                                                switch_name=switch_name))
+        return self.driver._ensure_port(port, context, switch_name,
+                                        switch_port, physnet,
+                                        segmentation_id, delete=delete,
+                                        priority=priority)
+
+    def change_vlan(self, context, switch_name, action, network_id,
+                    segmentation_id, physnet=None):
+        LOG.debug('Running routed VLAN {action} of network {net_id} on '
+                  'switch {switch_name}'.format(action=action,
+                                                net_id=network_id,
+                                                switch_name=switch_name))
+        return self.driver._change_vlan(context, switch_name, action,
+                                        network_id, segmentation_id,
+                                        physnet)
+
+    def ensure_subports(self, context, port_id, switch_name, switch_port):
+        LOG.debug('Running routed subports operation for port {port_id} '
+                  'on switch {switch_name}'.format(port_id=port_id,
+                                                   switch_name=switch_name))
+        return self.driver._ensure_subports(port_id, context, switch_name,
+                                            switch_port)
+
+
+def start_server(driver, member_id):
+    """Consume the switch operations sent to a group member"""
+    conn = n_rpc.Connection()
+    conn.create_consumer(topic_for(member_id),
+                         [SwitchOpsRpcCallback(driver)],
+                         fanout=False)
+    conn.consume_in_threads()
+    return conn
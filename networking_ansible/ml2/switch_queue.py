@@ -0,0 +1,272 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+from concurrent import futures
+import itertools
+import threading
+import time
+
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+
+class _Operation(object):
+    def __init__(self, priority, func, args, kwargs):
+        self.priority = priority
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.queued_at = time.monotonic()
+        self.future = futures.Future()
+
+    def effective_priority(self, now, aging_interval):
+        """Raise the priority of an operation the longer it waits"""
+        if not aging_interval:
+            return self.priority
+        return self.priority - int((now - self.queued_at) / aging_interval)
+
+    def run(self):
+        try:
+            self.future.set_result(self.func(*self.args, **self.kwargs))
+        except Exception as e:
+            self.future.set_exception(e)
+
+    def run_staged(self, committer):
+        """Run the operation staging its device operations
+
+        :returns: the staged device operations and the outcome of the
+                  operation, its result or the exception it raised
+        """
+        with committer.staging() as staged:
+            try:
+                outcome = (self.func(*self.args, **self.kwargs), None)
+            except Exception as e:
+                outcome = (None, e)
+        return staged, outcome
+
+
+class Committer(object):
+    """Stage the device operations of queued operations into one commit
+
+    :param window: seconds to wait for more operations to join a commit
+    :param staging: returns a context manager collecting the device
+                    operations run within it into a list instead of
+                    running them
+    :param commit: commit(switch_name, staged) applies the staged device
+                   operations and returns the exception of every one that
+                   failed, None for the others
+    """
+
+    def __init__(self, window, staging, commit):
+        self.window = window
+        self.staging = staging
+        self.commit = commit
+
+
+class SwitchQueue(object):
+    """Serial actor running the operations of one switch
+
+    Operations are queued with a priority class and run one at a time by a
+    single consumer thread. The next operation is always the one with the
+    best priority; operations of the same class run in order. An operation
+    gains one priority class for every aging interval it has been waiting
+    so background work can't be starved by a steady stream of binds.
+
+    The consumer takes the distributed switch lock once and keeps running
+    queued operations under it, up to the batch size, instead of taking the
+    lock once per operation.
+
+    With a committer, operations are collected into a batch until it is
+    full or no operation was queued for the commit window. Only then is the
+    switch lock taken to stage the device operations of the batch and
+    apply them in a single commit. An operation fails when one of its own
+    device operations failed, the others of the commit are not affected.
+    """
+
+    def __init__(self, switch_name, get_lock, batch_size, aging_interval,
+                 committer=None):
+        self.switch_name = switch_name
+        self._get_lock = get_lock
+        self.batch_size = batch_size
+        self.aging_interval = aging_interval
+        self.committer = committer
+        # {priority: deque of operations}
+        self._pending = collections.defaultdict(collections.deque)
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._consume,
+                                        name='switch-queue-' + switch_name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, priority, func, *args, **kwargs):
+        """Queue an operation
+
+        :param priority: the priority class, lower values run first
+        :returns: a future for the result of the operation
+        """
+        op = _Operation(priority, func, args, kwargs)
+        with self._cond:
+            self._pending[priority].append(op)
+            self._cond.notify()
+        return op.future
+
+    def _pop(self, block=True, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                while not any(self._pending.values()):
+                    if not block:
+                        return None
+                    if deadline is None:
+                        self._cond.wait()
+                        continue
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                    self._cond.wait(remaining)
+
+                now = time.monotonic()
+                best = None
+                for ops in self._pending.values():
+                    if not ops:
+                        continue
+                    key = (ops[0].effective_priority(now,
+                                                     self.aging_interval),
+                           ops[0].queued_at)
+                    if best is None or key < best[0]:
+                        best = (key, ops)
+                op = best[1].popleft()
+                # operations whose caller gave up waiting are dropped
+                if op.future.set_running_or_notify_cancel():
+                    return op
+
+    def _consume(self):
+        while True:
+            op = self._pop()
+            if self.committer:
+                self._run_commit(op)
+            else:
+                self._run_batch(op)
+
+    def _run_batch(self, op):
+        count = 0
+        try:
+            lock = self._get_lock(self.switch_name)
+            with lock:
+                while op:
+                    op.run()
+                    count += 1
+                    # pick the next operation only now so that an urgent
+                    # one queued meanwhile runs before the rest
+                    op = self._pop(block=False) \
+                        if count < self.batch_size else None
+        except Exception as e:
+            # the lock could not be acquired or released, fail the current
+            # operation so its caller doesn't wait forever
+            LOG.error('Failed to run queued operations on switch '
+                      '{switch_name}, reason: {err}'.format(
+                          switch_name=self.switch_name, err=e))
+            if op and not op.future.done():
+                op.future.set_exception(e)
+        LOG.debug('Ran {count} queued operations on switch '
+                  '{switch_name}'.format(count=count,
+                                         switch_name=self.switch_name))
+
+    def _run_commit(self, op):
+        # collect the batch before taking the lock, so the switch isn't
+        # held while waiting for operations to join the commit
+        queued = [op]
+        while len(queued) < self.batch_size:
+            op = self._pop(timeout=self.committer.window)
+            if op is None:
+                break
+            queued.append(op)
+        # [(operation, staged device operations, outcome)]
+        batch = []
+        try:
+            lock = self._get_lock(self.switch_name)
+            with lock:
+                # the operations read the state they change, they are
+                # staged under the lock as well
+                for op in queued:
+                    staged, outcome = op.run_staged(self.committer)
+                    batch.append((op, staged, outcome))
+                staged = [device_op for _, ops, _ in batch
+                          for device_op in ops]
+                errors = self.committer.commit(self.switch_name, staged) \
+                    if staged else []
+        except Exception as e:
+            LOG.error('Failed to commit queued operations on switch '
+                      '{switch_name}, reason: {err}'.format(
+                          switch_name=self.switch_name, err=e))
+            for failed_op in queued:
+                if not failed_op.future.done():
+                    failed_op.future.set_exception(e)
+            return
+
+        errors = iter(errors)
+        for queued_op, ops, (result, error) in batch:
+            # the first failed device operation of the queued operation
+            # fails it, unless it failed on its own already
+            op_errors = [err for err in itertools.islice(errors, len(ops))
+                         if err is not None]
+            error = error or (op_errors[0] if op_errors else None)
+            if error is not None:
+                queued_op.future.set_exception(error)
+            else:
+                queued_op.future.set_result(result)
+        LOG.debug('Committed {ops} device operations of {count} queued '
+                  'operations on switch {switch_name}'.format(
+                      ops=len(staged), count=len(batch),
+                      switch_name=self.switch_name))
+
+
+class SwitchQueues(object):
+    """One serial actor per switch, created on first use"""
+
+    def __init__(self, get_lock, batch_size, aging_interval,
+                 get_committer=None):
+        self._get_lock = get_lock
+        self.batch_size = batch_size
+        self.aging_interval = aging_interval
+        # returns the committer of a switch aggregating commits, if any
+        self._get_committer = get_committer or (lambda switch_name: None)
+        self._queues = {}
+        self._queues_lock = threading.Lock()
+
+    def get(self, switch_name):
+        with self._queues_lock:
+            if switch_name not in self._queues:
+                self._queues[switch_name] = SwitchQueue(
+                    switch_name, self._get_lock, self.batch_size,
+                    self.aging_interval, self._get_committer(switch_name))
+            return self._queues[switch_name]
+
+    def run(self, switch_name, priority, func, *args, timeout=None,
+            **kwargs):
+        """Run an operation on the switch's actor and wait for its result
+
+        :param timeout: seconds to wait for the result, an operation that
+                        didn't start by then is dropped from the queue
+        :raises: concurrent.futures.TimeoutError when the timeout expired
+        """
+        future = self.get(switch_name).submit(priority, func, *args, **kwargs)
+        try:
+            return future.result(timeout)
+        except futures.TimeoutError:
+            future.cancel()
+            raise
@@ -0,0 +1,173 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+import time
+
+from oslo_log import log as logging
+from oslo_utils import importutils
+
+eventlet = importutils.try_import('eventlet')
+tpool = importutils.try_import('eventlet.tpool')
+
+LOG = logging.getLogger(__name__)
+
+# operations waiting longer than this many seconds for a thread or a
+# switch lock are logged with the pool's stats
+WAIT_LOG_THRESHOLD = 1.0
+
+
+def _monkey_patched():
+    return bool(eventlet and eventlet.patcher.is_monkey_patched('thread'))
+
+
+class DeviceThreadPool(object):
+    """Run blocking device operations on native threads
+
+    neutron-server runs under eventlet, so a call blocking its OS thread,
+    like an Ansible run, stalls every greenthread of the worker including
+    the API requests. Calls run through the pool are handed to eventlet's
+    native thread pool when eventlet monkey patched the process and run
+    directly otherwise. At most ``size`` calls run at a time, the others
+    wait for a free thread without blocking the hub. As many native threads
+    again are kept for switch lock waits.
+
+    :param size: the number of calls running at a time
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock_slots = threading.BoundedSemaphore(size)
+        self._stats_lock = threading.Lock()
+        self._waiting = 0
+        self._running = 0
+        self._completed = 0
+        self._max_wait = 0.0
+        self._lock_waits = 0
+        self._lock_wait_time = 0.0
+        if tpool and _monkey_patched():
+            tpool.set_num_threads(size * 2)
+
+    def stats(self):
+        """Return the queue metrics of the pool"""
+        with self._stats_lock:
+            return {'size': self.size,
+                    'waiting': self._waiting,
+                    'running': self._running,
+                    'completed': self._completed,
+                    'max_wait': self._max_wait,
+                    'lock_waits': self._lock_waits,
+                    'lock_wait_time': self._lock_wait_time}
+
+    def execute(self, func, *args, **kwargs):
+        """Run a blocking call on a native thread and return its result"""
+        start = time.monotonic()
+        with self._stats_lock:
+            self._waiting += 1
+        try:
+            self._slots.acquire()
+        finally:
+            with self._stats_lock:
+                self._waiting -= 1
+        waited = time.monotonic() - start
+        with self._stats_lock:
+            self._running += 1
+            self._max_wait = max(self._max_wait, waited)
+            waiting = self._waiting
+        if waited >= WAIT_LOG_THRESHOLD:
+            LOG.debug('Device operation waited {waited:.2f} seconds for a '
+                      'free thread, {waiting} operations are waiting, '
+                      'pool stats: {stats}'.format(waited=waited,
+                                                   waiting=waiting,
+                                                   stats=self.stats()))
+        try:
+            return self._native(func, *args, **kwargs)
+        finally:
+            self._slots.release()
+            with self._stats_lock:
+                self._running -= 1
+                self._completed += 1
+
+    def lock(self, lock):
+        """Wrap a coordination lock to be waited for without blocking"""
+        return BlockingLock(lock, self)
+
+    @staticmethod
+    def _native(func, *args, **kwargs):
+        if tpool and _monkey_patched():
+            return tpool.execute(func, *args, **kwargs)
+        return func(*args, **kwargs)
+
+    def _wait_lock(self, lock, blocking):
+        """Wait for a lock on a native thread kept for lock waits
+
+        :param blocking: True or the seconds to wait for the lock
+        """
+        start = time.monotonic()
+        try:
+            timeout = None if blocking is True else blocking
+            if not self._lock_slots.acquire(timeout=timeout):
+                return False
+            try:
+                if timeout is not None:
+                    blocking = max(start + timeout - time.monotonic(), 0)
+                return self._native(lock.acquire, blocking=blocking)
+            finally:
+                self._lock_slots.release()
+        finally:
+            waited = time.monotonic() - start
+            with self._stats_lock:
+                self._lock_waits += 1
+                self._lock_wait_time += waited
+            if waited >= WAIT_LOG_THRESHOLD:
+                LOG.debug('Waited {waited:.2f} seconds for a switch lock, '
+                          'pool stats: {stats}'.format(waited=waited,
+                                                       stats=self.stats()))
+
+
+class BlockingLock(object):
+    """Coordination lock waited for on a native thread
+
+    A blocking acquisition of some coordination backends blocks the OS
+    thread. A free lock is taken right away, a held one is waited for by
+    a blocking acquisition on one of the pool's native threads, which only
+    suspends the caller's greenthread.
+    """
+
+    def __init__(self, lock, pool):
+        self._lock = lock
+        self._pool = pool
+
+    def acquire(self, blocking=True):
+        """Acquire the lock
+
+        :param blocking: wait for the lock, or the seconds to wait for it
+        """
+        if self._lock.acquire(blocking=False):
+            return True
+        if not blocking:
+            return False
+        return self._pool._wait_lock(self._lock, blocking)
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
@@ -0,0 +1,161 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+import time
+
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+# the adaptive rate never drops below this fraction of the configured rate
+MIN_RATE_FACTOR = 0.1
+# the adaptive rate grows by this fraction of the configured rate per
+# healthy device operation and is halved on errors or slow operations
+INCREASE_FACTOR = 0.1
+DECREASE_FACTOR = 0.5
+
+
+class TokenBucket(object):
+    """Token bucket rate limiter
+
+    :param rate: tokens added per second
+    :param burst: maximum number of tokens the bucket holds
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill()
+            self.rate = rate
+
+    def acquire(self):
+        """Take a token, waiting for one to become available"""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveRate(object):
+    """Additive increase, multiplicative decrease of a bucket's rate
+
+    The rate grows a little with every healthy device operation, up to the
+    configured rate, and is cut down whenever an operation fails or takes
+    longer than the latency threshold.
+    """
+
+    def __init__(self, bucket, max_rate, latency_threshold):
+        self.bucket = bucket
+        self.max_rate = max_rate
+        self.min_rate = max_rate * MIN_RATE_FACTOR
+        self.latency_threshold = latency_threshold
+
+    def record(self, latency, failed=False):
+        rate = self.bucket.rate
+        if failed or latency > self.latency_threshold:
+            rate = max(self.min_rate, rate * DECREASE_FACTOR)
+        else:
+            rate = min(self.max_rate, rate + self.max_rate * INCREASE_FACTOR)
+        if rate != self.bucket.rate:
+            LOG.debug('Adjusting device operation rate from {old} to {new} '
+                      'per second'.format(old=self.bucket.rate, new=rate))
+            self.bucket.set_rate(rate)
+
+
+class SwitchThrottle(object):
+    """Rate limit the device operations of one switch"""
+
+    def __init__(self, switch_name, rate, burst, adaptive,
+                 latency_threshold):
+        self.switch_name = switch_name
+        self.bucket = TokenBucket(rate, burst)
+        self.adaptive = None
+        if adaptive:
+            self.adaptive = AdaptiveRate(self.bucket, rate, latency_threshold)
+
+    def call(self, func, *args, **kwargs):
+        self.bucket.acquire()
+        start = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            if self.adaptive:
+                self.adaptive.record(time.monotonic() - start, failed=True)
+            raise
+        if self.adaptive:
+            self.adaptive.record(time.monotonic() - start)
+        return result
+
+
+class Throttles(object):
+    """Per switch throttles built from the switch inventory
+
+    Switches are throttled when their ``[ansible:<host>]`` section sets
+    ``rate_limit``, the number of device operations per second, and
+    optionally ``rate_burst`` and ``adaptive_rate``. The limits are kept
+    in memory and apply per neutron-server worker.
+    """
+
+    def __init__(self, inventory, latency_threshold):
+        self._throttles = {}
+        for switch_name, switch in inventory.items():
+            if 'rate_limit' not in switch:
+                if switch.get('adaptive_rate'):
+                    LOG.warning('Ignoring adaptive_rate on switch {} '
+                                'without a rate_limit'.format(switch_name))
+                continue
+            try:
+                rate = float(switch['rate_limit'])
+                burst = int(switch.get('rate_burst', 1))
+                if rate <= 0 or burst < 1:
+                    raise ValueError()
+            except ValueError:
+                LOG.error('Invalid rate_limit {} or rate_burst {} on switch '
+                          '{}, it will not be rate limited'.format(
+                              switch['rate_limit'],
+                              switch.get('rate_burst'),
+                              switch_name))
+                continue
+            self._throttles[switch_name] = SwitchThrottle(
+                switch_name, rate, burst,
+                switch.get('adaptive_rate', False),
+                latency_threshold)
+
+    def get(self, switch_name):
+        return self._throttles.get(switch_name)
+
+    def call(self, switch_name, func, *args, **kwargs):
+        """Run a device operation within the switch's rate limit"""
+        throttle = self._throttles.get(switch_name)
+        if not throttle:
+            return func(*args, **kwargs)
+        return throttle.call(func, *args, **kwargs)
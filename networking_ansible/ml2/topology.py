@@ -0,0 +1,115 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import threading
+
+from neutron_lib.api.definitions import provider_net
+from neutron_lib.callbacks import events
+from neutron_lib.callbacks import registry
+from neutron_lib.callbacks import resources
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+Segment = collections.namedtuple(
+    'Segment', ['network_type', 'physical_network', 'segmentation_id'])
+
+
+def _latest_state(payload, kwargs, key):
+    # callbacks are published with a payload or, by older publishers,
+    # with the resource as a keyword argument
+    if payload is not None:
+        return payload.latest_state
+    return kwargs.get(key)
+
+
+class TopologyIndex(object):
+    """In-memory index of the networks' segments
+
+    The segments of a network are looked up for every port operation. They
+    are kept in memory, filled from the network callbacks of this process
+    and from the networks the driver reads from the DB, and dropped when
+    the network or one of its segments is deleted or created. Dynamic
+    segments are allocated and released by any worker, they are left out
+    and always read from the DB.
+
+    The index is only a hint: a miss means the caller reads the network
+    from the DB.
+    """
+
+    def __init__(self):
+        # {network_id: [Segment]}
+        self._segments = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        registry.subscribe(self._network_created,
+                           resources.NETWORK, events.AFTER_CREATE)
+        registry.subscribe(self._network_deleted,
+                           resources.NETWORK, events.AFTER_DELETE)
+        for event in (events.AFTER_CREATE, events.AFTER_DELETE):
+            registry.subscribe(self._segment_changed,
+                               resources.SEGMENT, event)
+
+    def segments(self, network_id):
+        """Return the segments of a network, None if it isn't indexed"""
+        with self._lock:
+            return self._segments.get(network_id)
+
+    def add_network(self, network):
+        """Index the static segments of a network object read from the DB"""
+        segments = [Segment(s.network_type, s.physical_network,
+                            s.segmentation_id) for s in network.segments
+                    if not s.is_dynamic]
+        with self._lock:
+            self._segments[network.id] = segments
+        return segments
+
+    def remove_network(self, network_id):
+        with self._lock:
+            self._segments.pop(network_id, None)
+
+    def _network_created(self, resource, event, trigger, payload=None,
+                         **kwargs):
+        network = _latest_state(payload, kwargs, 'network')
+        if not network:
+            return
+        if network.get('segments'):
+            segments = network['segments']
+        elif network.get(provider_net.NETWORK_TYPE):
+            segments = [network]
+        else:
+            return
+        with self._lock:
+            self._segments[network['id']] = [
+                Segment(s[provider_net.NETWORK_TYPE],
+                        s.get(provider_net.PHYSICAL_NETWORK),
+                        s.get(provider_net.SEGMENTATION_ID))
+                for s in segments]
+        LOG.debug('Indexed segments of network {}'.format(network['id']))
+
+    def _network_deleted(self, resource, event, trigger, payload=None,
+                         **kwargs):
+        network = _latest_state(payload, kwargs, 'network')
+        if network:
+            self.remove_network(network['id'])
+
+    def _segment_changed(self, resource, event, trigger, payload=None,
+                         **kwargs):
+        segment = _latest_state(payload, kwargs, 'segment')
+        if segment:
+            self.remove_network(segment['network_id'])
+
@@ -0,0 +1,175 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from concurrent import futures
+import threading
+
+from neutron.objects.network import Network
+from neutron.objects.network import NetworkSegment
+from neutron_lib import context as n_context
+from oslo_log import log as logging
+
+from networking_ansible import constants as c
+from networking_ansible import exceptions
+from networking_ansible.ml2 import object_cache
+
+LOG = logging.getLogger(__name__)
+
+CREATE = 'create'
+DELETE = 'delete'
+
+
+class _Intent(object):
+    def __init__(self, action, network_id, segmentation_id, physnet):
+        self.action = action
+        self.network_id = network_id
+        self.segmentation_id = segmentation_id
+        self.physnet = physnet
+        self.future = futures.Future()
+
+
+class VlanBatcher(object):
+    """Create and delete the VLANs of many networks in bulk
+
+    The VLAN changes of the network hooks are collected per switch for a
+    short window and then applied under a single switch lock with one
+    create_vlans and one delete_vlans device operation. The hooks wait for
+    the outcome of their own network: True once the VLAN is changed, False
+    when the network or segment changed in the meantime and there was
+    nothing to do, or the exception of the failed VLAN.
+    """
+
+    def __init__(self, driver, window):
+        self.driver = driver
+        self.window = window
+        # {switch_name: [_Intent]}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def submit(self, switch_name, action, network_id, segmentation_id,
+               physnet=None):
+        """Queue a VLAN change of a network on a switch
+
+        :returns: a future for the outcome of the change
+        """
+        intent = _Intent(action, network_id, segmentation_id, physnet)
+        with self._lock:
+            first = switch_name not in self._pending
+            self._pending.setdefault(switch_name, []).append(intent)
+        if first:
+            timer = threading.Timer(self.window, self.flush, [switch_name])
+            timer.daemon = True
+            timer.start()
+        return intent.future
+
+    def flush(self, switch_name):
+        with self._lock:
+            intents = self._pending.pop(switch_name, [])
+        if not intents:
+            return
+        priority = c.PRIORITY_UPDATE
+        if all(i.action == DELETE for i in intents):
+            priority = c.PRIORITY_DELETE
+        try:
+            # the outcomes are only reported once the switch lock was
+            # released, a commit aggregated by the switch queue can fail
+            # them all
+            outcomes = self.driver._switch_locked(switch_name,
+                                                  self._apply_locked,
+                                                  switch_name, intents,
+                                                  priority=priority)
+        except Exception as e:
+            LOG.error('Failed to change VLANs on ansible host: {host}, '
+                      'reason: {err}'.format(host=switch_name, err=e))
+            for intent in intents:
+                intent.future.set_exception(
+                    exceptions.NetworkingAnsibleMechException(e))
+            return
+        for intent, result, err in outcomes:
+            if err is None:
+                intent.future.set_result(result)
+            else:
+                intent.future.set_exception(
+                    exceptions.NetworkingAnsibleMechException(err))
+
+    def _apply_locked(self, switch_name, intents):
+        """Apply the VLAN changes of a switch
+
+        :returns: [(intent, result, exception)]
+        """
+        cache = object_cache.ObjectCache(n_context.get_admin_context())
+        changes = {CREATE: {}, DELETE: {}}
+        outcomes = []
+        for intent in intents:
+            if self._is_current(cache, intent):
+                changes[intent.action].setdefault(
+                    intent.segmentation_id, []).append(intent)
+            else:
+                outcomes.append((intent, False, None))
+
+        for action, operation in ((DELETE, 'delete_vlans'),
+                                  (CREATE, 'create_vlans')):
+            if not changes[action]:
+                continue
+            errors = self._bulk_call(switch_name, operation,
+                                     sorted(changes[action]))
+            for segmentation_id, vlan_intents in changes[action].items():
+                err = errors.get(segmentation_id)
+                outcomes.extend((intent, err is None, err)
+                                for intent in vlan_intents)
+            done = set(changes[action]).difference(errors)
+            LOG.info('VLANs {vlans} have been {action}d on ansible host '
+                     '{host}'.format(vlans=sorted(done), action=action,
+                                     host=switch_name))
+        return outcomes
+
+    def _bulk_call(self, switch_name, operation, segmentation_ids):
+        """Run a bulk VLAN operation and return the errors per VLAN"""
+        try:
+            self.driver._device_call(switch_name, operation,
+                                     segmentation_ids)
+        except exceptions.BulkVlanException as e:
+            for vlan, err in e.errors.items():
+                LOG.error('Failed to {op} {vlan} on ansible host: {host}, '
+                          'reason: {err}'.format(op=operation, vlan=vlan,
+                                                 host=switch_name, err=err))
+            return e.errors
+        except Exception as e:
+            LOG.error('Failed to {op} {vlans} on ansible host: {host}, '
+                      'reason: {err}'.format(op=operation,
+                                             vlans=segmentation_ids,
+                                             host=switch_name, err=e))
+            return dict.fromkeys(segmentation_ids, e)
+        return {}
+
+    @staticmethod
+    def _is_current(cache, intent):
+        if intent.action == CREATE:
+            # the network may have been deleted meanwhile
+            net = cache.get_object(Network, id=intent.network_id)
+            return bool(net) and intent.segmentation_id in [
+                s.segmentation_id for s in net.segments]
+
+        # the VLAN may have been reused by a new network meanwhile
+        segments = cache.get_objects(NetworkSegment,
+                                     segmentation_id=intent.segmentation_id)
+        for segment in segments:
+            if segment.physical_network == intent.physnet and \
+               segment.network_type == 'vlan':
+                LOG.debug('Not deleting segment {} from {} because it was '
+                          'recreated'.format(intent.segmentation_id,
+                                             intent.physnet))
+                return False
+        return True
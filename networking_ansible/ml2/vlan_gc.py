@@ -0,0 +1,184 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import threading
+import time
+
+from neutron.objects.network import NetworkSegment
+from neutron_lib import context as n_context
+from oslo_log import log as logging
+from oslo_service import loopingcall
+
+from networking_ansible import constants as c
+from networking_ansible import exceptions
+
+LOG = logging.getLogger(__name__)
+
+
+class VlanGarbageCollector(object):
+    """Deferred removal of unused VLANs from the switches
+
+    The removal candidates of a switch are worked out from the DB: the VLAN
+    segments that disappeared since the previous run of the worker.
+    Deleting a network also records its VLAN as a candidate right away. A
+    periodic task checks the candidates that have been waiting longer than
+    the grace period against the VLAN segments still present in the DB and
+    removes the unused ones with one bulk operation per switch. A network
+    recreated with the same VLAN during the grace period keeps its VLAN on
+    the switches. A switch without a physical network carries the VLANs of
+    every physical network, a VLAN stays on it while any physical network
+    uses it.
+    """
+
+    def __init__(self, driver, interval, grace_period):
+        self.driver = driver
+        self.interval = interval
+        self.grace_period = grace_period
+        # {switch_name: {(physnet, segmentation_id): scheduled_at}}
+        self._pending = collections.defaultdict(dict)
+        self._pending_lock = threading.Lock()
+        # {(physnet, segmentation_id)} in use at the previous run
+        self._in_use = None
+        self._loop = None
+
+    def start(self):
+        self._loop = loopingcall.FixedIntervalLoopingCall(self.collect)
+        self._loop.start(interval=self.interval,
+                         initial_delay=self.interval,
+                         stop_on_exception=False)
+        LOG.debug('VLAN garbage collector started with an interval of '
+                  '%(interval)s seconds and a grace period of %(grace)s '
+                  'seconds', {'interval': self.interval,
+                              'grace': self.grace_period})
+
+    def stop(self):
+        if self._loop:
+            self._loop.stop()
+            self._loop = None
+
+    def schedule(self, switch_name, segmentation_id, physnet):
+        """Mark a VLAN as a removal candidate on a switch"""
+        with self._pending_lock:
+            self._pending[switch_name][(physnet, segmentation_id)] = \
+                time.monotonic()
+        LOG.debug('VLAN {seg} on {switch_name} scheduled for garbage '
+                  'collection'.format(seg=segmentation_id,
+                                      switch_name=switch_name))
+
+    def pending(self, switch_name):
+        with self._pending_lock:
+            return dict(self._pending.get(switch_name, {}))
+
+    def collect(self):
+        """Remove expired, unused VLAN candidates from the switches"""
+        context = n_context.get_admin_context()
+        in_use = self._vlans_in_use(context)
+        # the first run only learns the VLANs in use
+        if self._in_use is not None:
+            self._schedule_all(self._in_use - in_use)
+        self._in_use = in_use
+        segs_in_use = {seg for _, seg in in_use}
+
+        for switch_name, vlans in self._pop_expired().items():
+            # the owner of the switch sees the same VLANs go away in the DB
+            if self.driver._switch_owner(switch_name) is not None:
+                continue
+            switch = self.driver.ml2config.inventory.get(switch_name, {})
+            if switch.get(c.SWITCH_PHYSNET):
+                unused = vlans - in_use
+            else:
+                unused = {(physnet, seg) for physnet, seg in vlans
+                          if seg not in segs_in_use}
+            kept = sorted({seg for _, seg in vlans - unused})
+            if kept:
+                LOG.debug('Not deleting VLANs {} from {} because they are '
+                          'in use'.format(kept, switch_name))
+            stale = sorted({seg for _, seg in unused})
+            if not stale:
+                continue
+
+            try:
+                failed = self._delete_vlans(switch_name, stale)
+            except Exception as e:
+                LOG.error('Failed to garbage collect VLANs on ansible host: '
+                          '{host}, reason: {err}'.format(host=switch_name,
+                                                         err=e))
+                failed = stale
+            # keep failed deletions around so the next run retries them
+            for physnet, seg in unused:
+                if seg in failed:
+                    self.schedule(switch_name, seg, physnet)
+
+    def _schedule_all(self, vlans):
+        """Mark VLANs as removal candidates on the switches managing them"""
+        for switch_name, switch in self.driver.ml2config.inventory.items():
+            if not switch.get('manage_vlans', True):
+                continue
+            switch_physnet = switch.get(c.SWITCH_PHYSNET)
+            for physnet, seg in vlans:
+                if switch_physnet and switch_physnet != physnet:
+                    continue
+                self.schedule(switch_name, seg, physnet)
+
+    def _pop_expired(self):
+        now = time.monotonic()
+        expired = {}
+        with self._pending_lock:
+            for switch_name, vlans in self._pending.items():
+                for vlan, scheduled_at in list(vlans.items()):
+                    if now - scheduled_at >= self.grace_period:
+                        expired.setdefault(switch_name, set()).add(vlan)
+                        del vlans[vlan]
+        return expired
+
+    @staticmethod
+    def _vlans_in_use(context):
+        segments = NetworkSegment.get_objects(context, network_type='vlan')
+        return {(s.physical_network, s.segmentation_id) for s in segments}
+
+    def _delete_vlans(self, switch_name, segmentation_ids):
+        return self.driver._switch_locked(switch_name,
+                                          self._delete_vlans_locked,
+                                          switch_name, segmentation_ids,
+                                          priority=c.PRIORITY_BACKGROUND)
+
+    def _delete_vlans_locked(self, switch_name, segmentation_ids):
+        """Delete VLANs in one bulk operation and return the failed ones"""
+        try:
+            self.driver._device_call(switch_name, 'delete_vlans',
+                                     segmentation_ids)
+            failed = []
+        except exceptions.BulkVlanException as e:
+            failed = sorted(e.errors)
+            for seg in failed:
+                LOG.error('Failed to garbage collect VLAN {seg} '
+                          'on ansible host: {host}, '
+                          'reason: {err}'.format(seg=seg,
+                                                 host=switch_name,
+                                                 err=e.errors[seg]))
+        except Exception as e:
+            LOG.error('Failed to garbage collect VLANs {segs} '
+                      'on ansible host: {host}, '
+                      'reason: {err}'.format(segs=segmentation_ids,
+                                             host=switch_name,
+                                             err=e))
+            failed = list(segmentation_ids)
+        collected = sorted(set(segmentation_ids) - set(failed))
+        if collected:
+            LOG.info('VLANs {segs} have been garbage collected on '
+                     'ansible host {host}'.format(segs=collected,
+                                                  host=switch_name))
+        return failed
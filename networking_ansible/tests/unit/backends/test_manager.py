@@ -0,0 +1,57 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from unittest import mock
+
+from networking_ansible.backends import manager
+from networking_ansible import exceptions
+from networking_ansible.tests.unit import base
+
+
+@mock.patch('networking_ansible.backends.manager.driver.DriverManager')
+@mock.patch('networking_ansible.backends.network_runner.'
+            'NetworkRunnerBackend')
+class TestBackendManager(base.BaseTestCase):
+    def test_default_backend(self, m_nr_backend, m_driver_mgr):
+        inventory = {self.testhost: {'mac': self.testmac}}
+        backends = manager.BackendManager(inventory)
+        m_nr_backend.assert_called_once_with(inventory)
+        m_driver_mgr.assert_not_called()
+        self.assertEqual(m_nr_backend.return_value,
+                         backends.get(self.testhost))
+
+    def test_selected_backend(self, m_nr_backend, m_driver_mgr):
+        ssh_switch = {'backend': 'ssh'}
+        backends = manager.BackendManager({self.testhost: {},
+                                           'sshswitch': ssh_switch})
+        m_driver_mgr.assert_called_once_with(
+            'networking_ansible.backends', 'ssh', invoke_on_load=True,
+            invoke_args=({'sshswitch': ssh_switch},))
+        self.assertEqual(m_driver_mgr.return_value.driver,
+                         backends.get('sshswitch'))
+        self.assertEqual(m_nr_backend.return_value,
+                         backends.get(self.testhost))
+
+    def test_warm_up(self, m_nr_backend, m_driver_mgr):
+        backends = manager.BackendManager({self.testhost: {},
+                                           'otherhost': {}})
+        backends.warm_up()
+        m_nr_backend.return_value.warm_up.assert_called_once_with()
+
+    def test_backend_load_failure(self, m_nr_backend, m_driver_mgr):
+        m_driver_mgr.side_effect = ValueError('unsupported')
+        self.assertRaises(exceptions.NetworkingAnsibleMechException,
+                          manager.BackendManager,
+                          {self.testhost: {'backend': 'ssh'}})
@@ -0,0 +1,192 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import io
+import json
+import os
+import signal
+import sys
+from unittest import mock
+
+from network_runner import api
+from oslo_concurrency import processutils
+
+from networking_ansible.backends import network_runner
+from networking_ansible import exceptions
+from networking_ansible.tests.unit import base
+
+
+class TestNetworkRunnerBackend(base.BaseTestCase):
+    def setUp(self):
+        super(TestNetworkRunnerBackend, self).setUp()
+        self.backend = network_runner.NetworkRunnerBackend(
+            {self.testhost: {'mac': self.testmac}})
+
+    @mock.patch.object(api.NetworkRunner, 'conf_access_port')
+    def test_conf_access_port(self, m_conf_access_port):
+        self.backend.conf_access_port(self.testhost, 'port', 37,
+                                      stp_edge=True)
+        m_conf_access_port.assert_called_once_with(self.testhost, 'port',
+                                                   37, stp_edge=True)
+
+    @mock.patch.object(api.NetworkRunner, 'conf_trunk_port')
+    def test_conf_trunk_port(self, m_conf_trunk_port):
+        self.backend.conf_trunk_port(self.testhost, 'port', 37, [73])
+        m_conf_trunk_port.assert_called_once_with(self.testhost, 'port',
+                                                  37, [73])
+
+    @mock.patch.object(api.NetworkRunner, 'delete_port')
+    def test_delete_port(self, m_delete_port):
+        self.backend.delete_port(self.testhost, 'port')
+        m_delete_port.assert_called_once_with(self.testhost, 'port')
+
+    @mock.patch.object(api.NetworkRunner, 'create_vlan')
+    @mock.patch.object(api.NetworkRunner, 'run')
+    def test_create_vlans(self, m_run, m_create_vlan):
+        m_run.side_effect = Exception('vlan in use')
+        m_create_vlan.side_effect = [None, Exception('vlan in use'), None]
+        try:
+            self.backend.create_vlans(self.testhost, [37, 38, 39])
+        except exceptions.BulkVlanException as e:
+            self.assertEqual([38], list(e.errors))
+        else:
+            self.fail('BulkVlanException not raised')
+        self.assertEqual(3, m_create_vlan.call_count)
+
+    @mock.patch.object(api.NetworkRunner, 'create_vlan')
+    @mock.patch.object(api.NetworkRunner, 'run')
+    def test_create_vlans_single_run(self, m_run, m_create_vlan):
+        self.backend.create_vlans(self.testhost, [37, 38])
+        m_run.assert_called_once()
+        m_create_vlan.assert_not_called()
+        tasks = m_run.call_args[0][0].serialize()[0]['tasks']
+        self.assertEqual(
+            [{'vlan_id': 37, 'vlan_name': None},
+             {'vlan_id': 38, 'vlan_name': None}],
+            [task['vars'] for task in tasks])
+        self.assertEqual(
+            [api.CREATE_VLAN] * 2,
+            [task['args']['tasks_from'] for task in tasks])
+
+    @mock.patch.object(api.NetworkRunner, 'delete_vlan')
+    @mock.patch.object(api.NetworkRunner, 'run')
+    def test_delete_vlans_single_run(self, m_run, m_delete_vlan):
+        self.backend.delete_vlans(self.testhost, [37, 38])
+        m_run.assert_called_once()
+        m_delete_vlan.assert_not_called()
+        tasks = m_run.call_args[0][0].serialize()[0]['tasks']
+        self.assertEqual([{'vlan_id': 37}, {'vlan_id': 38}],
+                         [task['vars'] for task in tasks])
+
+    @mock.patch('networking_ansible.backends.network_runner._build_runner')
+    def test_runner_built_on_first_use(self, m_build_runner):
+        backend = network_runner.NetworkRunnerBackend(
+            {self.testhost: {'mac': self.testmac}})
+        m_build_runner.assert_not_called()
+        backend.delete_port(self.testhost, 'port')
+        backend.delete_port(self.testhost, 'port')
+        m_build_runner.assert_called_once_with(
+            {self.testhost: {'mac': self.testmac}})
+
+    @mock.patch('networking_ansible.backends.network_runner._build_runner')
+    def test_warm_up(self, m_build_runner):
+        backend = network_runner.NetworkRunnerBackend(
+            {self.testhost: {'mac': self.testmac}})
+        backend.warm_up()
+        backend.delete_port(self.testhost, 'port')
+        m_build_runner.assert_called_once_with(
+            {self.testhost: {'mac': self.testmac}})
+
+
+@mock.patch.object(processutils, 'execute')
+class TestNetworkRunnerBackendWorkers(base.BaseTestCase):
+    def setUp(self):
+        super(TestNetworkRunnerBackendWorkers, self).setUp()
+        self.config(ansible_worker_pool_size=2, group='ml2_ansible')
+        self.inventory = {self.testhost: {'mac': self.testmac},
+                          'otherhost': {'mac': self.testmac}}
+        self.backend = network_runner.NetworkRunnerBackend(self.inventory)
+
+    def test_run_in_worker(self, m_execute):
+        self.backend.create_vlans(self.testhost, {37})
+        m_execute.assert_called_once_with(
+            sys.executable, '-m', network_runner.__name__,
+            process_input=mock.ANY, preexec_fn=os.setsid,
+            on_execute=mock.ANY)
+        self.assertEqual(
+            {'inventory': {self.testhost: {'mac': self.testmac}},
+             'operation': 'create_vlans',
+             'args': [self.testhost, [37]],
+             'kwargs': {}},
+            json.loads(m_execute.call_args[1]['process_input']))
+
+    def test_worker_error(self, m_execute):
+        m_execute.side_effect = processutils.ProcessExecutionError(
+            stderr='device error')
+        self.assertRaisesRegex(exceptions.DeviceCommandException,
+                               'device error',
+                               self.backend.delete_port, self.testhost,
+                               'port')
+
+    @mock.patch('networking_ansible.backends.network_runner.os.killpg')
+    @mock.patch('networking_ansible.backends.network_runner.threading.Timer')
+    def test_device_timeout(self, m_timer, m_killpg, m_execute):
+        self.config(device_timeout=60, group='ml2_ansible')
+        process = mock.Mock(pid=42)
+
+        def _expire(*args, **kwargs):
+            kwargs['on_execute'](process)
+            timeout, func, func_args = m_timer.call_args[0]
+            self.assertEqual(60, timeout)
+            func(*func_args)
+            raise processutils.ProcessExecutionError(exit_code=-9)
+
+        m_execute.side_effect = _expire
+        self.assertRaisesRegex(exceptions.DeviceCommandException,
+                               'timed out after 60 seconds',
+                               self.backend.create_vlan, self.testhost, 37)
+        m_killpg.assert_called_once_with(42, signal.SIGKILL)
+        m_timer.return_value.cancel.assert_called_once_with()
+
+    @mock.patch('networking_ansible.backends.network_runner.threading.Timer')
+    def test_no_device_timeout(self, m_timer, m_execute):
+        m_execute.side_effect = (
+            lambda *args, **kwargs: kwargs['on_execute'](mock.Mock()))
+        self.backend.create_vlan(self.testhost, 37)
+        m_timer.assert_not_called()
+
+    @mock.patch.object(api.NetworkRunner, 'create_vlan')
+    def test_main(self, m_create_vlan, m_execute):
+        request = {'inventory': {self.testhost: {'mac': self.testmac}},
+                   'operation': 'create_vlan',
+                   'args': [self.testhost, 37],
+                   'kwargs': {'stp_edge': True}}
+        with mock.patch.object(sys, 'stdin',
+                               io.StringIO(json.dumps(request))):
+            network_runner.main()
+        m_create_vlan.assert_called_once_with(self.testhost, 37,
+                                              stp_edge=True)
+
+    @mock.patch.object(api.NetworkRunner, 'create_vlan')
+    def test_main_error(self, m_create_vlan, m_execute):
+        m_create_vlan.side_effect = Exception('device error')
+        request = {'inventory': {self.testhost: {'mac': self.testmac}},
+                   'operation': 'create_vlan',
+                   'args': [self.testhost, 37],
+                   'kwargs': {}}
+        with mock.patch.object(sys, 'stdin',
+                               io.StringIO(json.dumps(request))):
+            e = self.assertRaises(SystemExit, network_runner.main)
+        self.assertEqual('device error', e.code)
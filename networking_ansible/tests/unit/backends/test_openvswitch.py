@@ -0,0 +1,115 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from unittest import mock
+
+from oslo_concurrency import processutils
+
+from networking_ansible.backends import openvswitch
+from networking_ansible import exceptions
+from networking_ansible.tests.unit import base
+
+
+class TestOpenvswitch(base.BaseTestCase):
+    def test_conf_access_port(self):
+        self.assertEqual(
+            ['ovs-vsctl', 'set', 'port', 'p1', 'vlan_mode=access', 'tag=37',
+             '--', 'clear', 'port', 'p1', 'trunks'],
+            openvswitch.vsctl(openvswitch.conf_access_port('p1', 37)))
+
+    def test_conf_trunk_port(self):
+        self.assertEqual(
+            [['set', 'port', 'p1', 'vlan_mode=native-untagged', 'tag=37',
+              'trunks=37,73,74']],
+            openvswitch.conf_trunk_port('p1', 37, [73, 74]))
+
+    def test_trunk_vlans(self):
+        self.assertEqual([['add', 'port', 'p1', 'trunks', '37']],
+                         openvswitch.add_trunk_vlan('p1', 37))
+        self.assertEqual([['remove', 'port', 'p1', 'trunks', '37']],
+                         openvswitch.delete_trunk_vlan('p1', 37))
+
+    def test_delete_port(self):
+        self.assertEqual(
+            ['ovs-vsctl', 'clear', 'port', 'p1', 'tag', 'trunks',
+             'vlan_mode'],
+            openvswitch.vsctl(openvswitch.delete_port('p1')))
+
+
+@mock.patch('networking_ansible.backends.openvswitch.processutils.execute')
+class TestOvsBackend(base.BaseTestCase):
+    def setUp(self):
+        super(TestOvsBackend, self).setUp()
+        self.backend = openvswitch.OvsBackend(
+            {self.testhost: {'root_helper': 'sudo'},
+             'remote': {'ovsdb_connection': 'tcp:192.0.2.1:6640',
+                        'ovs_timeout': '5'}})
+
+    def test_conf_access_port(self, m_execute):
+        self.backend.conf_access_port(self.testhost, 'p1', 37, stp_edge=True)
+        m_execute.assert_called_once_with(
+            'ovs-vsctl', '--timeout=10', 'set', 'port', 'p1',
+            'vlan_mode=access', 'tag=37', '--', 'clear', 'port', 'p1',
+            'trunks', run_as_root=True, root_helper='sudo')
+
+    def test_ovsdb_connection(self, m_execute):
+        self.backend.add_trunk_vlan('remote', 'p1', 37)
+        m_execute.assert_called_once_with(
+            'ovs-vsctl', '--timeout=5', '--db=tcp:192.0.2.1:6640', 'add',
+            'port', 'p1', 'trunks', '37', run_as_root=False,
+            root_helper=None)
+
+    def test_device_timeout(self, m_execute):
+        self.config(device_timeout=3, group='ml2_ansible')
+        backend = openvswitch.OvsBackend(self.backend.inventory)
+        backend.add_trunk_vlan(self.testhost, 'p1', 37)
+        self.assertEqual('--timeout=3', m_execute.call_args[0][1])
+        self.config(device_timeout=30, group='ml2_ansible')
+        backend = openvswitch.OvsBackend(self.backend.inventory)
+        backend.add_trunk_vlan(self.testhost, 'p1', 37)
+        self.assertEqual('--timeout=10', m_execute.call_args[0][1])
+
+    def test_create_vlan_noop(self, m_execute):
+        self.backend.create_vlan(self.testhost, 37)
+        self.backend.delete_vlan(self.testhost, 37)
+        m_execute.assert_not_called()
+
+    def test_transaction_failure(self, m_execute):
+        m_execute.side_effect = processutils.ProcessExecutionError(
+            stderr='no port named p1')
+        self.assertRaises(exceptions.DeviceCommandException,
+                          self.backend.delete_port, self.testhost, 'p1')
+
+    def test_commit(self, m_execute):
+        errors = self.backend.commit(self.testhost,
+                                     [('create_vlan', (37,)),
+                                      ('add_trunk_vlan', ('p1', 37)),
+                                      ('delete_port', ('p2',))])
+        self.assertEqual([None, None, None], errors)
+        m_execute.assert_called_once_with(
+            'ovs-vsctl', '--timeout=10', 'add', 'port', 'p1', 'trunks', '37',
+            '--', 'clear', 'port', 'p2', 'tag', 'trunks', 'vlan_mode',
+            run_as_root=True, root_helper='sudo')
+
+    def test_commit_failure_isolated(self, m_execute):
+        error = processutils.ProcessExecutionError(stderr='no port named p2')
+        # the transaction, then every operation on its own
+        m_execute.side_effect = [error, None, error]
+        errors = self.backend.commit(self.testhost,
+                                     [('add_trunk_vlan', ('p1', 37)),
+                                      ('delete_port', ('p2',))])
+        self.assertIsNone(errors[0])
+        self.assertIsInstance(errors[1], exceptions.DeviceCommandException)
+        self.assertEqual(3, m_execute.call_count)
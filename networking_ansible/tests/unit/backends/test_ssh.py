@@ -0,0 +1,178 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from unittest import mock
+
+from networking_ansible.backends import ssh
+from networking_ansible import exceptions
+from networking_ansible.tests.unit import base
+
+
+class FakeSSHException(Exception):
+    pass
+
+
+@mock.patch('networking_ansible.backends.ssh.paramiko')
+class TestSshBackend(base.BaseTestCase):
+    def setUp(self):
+        super(TestSshBackend, self).setUp()
+        self.inventory = {self.testhost: {
+            'ansible_network_os': 'openvswitch',
+            'ansible_host': '192.0.2.1',
+            'ansible_user': 'ovs_manager',
+            'ansible_ssh_private_key_file': '/tmp/key',
+            'ansible_become': 'True'}}
+
+    def _backend(self, m_paramiko, status=0, output=b''):
+        m_paramiko.SSHException = FakeSSHException
+        self.client = m_paramiko.SSHClient.return_value
+        self.stdout = mock.Mock()
+        self.stdout.channel.recv_exit_status.return_value = status
+        self.stdout.read.return_value = output
+        stderr = mock.Mock()
+        stderr.read.return_value = b'error'
+        self.client.exec_command.return_value = (mock.Mock(), self.stdout,
+                                                 stderr)
+        return ssh.SshBackend(self.inventory)
+
+    def test_unsupported_platform(self, m_paramiko):
+        self.inventory[self.testhost]['ansible_network_os'] = 'junos'
+        self.assertRaises(ValueError, ssh.SshBackend, self.inventory)
+
+    def test_conf_access_port(self, m_paramiko):
+        backend = self._backend(m_paramiko)
+        backend.conf_access_port(self.testhost, 'p1', 37, stp_edge=True)
+        self.client.connect.assert_called_once_with(
+            '192.0.2.1', port=22, username='ovs_manager', password=None,
+            key_filename='/tmp/key', timeout=ssh.CONNECT_TIMEOUT)
+        self.client.exec_command.assert_called_once_with(
+            'sudo -n ovs-vsctl set port p1 vlan_mode=access tag=37 -- '
+            'clear port p1 trunks', timeout=ssh.DEFAULT_COMMAND_TIMEOUT)
+
+    def test_session_reused(self, m_paramiko):
+        backend = self._backend(m_paramiko)
+        backend.add_trunk_vlan(self.testhost, 'p1', 37)
+        backend.delete_trunk_vlan(self.testhost, 'p1', 37)
+        m_paramiko.SSHClient.assert_called_once_with()
+        self.assertEqual(2, self.client.exec_command.call_count)
+
+    def test_create_vlan_noop(self, m_paramiko):
+        backend = self._backend(m_paramiko)
+        backend.create_vlan(self.testhost, 37)
+        m_paramiko.SSHClient.assert_not_called()
+
+    def test_reconnect(self, m_paramiko):
+        backend = self._backend(m_paramiko)
+        backend.delete_port(self.testhost, 'p1')
+        self.client.exec_command.side_effect = [
+            FakeSSHException('closed'),
+            self.client.exec_command.return_value]
+        backend.delete_port(self.testhost, 'p1')
+        self.client.close.assert_called_once_with()
+        self.assertEqual(2, m_paramiko.SSHClient.call_count)
+
+    def test_command_failure(self, m_paramiko):
+        backend = self._backend(m_paramiko, status=1)
+        self.assertRaises(exceptions.DeviceCommandException,
+                          backend.delete_port, self.testhost, 'p1')
+
+    def test_command_timeout(self, m_paramiko):
+        backend = self._backend(m_paramiko)
+        self.stdout.channel.status_event.wait.return_value = False
+        self.assertRaises(exceptions.DeviceCommandException,
+                          backend.delete_port, self.testhost, 'p1')
+        self.stdout.channel.status_event.wait.assert_called_once_with(
+            ssh.DEFAULT_COMMAND_TIMEOUT)
+        self.stdout.channel.recv_exit_status.assert_not_called()
+        self.client.close.assert_called_once_with()
+
+    def test_device_timeout(self, m_paramiko):
+        self.config(device_timeout=5, group='ml2_ansible')
+        backend = self._backend(m_paramiko)
+        backend.delete_port(self.testhost, 'p1')
+        self.client.exec_command.assert_called_once_with(mock.ANY,
+                                                         timeout=5)
+        self.stdout.channel.status_event.wait.assert_called_once_with(5)
+
+    def test_nxos_conf_access_port(self, m_paramiko):
+        self.inventory[self.testhost]['ansible_network_os'] = 'nxos'
+        self.inventory[self.testhost]['ansible_become'] = 'False'
+        backend = self._backend(m_paramiko)
+        backend.conf_access_port(self.testhost, 'Ethernet1/1', 37)
+        self.client.exec_command.assert_called_once_with(
+            'configure terminal ; interface Ethernet1/1 ; '
+            'switchport mode access ; switchport access vlan 37 ; end',
+            timeout=ssh.DEFAULT_COMMAND_TIMEOUT)
+
+    def test_eos_create_vlan(self, m_paramiko):
+        self.inventory[self.testhost]['ansible_network_os'] = 'eos'
+        backend = self._backend(m_paramiko)
+        backend.create_vlan(self.testhost, 37)
+        self.client.exec_command.assert_called_once_with(
+            'enable\nconfigure terminal\nvlan 37\nend',
+            timeout=ssh.DEFAULT_COMMAND_TIMEOUT)
+
+    def test_eos_create_vlans(self, m_paramiko):
+        self.inventory[self.testhost]['ansible_network_os'] = 'eos'
+        backend = self._backend(m_paramiko)
+        backend.create_vlans(self.testhost, [37, 38])
+        self.client.exec_command.assert_called_once_with(
+            'enable\nconfigure terminal\nvlan 37,38\nend',
+            timeout=ssh.DEFAULT_COMMAND_TIMEOUT)
+
+    def test_nxos_delete_vlans(self, m_paramiko):
+        self.inventory[self.testhost]['ansible_network_os'] = 'nxos'
+        self.inventory[self.testhost]['ansible_become'] = 'False'
+        backend = self._backend(m_paramiko)
+        backend.delete_vlans(self.testhost, [37, 38])
+        self.client.exec_command.assert_called_once_with(
+            'configure terminal ; no vlan 37,38 ; end',
+            timeout=ssh.DEFAULT_COMMAND_TIMEOUT)
+
+    def test_create_vlans_one_by_one_on_failure(self, m_paramiko):
+        self.inventory[self.testhost]['ansible_network_os'] = 'nxos'
+        self.inventory[self.testhost]['ansible_become'] = 'False'
+        backend = self._backend(m_paramiko)
+        self.stdout.read.side_effect = [b'% Invalid command', b'',
+                                        b'% Invalid command']
+        try:
+            backend.create_vlans(self.testhost, [37, 38])
+        except exceptions.BulkVlanException as e:
+            self.assertEqual([38], list(e.errors))
+        else:
+            self.fail('BulkVlanException not raised')
+        self.assertEqual(3, self.client.exec_command.call_count)
+        self.client.exec_command.assert_called_with(
+            'configure terminal ; vlan 38 ; end',
+            timeout=ssh.DEFAULT_COMMAND_TIMEOUT)
+
+    def test_create_vlans_noop(self, m_paramiko):
+        backend = self._backend(m_paramiko)
+        backend.create_vlans(self.testhost, [37, 38])
+        m_paramiko.SSHClient.assert_not_called()
+
+    def test_cli_error_output(self, m_paramiko):
+        self.inventory[self.testhost]['ansible_network_os'] = 'nxos'
+        backend = self._backend(m_paramiko,
+                                output=b'% Invalid command at marker')
+        self.assertRaises(exceptions.DeviceCommandException,
+                          backend.create_vlan, self.testhost, 37)
+
+    def test_cli_invalid_port_name(self, m_paramiko):
+        self.inventory[self.testhost]['ansible_network_os'] = 'eos'
+        backend = self._backend(m_paramiko)
+        self.assertRaises(exceptions.DeviceCommandException,
+                          backend.delete_port, self.testhost, 'p1 ; reload')
+        self.client.exec_command.assert_not_called()
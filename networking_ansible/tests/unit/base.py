@@ -56,6 +56,10 @@ class MockConfig(object):
         self.mac_map = {}
         self.port_mappings = {}
 
+    @property
+    def sriov_port_mappings(self):
+        return config.build_sriov_index(self.port_mappings)
+
     def add_extra_params(self):
         for i in self.inventory:
             self.inventory[i]['stp_edge'] = True
@@ -94,6 +98,17 @@ class BaseTestCase(base.BaseTestCase):
                  project='networking_ansible',
                  version='%%(prog)s%s' % version_info.release_string())
 
+    def config(self, **kw):
+        """Override configuration options until the end of the test
+
+        The keyword arguments are the names of the options to override and
+        their values, group is the option group.
+        """
+        group = kw.pop('group', None)
+        for name, value in kw.items():
+            cfg.CONF.set_override(name, value, group=group)
+            self.addCleanup(cfg.CONF.clear_override, name, group=group)
+
 
 class NetworkingAnsibleTestCase(BaseTestCase):
     def setUp(self):
@@ -148,6 +163,7 @@ class NetworkingAnsibleTestCase(BaseTestCase):
         self.mock_netseg.segmentation_id = self.testsegid
         self.mock_netseg.physical_network = self.testphysnet
         self.mock_netseg.network_type = 'vlan'
+        self.mock_netseg.is_dynamic = False
         self.mock_net.segments = [self.mock_netseg]
 
         # alternative segment
@@ -155,12 +171,14 @@ class NetworkingAnsibleTestCase(BaseTestCase):
         self.mock_netseg2.segmentation_id = self.testsegid2
         self.mock_netseg2.physical_network = self.testphysnet
         self.mock_netseg2.network_type = 'vlan'
+        self.mock_netseg2.is_dynamic = False
 
         # non-physnet segment
         self.mock_netseg3 = mock.Mock(spec=network.NetworkSegment)
         self.mock_netseg3.segmentation_id = self.testsegid2
         self.mock_netseg3.physical_network = 'virtual'
         self.mock_netseg3.network_type = 'vxlan'
+        self.mock_netseg3.is_dynamic = False
 
         # Binding profile dicts with
         # Local Link Information dicts
@@ -288,3 +306,7 @@ class NetworkingAnsibleTestCase(BaseTestCase):
         self.mock_port_context.segments_to_bind = [
             self.mock_port_context.network.current
         ]
+        self.mock_port_context.top_bound_segment = None
+        self.mock_port_context.bottom_bound_segment = None
+        self.mock_port_context.original_top_bound_segment = None
+        self.mock_port_context.original_bottom_bound_segment = None
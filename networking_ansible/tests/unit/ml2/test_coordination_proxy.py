@@ -0,0 +1,163 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import tempfile
+import threading
+from unittest import mock
+
+from tooz import coordination
+
+from networking_ansible import exceptions
+from networking_ansible.ml2 import coordination_proxy
+from networking_ansible.tests.unit import base
+
+
+class TestLockTable(base.BaseTestCase):
+    def setUp(self):
+        super(TestLockTable, self).setUp()
+        self.coordinator = mock.create_autospec(
+            coordination.CoordinationDriver).return_value
+        self.backend_lock = self.coordinator.get_lock.return_value
+        self.backend_lock.acquire.return_value = True
+        self.locks = coordination_proxy.LockTable(self.coordinator)
+
+    def test_acquire_release(self):
+        self.assertTrue(self.locks.acquire(self.testhost, 1))
+        self.coordinator.get_lock.assert_called_once_with(self.testhost)
+        self.backend_lock.acquire.assert_called_once_with(blocking=True)
+        self.assertTrue(self.locks.release(self.testhost, 1))
+        self.backend_lock.release.assert_called_once_with()
+        self.assertEqual({}, self.locks._locks)
+
+    def test_release_not_holder(self):
+        self.locks.acquire(self.testhost, 1)
+        self.assertFalse(self.locks.release(self.testhost, 2))
+        self.backend_lock.release.assert_not_called()
+
+    def test_acquire_held_locally_non_blocking(self):
+        self.locks.acquire(self.testhost, 1)
+        self.assertFalse(self.locks.acquire(self.testhost, 2,
+                                            blocking=False))
+        self.assertEqual(1, self.backend_lock.acquire.call_count)
+
+    def test_acquire_held_remotely_non_blocking(self):
+        self.backend_lock.acquire.return_value = False
+        self.assertFalse(self.locks.acquire(self.testhost, 1,
+                                            blocking=False))
+        self.assertEqual({}, self.locks._locks)
+
+    def test_acquire_held_locally_timeout(self):
+        self.locks.acquire(self.testhost, 1)
+        self.assertFalse(self.locks.acquire(self.testhost, 2,
+                                            blocking=0.01))
+        self.assertEqual(0, self.locks._locks[self.testhost].waiters)
+        self.assertTrue(self.locks.release(self.testhost, 1))
+        self.assertEqual({}, self.locks._locks)
+
+    def test_acquire_held_remotely_timeout(self):
+        self.backend_lock.acquire.return_value = False
+        self.assertFalse(self.locks.acquire(self.testhost, 1, blocking=5))
+        blocking = self.backend_lock.acquire.call_args[1]['blocking']
+        self.assertTrue(0 < blocking <= 5)
+        self.assertEqual({}, self.locks._locks)
+
+    def test_local_handover(self):
+        self.locks.acquire(self.testhost, 1)
+        acquired = threading.Event()
+
+        def wait():
+            self.locks.acquire(self.testhost, 2)
+            acquired.set()
+
+        waiter = threading.Thread(target=wait)
+        waiter.start()
+        for i in range(100):
+            if self.locks._locks[self.testhost].waiters:
+                break
+            acquired.wait(0.01)
+        self.locks.release(self.testhost, 1)
+        waiter.join(10)
+        self.assertTrue(acquired.is_set())
+        # the backend lock went straight to the next local worker
+        self.assertEqual(1, self.backend_lock.acquire.call_count)
+        self.backend_lock.release.assert_not_called()
+        self.locks.release(self.testhost, 2)
+        self.backend_lock.release.assert_called_once_with()
+
+    def test_handover_limit(self):
+        self.locks.acquire(self.testhost, 1)
+        state = self.locks._locks[self.testhost]
+        state.waiters = 1
+        state.handovers = coordination_proxy.MAX_LOCAL_HANDOVERS
+        self.locks.release(self.testhost, 1)
+        self.backend_lock.release.assert_called_once_with()
+        self.assertIsNone(state.distributed)
+
+    def test_release_all(self):
+        self.locks.acquire(self.testhost, 1)
+        self.locks.acquire('otherhost', 1)
+        self.locks.release_all(1)
+        self.assertEqual(2, self.backend_lock.release.call_count)
+        self.assertEqual({}, self.locks._locks)
+
+
+class TestCoordinationProxy(base.BaseTestCase):
+    def setUp(self):
+        super(TestCoordinationProxy, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.socket_path = os.path.join(self.tmpdir, 'proxy.sock')
+        self.coordinator = mock.create_autospec(
+            coordination.CoordinationDriver).return_value
+        self.backend_lock = self.coordinator.get_lock.return_value
+        self.backend_lock.acquire.return_value = True
+        self.server = coordination_proxy.CoordinationProxy(self.coordinator,
+                                                           self.socket_path)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.client = coordination_proxy.ProxyClient(self.socket_path)
+
+    def test_lock(self):
+        with self.client.get_lock(self.testhost):
+            self.backend_lock.acquire.assert_called_once_with(blocking=True)
+        self.backend_lock.release.assert_called_once_with()
+
+    def test_acquire_non_blocking(self):
+        lock = self.client.get_lock(self.testhost)
+        self.assertTrue(lock.acquire(blocking=False))
+        self.assertFalse(
+            self.client.get_lock(self.testhost).acquire(blocking=False))
+        self.assertTrue(lock.release())
+
+    def test_disconnect_releases(self):
+        lock = self.client.get_lock(self.testhost)
+        lock.acquire()
+        lock._close()
+        for i in range(100):
+            if self.backend_lock.release.called:
+                break
+            threading.Event().wait(0.01)
+        self.backend_lock.release.assert_called_once_with()
+
+    def test_proxy_unreachable(self):
+        lock = coordination_proxy.ProxyClient(
+            os.path.join(self.tmpdir, 'missing.sock')).get_lock(self.testhost)
+        self.assertRaises(exceptions.CoordinationProxyException,
+                          lock.acquire)
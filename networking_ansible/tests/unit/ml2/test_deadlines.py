@@ -0,0 +1,101 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from unittest import mock
+
+from networking_ansible import exceptions
+from networking_ansible.ml2 import deadlines
+from networking_ansible.tests.unit import base
+
+
+@mock.patch('networking_ansible.ml2.deadlines.time')
+class TestDeadlines(base.BaseTestCase):
+    def test_no_deadline(self, m_time):
+        self.assertIsNone(deadlines.deadline())
+        self.assertIsNone(deadlines.timeout())
+        self.assertEqual(5, deadlines.timeout(5))
+
+    def test_budget(self, m_time):
+        m_time.monotonic.return_value = 100
+        with deadlines.budget(10):
+            self.assertEqual(110, deadlines.deadline())
+            m_time.monotonic.return_value = 104
+            self.assertEqual(6, deadlines.timeout())
+            self.assertEqual(5, deadlines.timeout(5))
+            self.assertEqual(6, deadlines.timeout(30))
+        self.assertIsNone(deadlines.deadline())
+
+    def test_no_budget(self, m_time):
+        with deadlines.budget(0):
+            self.assertIsNone(deadlines.deadline())
+
+    def test_nested_budget_keeps_outer_deadline(self, m_time):
+        m_time.monotonic.return_value = 100
+        with deadlines.budget(10):
+            with deadlines.budget(30):
+                self.assertEqual(110, deadlines.deadline())
+            with deadlines.budget(5):
+                self.assertEqual(105, deadlines.deadline())
+            self.assertEqual(110, deadlines.deadline())
+
+    def test_budget_exhausted(self, m_time):
+        m_time.monotonic.return_value = 100
+        with deadlines.budget(10):
+            m_time.monotonic.return_value = 110
+            self.assertRaisesRegex(exceptions.DeadlineExceededException,
+                                   'before acquiring the lock',
+                                   deadlines.timeout,
+                                   what='acquiring the lock')
+
+    def test_hook(self, m_time):
+        m_time.monotonic.return_value = 100
+        self.config(hook_timeout=20, group='ml2_ansible')
+
+        @deadlines.hook
+        def hook():
+            return deadlines.deadline()
+
+        self.assertEqual(120, hook())
+        self.assertIsNone(deadlines.deadline())
+
+
+class TestTimedLock(base.BaseTestCase):
+    def setUp(self):
+        super(TestTimedLock, self).setUp()
+        self.lock = mock.Mock()
+
+    def test_acquire_forever(self):
+        with deadlines.TimedLock(self.lock, 0, self.testhost):
+            self.lock.acquire.assert_called_once_with(blocking=True)
+        self.lock.release.assert_called_once_with()
+
+    def test_acquire_timeout(self):
+        self.lock.acquire.return_value = False
+        lock = deadlines.TimedLock(self.lock, 30, self.testhost)
+        self.assertRaisesRegex(exceptions.DeadlineExceededException,
+                               'lock of switch {}'.format(self.testhost),
+                               lock.__enter__)
+        self.lock.acquire.assert_called_once_with(blocking=30)
+        self.lock.release.assert_not_called()
+
+    def test_released_on_error(self):
+        self.lock.acquire.return_value = True
+
+        def locked():
+            with deadlines.TimedLock(self.lock, 30, self.testhost):
+                raise ValueError('switch error')
+
+        self.assertRaises(ValueError, locked)
+        self.lock.release.assert_called_once_with()
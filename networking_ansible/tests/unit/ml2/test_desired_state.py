@@ -0,0 +1,222 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import base64
+import json
+from unittest import mock
+
+from networking_ansible import constants as c
+from networking_ansible.ml2 import desired_state
+from networking_ansible.tests.unit import base
+
+
+class FakeEtcd(object):
+    """In memory stand-in of an etcd3gw client"""
+
+    def __init__(self):
+        self.revision = 0
+        self.kvs = {}
+
+    def put(self, key, value):
+        self.revision += 1
+        self.kvs[key] = (value.encode('utf-8'), self.revision)
+        return True
+
+    def get(self, key):
+        if key in self.kvs:
+            return [self.kvs[key][0]]
+        return []
+
+    def get_prefix(self, prefix):
+        return [(value, {'key': key.encode('utf-8'),
+                         'mod_revision': str(revision)})
+                for key, (value, revision) in self.kvs.items()
+                if key.startswith(prefix)]
+
+    def transaction(self, txn):
+        compare = txn['compare'][0]
+        key = base64.b64decode(compare['key']).decode('utf-8')
+        if key in self.kvs and \
+                self.kvs[key][1] == compare['mod_revision']:
+            del self.kvs[key]
+            return {'succeeded': True}
+        return {}
+
+
+class TestDesiredStateStore(base.BaseTestCase):
+    def setUp(self):
+        super(TestDesiredStateStore, self).setUp()
+        self.client = FakeEtcd()
+        self.store = desired_state.DesiredStateStore(self.client)
+
+    def test_publish(self):
+        self.store.publish(self.testhost, 'conf_access_port', 'port1', 37)
+        key = '/networking-ansible/desired/testhost/port/port1'
+        value, revision = self.client.kvs[key]
+        self.assertEqual({'operation': 'conf_access_port',
+                          'args': ['port1', 37]},
+                         json.loads(value.decode('utf-8')))
+
+    def test_publish_replaces_object_state(self):
+        self.store.publish(self.testhost, 'create_vlan', 37)
+        self.store.publish(self.testhost, 'add_trunk_vlan', 'port1', 37)
+        self.store.publish(self.testhost, 'delete_vlan', 37)
+        desired = self.store.desired(self.testhost)
+        self.assertEqual([('add_trunk_vlan', ('port1', 37)),
+                          ('delete_vlan', (37,))],
+                         [(e.operation, e.args) for e in desired])
+        self.assertEqual([2, 3], [e.revision for e in desired])
+
+    def test_publish_bulk(self):
+        self.store.publish(self.testhost, 'create_vlans', [37, 38])
+        self.assertEqual([('create_vlan', (37,)), ('create_vlan', (38,))],
+                         [(e.operation, e.args)
+                          for e in self.store.desired(self.testhost)])
+
+    def test_applied_revision(self):
+        self.assertEqual(0, self.store.applied_revision(self.testhost))
+        self.store.record_applied(self.testhost, 5)
+        self.assertEqual(5, self.store.applied_revision(self.testhost))
+
+    def test_compact(self):
+        self.store.publish(self.testhost, 'create_vlan', 37)
+        self.store.publish(self.testhost, 'delete_vlan', 38)
+        self.store.publish(self.testhost, 'delete_port', 'port1')
+        entries = self.store.desired(self.testhost)
+        # a newer desired state of port1 is published meanwhile
+        self.store.publish(self.testhost, 'conf_access_port', 'port1', 37)
+        self.store.compact(entries)
+        self.assertEqual([('create_vlan', (37,)),
+                          ('conf_access_port', ('port1', 37))],
+                         [(e.operation, e.args)
+                          for e in self.store.desired(self.testhost)])
+
+    def test_watch(self):
+        self.client.watch_prefix = mock.Mock(return_value=(iter([
+            {'type': 'DELETE', 'kv': {'key': b'ignored'}},
+            {'kv': {'key': b'/networking-ansible/desired/testhost/vlan/37',
+                    'value': b'{"operation": "create_vlan", "args": [37]}',
+                    'mod_revision': '4'}}]), mock.sentinel.cancel))
+        changes, cancel = self.store.watch()
+        self.assertEqual(mock.sentinel.cancel, cancel)
+        switch_name, entry = next(changes)
+        self.assertEqual(self.testhost, switch_name)
+        self.assertEqual((4, 'create_vlan', (37,)),
+                         (entry.revision, entry.operation, entry.args))
+        self.assertRaises(StopIteration, next, changes)
+
+    @mock.patch('networking_ansible.ml2.desired_state.etcd3gw', None)
+    def test_from_uri_without_etcd3gw(self):
+        self.assertRaises(ImportError,
+                          desired_state.DesiredStateStore.from_uri,
+                          'http://127.0.0.1:2379')
+
+    @mock.patch('networking_ansible.ml2.desired_state.etcd3gw')
+    def test_from_uri(self, m_etcd3gw):
+        desired_state.DesiredStateStore.from_uri('https://etcd:2380')
+        m_etcd3gw.client.assert_called_once_with(host='etcd', port=2380,
+                                                 protocol='https')
+
+
+class TestSwitchConverger(base.BaseTestCase):
+    def setUp(self):
+        super(TestSwitchConverger, self).setUp()
+        self.store = desired_state.DesiredStateStore(FakeEtcd())
+        self.driver = mock.Mock()
+        self.driver.ml2config.inventory = {self.testhost: {}}
+        self.driver.partitioner.owns.return_value = True
+        self.driver._run_switch_locked.side_effect = \
+            lambda switch_name, func, *args, **kwargs: func(*args)
+        self.converger = desired_state.SwitchConverger(self.driver,
+                                                       self.store, 60)
+
+    def test_resync(self):
+        self.store.publish(self.testhost, 'create_vlan', 37)
+        self.store.publish(self.testhost, 'conf_access_port', 'port1', 37)
+        self.converger.resync()
+        self.driver._run_device_call.assert_has_calls([
+            mock.call(self.testhost, 'create_vlan', 37),
+            mock.call(self.testhost, 'conf_access_port', 'port1', 37)])
+        self.assertEqual(2, self.store.applied_revision(self.testhost))
+        self.driver._run_switch_locked.assert_called_once_with(
+            self.testhost, self.converger._converge_locked, self.testhost,
+            mock.ANY, priority=c.PRIORITY_BACKGROUND)
+
+    def test_applied_once(self):
+        self.store.publish(self.testhost, 'create_vlan', 37)
+        self.converger.resync()
+        self.converger.resync()
+        self.driver._run_device_call.assert_called_once_with(
+            self.testhost, 'create_vlan', 37)
+
+    def test_removal_compacted(self):
+        self.store.publish(self.testhost, 'delete_vlan', 37)
+        self.converger.resync()
+        self.driver._run_device_call.assert_called_once_with(
+            self.testhost, 'delete_vlan', 37)
+        self.assertEqual([], self.store.desired(self.testhost))
+        self.assertEqual(1, self.store.applied_revision(self.testhost))
+
+    def test_not_owner(self):
+        self.driver.partitioner.owns.return_value = False
+        self.store.publish(self.testhost, 'create_vlan', 37)
+        self.converger.resync()
+        self.driver._run_device_call.assert_not_called()
+
+    def test_without_partitioning(self):
+        self.driver.partitioner = None
+        self.store.publish(self.testhost, 'create_vlan', 37)
+        self.converger.resync()
+        self.driver._run_device_call.assert_not_called()
+
+    def test_failure_blocks_later_changes(self):
+        self.store.publish(self.testhost, 'create_vlan', 37)
+        self.store.publish(self.testhost, 'create_vlan', 38)
+        self.driver._run_device_call.side_effect = [Exception('error'),
+                                                    None, None]
+        self.converger.resync()
+        self.driver._run_device_call.assert_called_once_with(
+            self.testhost, 'create_vlan', 37)
+        self.assertEqual(0, self.store.applied_revision(self.testhost))
+        self.assertIn(self.testhost, self.converger._behind)
+        self.converger.resync()
+        self.driver._run_device_call.assert_has_calls([
+            mock.call(self.testhost, 'create_vlan', 37),
+            mock.call(self.testhost, 'create_vlan', 37),
+            mock.call(self.testhost, 'create_vlan', 38)])
+        self.assertEqual(2, self.store.applied_revision(self.testhost))
+        self.assertNotIn(self.testhost, self.converger._behind)
+        self.converger.resync()
+        self.assertEqual(3, self.driver._run_device_call.call_count)
+
+    def test_watch_behind_converges_desired_state(self):
+        self.store.publish(self.testhost, 'create_vlan', 37)
+        self.converger._behind.add(self.testhost)
+        self.store.publish(self.testhost, 'create_vlan', 38)
+        entry = self.store.desired(self.testhost)[-1]
+        self.converger.resync = mock.Mock()
+        self.store.watch = mock.Mock(return_value=(
+            iter([(self.testhost, entry)]), mock.Mock()))
+
+        def stop(seconds):
+            self.converger._stopped = True
+
+        with mock.patch.object(desired_state.time, 'sleep',
+                               side_effect=stop):
+            self.converger._watch()
+        self.driver._run_device_call.assert_has_calls([
+            mock.call(self.testhost, 'create_vlan', 37),
+            mock.call(self.testhost, 'create_vlan', 38)])
+        self.assertNotIn(self.testhost, self.converger._behind)
@@ -0,0 +1,77 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import socket
+from unittest import mock
+
+from networking_ansible import constants as c
+from networking_ansible.ml2 import health
+from networking_ansible.tests.unit import base
+
+
+@mock.patch('networking_ansible.ml2.health.socket.create_connection')
+class TestSwitchHealth(base.BaseTestCase):
+    def setUp(self):
+        super(TestSwitchHealth, self).setUp()
+        inventory = {'sw1': {'ansible_host': '192.0.2.1',
+                             'ansible_port': '2222'},
+                     'sw2': {},
+                     'br': {c.BACKEND: 'ovs'}}
+        self.health = health.SwitchHealth(inventory, 10, 2)
+
+    def test_targets(self, m_connect):
+        self.assertEqual({'sw1': ('192.0.2.1', 2222), 'sw2': ('sw2', 22)},
+                         self.health._targets)
+
+    def test_probe(self, m_connect):
+        sock = m_connect.return_value.__enter__.return_value
+        sock.recv.return_value = b'SSH-2.0-OpenSSH\r\n'
+        self.assertTrue(self.health.probe('sw1'))
+        m_connect.assert_called_once_with(('192.0.2.1', 2222), timeout=2)
+        state = self.health.state('sw1')
+        self.assertTrue(state['healthy'])
+        self.assertIsNotNone(state['latency'])
+        self.assertIsNone(state['error'])
+
+    def test_probe_unhealthy_after_threshold(self, m_connect):
+        m_connect.side_effect = socket.timeout('timed out')
+        for _ in range(health.FAILURE_THRESHOLD - 1):
+            self.assertFalse(self.health.probe('sw1'))
+            self.assertTrue(self.health.is_healthy('sw1'))
+        self.assertFalse(self.health.probe('sw1'))
+        self.assertFalse(self.health.is_healthy('sw1'))
+        self.assertEqual('timed out', self.health.state('sw1')['error'])
+
+        m_connect.side_effect = None
+        sock = m_connect.return_value.__enter__.return_value
+        sock.recv.return_value = b'SSH-2.0-OpenSSH\r\n'
+        self.assertTrue(self.health.probe('sw1'))
+        self.assertTrue(self.health.is_healthy('sw1'))
+
+    def test_probe_no_banner(self, m_connect):
+        sock = m_connect.return_value.__enter__.return_value
+        sock.recv.return_value = b''
+        self.assertFalse(self.health.probe('sw1'))
+        self.assertIn('banner', self.health.state('sw1')['error'])
+
+    def test_probe_all(self, m_connect):
+        sock = m_connect.return_value.__enter__.return_value
+        sock.recv.return_value = b'SSH-2.0-OpenSSH\r\n'
+        self.health.probe_all()
+        self.assertEqual(2, m_connect.call_count)
+
+    def test_unknown_switch_healthy(self, m_connect):
+        self.assertTrue(self.health.is_healthy('br'))
+        self.assertIsNone(self.health.state('br'))
@@ -13,8 +13,10 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from concurrent import futures
 import contextlib
 import fixtures
+import oslo_messaging
 import tempfile
 import webob.exc
 
@@ -32,10 +34,24 @@ from neutron import quota
 from neutron.tests.unit.plugins.ml2 import test_plugin
 from neutron_lib.api.definitions import portbindings
 from neutron_lib.api.definitions import provider_net
+from neutron_lib.callbacks import events
 from neutron_lib.callbacks import resources
+from neutron_lib.plugins.ml2 import api as ml2api
+from oslo_config import cfg
 
 from networking_ansible import constants as c
 from networking_ansible import exceptions as netans_ml2exc
+from networking_ansible.ml2 import coordination_proxy
+from networking_ansible.ml2 import deadlines
+from networking_ansible.ml2 import desired_state
+from networking_ansible.ml2 import health
+from networking_ansible.ml2 import provisioning
+from networking_ansible.ml2 import revisions
+from networking_ansible.ml2 import switch_queue
+from networking_ansible.ml2 import thread_pool
+from networking_ansible.ml2 import topology
+from networking_ansible.ml2 import vlan_batch
+from networking_ansible.ml2 import vlan_gc
 from networking_ansible.tests.unit import base
 
 
@@ -91,7 +107,90 @@ class TestBindPort(base.NetworkingAnsibleTestCase):
             self.testport,
             self.testphysnet,
             self.mock_port_context,
+            self.testsegid,
+            priority=c.PRIORITY_BIND,
+            cache=mock.ANY)
+
+    def test_bind_port_overlay_continue_binding(self,
+                                                mock_ensure_port,
+                                                mock_prov_blocks,
+                                                mock_port_supported):
+        mock_port_supported.return_value = True
+        self.m_config.inventory[self.testhost][c.SWITCH_PHYSNET] = 'rack1'
+        top = {ml2api.ID: 'top', ml2api.NETWORK_TYPE: 'vxlan',
+               ml2api.PHYSICAL_NETWORK: None, ml2api.SEGMENTATION_ID: 5000}
+        dynamic = {ml2api.ID: 'dynamic', ml2api.NETWORK_TYPE: 'vlan',
+                   ml2api.PHYSICAL_NETWORK: 'rack1',
+                   ml2api.SEGMENTATION_ID: self.testsegid2}
+        self.mock_port_context.segments_to_bind = [top]
+        self.mock_port_context.allocate_dynamic_segment.return_value = \
+            dynamic
+        self.mech.bind_port(self.mock_port_context)
+        allocate = self.mock_port_context.allocate_dynamic_segment
+        allocate.assert_called_once_with(
+            {ml2api.NETWORK_TYPE: 'vlan', ml2api.PHYSICAL_NETWORK: 'rack1'})
+        self.mock_port_context.continue_binding.assert_called_once_with(
+            'top', [dynamic])
+        mock_ensure_port.assert_not_called()
+
+    def test_bind_port_dynamic_segment(self,
+                                       mock_ensure_port,
+                                       mock_prov_blocks,
+                                       mock_port_supported):
+        mock_port_supported.return_value = True
+        self.m_config.inventory[self.testhost][c.SWITCH_PHYSNET] = 'rack1'
+        dynamic = {ml2api.ID: 'dynamic', ml2api.NETWORK_TYPE: 'vlan',
+                   ml2api.PHYSICAL_NETWORK: 'rack1',
+                   ml2api.SEGMENTATION_ID: self.testsegid2}
+        self.mock_port_context.segments_to_bind = [dynamic]
+        self.mech.bind_port(self.mock_port_context)
+        self.mock_port_context.continue_binding.assert_not_called()
+        mock_ensure_port.assert_called_once_with(
+            self.mock_port_context.current,
+            self.mock_port_context._plugin_context,
+            self.testhost,
+            self.testport,
+            'rack1',
+            self.mock_port_context,
+            self.testsegid2,
+            priority=c.PRIORITY_BIND,
+            cache=mock.ANY)
+
+    def test_bind_port_other_physnet(self,
+                                     mock_ensure_port,
+                                     mock_prov_blocks,
+                                     mock_port_supported):
+        mock_port_supported.return_value = True
+        self.m_config.inventory[self.testhost][c.SWITCH_PHYSNET] = 'rack1'
+        self.mock_port_context.segments_to_bind = [
+            {ml2api.ID: 'other', ml2api.NETWORK_TYPE: 'vlan',
+             ml2api.PHYSICAL_NETWORK: 'rack2',
+             ml2api.SEGMENTATION_ID: self.testsegid2}]
+        self.mech.bind_port(self.mock_port_context)
+        self.mock_port_context.allocate_dynamic_segment.assert_not_called()
+        self.mock_port_context.continue_binding.assert_not_called()
+        mock_ensure_port.assert_not_called()
+
+    @mock.patch('networking_ansible.ml2.mech_driver.'
+                'AnsibleMechanismDriver._ensure_links')
+    @mock.patch('networking_ansible.ml2.mech_driver.'
+                'AnsibleMechanismDriver.get_switch_meta')
+    def test_bind_port_one_block_per_port(self,
+                                          mock_get_switch_meta,
+                                          mock_ensure_links,
+                                          mock_ensure_port,
+                                          mock_prov_blocks,
+                                          mock_port_supported):
+        mock_port_supported.return_value = True
+        mock_get_switch_meta.return_value = (
+            [(self.testhost, self.testport), (self.testhost, 'port2')],
             self.testsegid)
+        self.mech.bind_port(self.mock_port_context)
+        mock_prov_blocks.add_provisioning_component.assert_called_once_with(
+            self.mock_port_context._plugin_context,
+            self.mock_port_context.current['id'],
+            resources.PORT,
+            c.NETWORKING_ENTITY)
 
 
 class TestIsPortSupported(base.NetworkingAnsibleTestCase):
@@ -168,6 +267,36 @@ class TestCreateNetworkPostCommit(base.NetworkingAnsibleTestCase):
         mock_create_network.assert_called_once_with(self.testhost,
                                                     self.testsegid)
 
+    def test_create_network_postcommit_routed_to_owner(self,
+                                                       mock_create_network,
+                                                       mock_get_network):
+        self.mech.partitioner = mock.Mock()
+        self.mech.partitioner.owns.return_value = False
+        self.mech.partitioner.owner.return_value = 'otherhost-1'
+        self.mech.switch_rpc = mock.Mock()
+        self.mech.switch_rpc.change_vlan.return_value = True
+        self.mech.create_network_postcommit(self.mock_net_context)
+        self.mech.switch_rpc.change_vlan.assert_called_once_with(
+            self.mock_net_context._plugin_context, 'otherhost-1',
+            self.testhost, vlan_batch.CREATE,
+            self.mock_net_context.current['id'], self.testsegid,
+            physnet=None)
+        mock_create_network.assert_not_called()
+
+    def test_create_network_postcommit_owner_timeout(self,
+                                                     mock_create_network,
+                                                     mock_get_network):
+        mock_get_network.return_value = self.mock_net
+        self.mech.partitioner = mock.Mock()
+        self.mech.partitioner.owns.return_value = False
+        self.mech.partitioner.owner.return_value = 'otherhost-1'
+        self.mech.switch_rpc = mock.Mock()
+        self.mech.switch_rpc.change_vlan.side_effect = \
+            oslo_messaging.MessagingTimeout()
+        self.mech.create_network_postcommit(self.mock_net_context)
+        mock_create_network.assert_called_once_with(self.testhost,
+                                                    self.testsegid)
+
     def test_create_network_postcommit_manage_vlans_false(self,
                                                           mock_create_network,
                                                           mock_get_network):
@@ -216,6 +345,30 @@ class TestCreateNetworkPostCommit(base.NetworkingAnsibleTestCase):
         self.mech.create_network_postcommit(self.mock_net_context)
         mock_create_network.assert_not_called()
 
+    def test_create_network_postcommit_batched(self,
+                                               mock_create_network,
+                                               mock_get_network):
+        self.mech.vlan_batcher = mock.create_autospec(
+            vlan_batch.VlanBatcher, instance=True)
+        self.mech.create_network_postcommit(self.mock_net_context)
+        self.mech.vlan_batcher.submit.assert_called_once_with(
+            self.testhost, vlan_batch.CREATE,
+            self.mock_net_context.current['id'], self.testsegid)
+        self.mech.vlan_batcher.submit.return_value.result.\
+            assert_called_once_with(None)
+        mock_create_network.assert_not_called()
+
+    def test_create_network_postcommit_batched_fails(self,
+                                                     mock_create_network,
+                                                     mock_get_network):
+        self.mech.vlan_batcher = mock.create_autospec(
+            vlan_batch.VlanBatcher, instance=True)
+        self.mech.vlan_batcher.submit.return_value.result.side_effect = \
+            netans_ml2exc.NetworkingAnsibleMechException('vlan in use')
+        self.assertRaises(netans_ml2exc.NetworkingAnsibleMechException,
+                          self.mech.create_network_postcommit,
+                          self.mock_net_context)
+
 
 @mock.patch.object(network.NetworkSegment, 'get_objects')
 @mock.patch.object(api.NetworkRunner, 'delete_vlan')
@@ -278,6 +431,29 @@ class TestDeleteNetworkPostCommit(base.NetworkingAnsibleTestCase):
         mock_delete_network.assert_called_once()
 
 
+@mock.patch.object(network.NetworkSegment, 'get_objects')
+@mock.patch.object(api.NetworkRunner, 'delete_vlan')
+class TestDeleteNetworkPostCommitDeferred(base.NetworkingAnsibleTestCase):
+    def setUp(self):
+        super(TestDeleteNetworkPostCommitDeferred, self).setUp()
+        self.mech.vlan_gc = vlan_gc.VlanGarbageCollector(self.mech, 60, 0)
+
+    def test_delete_network_postcommit_deferred(self,
+                                                mock_delete_vlan,
+                                                mock_get_segments):
+        self.mech.delete_network_postcommit(self.mock_net_context)
+        mock_get_segments.assert_not_called()
+        mock_delete_vlan.assert_not_called()
+        self.assertEqual({(self.testphysnet, self.testsegid)},
+                         set(self.mech.vlan_gc.pending(self.testhost)))
+
+    def test_delete_network_postcommit_deferred_manage_vlans_false(
+            self, mock_delete_vlan, mock_get_segments):
+        self.m_config.inventory[self.testhost]['manage_vlans'] = False
+        self.mech.delete_network_postcommit(self.mock_net_context)
+        self.assertEqual({}, self.mech.vlan_gc.pending(self.testhost))
+
+
 @mock.patch('networking_ansible.ml2.mech_driver.'
             'AnsibleMechanismDriver.ensure_port')
 class TestDeletePortPostCommit(base.NetworkingAnsibleTestCase):
@@ -292,7 +468,71 @@ class TestDeletePortPostCommit(base.NetworkingAnsibleTestCase):
             self.testphysnet,
             self.mock_port_context,
             self.testsegid,
-            delete=True)
+            delete=True,
+            cache=mock.ANY)
+
+    @mock.patch('networking_ansible.ml2.mech_driver.'
+                'AnsibleMechanismDriver._switch_locked')
+    @mock.patch.object(ports.PortBindingLevel, 'objects_exist')
+    def test_delete_port_postcommit_dynamic_segment(self,
+                                                    mock_levels_exist,
+                                                    mock_switch_locked,
+                                                    mock_ensure_port):
+        self.m_config.inventory[self.testhost][c.SWITCH_PHYSNET] = 'rack1'
+        self.mock_port_context.top_bound_segment = {
+            ml2api.ID: 'top', ml2api.NETWORK_TYPE: 'vxlan'}
+        self.mock_port_context.bottom_bound_segment = {
+            ml2api.ID: 'dynamic', ml2api.NETWORK_TYPE: 'vlan',
+            ml2api.PHYSICAL_NETWORK: 'rack1',
+            ml2api.SEGMENTATION_ID: self.testsegid2}
+        mock_levels_exist.return_value = False
+        self.mech.delete_port_postcommit(self.mock_port_context)
+        mock_ensure_port.assert_called_once_with(
+            self.mock_port_context.current,
+            self.mock_port_context._plugin_context,
+            self.testhost,
+            self.testport,
+            self.testphysnet,
+            self.mock_port_context,
+            self.testsegid2,
+            delete=True,
+            cache=mock.ANY)
+        mock_levels_exist.assert_called_once_with(
+            self.mock_port_context._plugin_context, segment_id='dynamic')
+        self.mock_port_context.release_dynamic_segment.assert_called_once_with(
+            'dynamic')
+        mock_switch_locked.assert_called_once_with(
+            self.testhost, self.mech._delete_vlan,
+            self.mock_port_context._plugin_context, self.testhost,
+            self.testid, self.testsegid2, 'rack1',
+            priority=c.PRIORITY_DELETE)
+
+    @mock.patch.object(ports.PortBindingLevel, 'objects_exist')
+    def test_delete_port_postcommit_dynamic_segment_in_use(
+            self, mock_levels_exist, mock_ensure_port):
+        self.m_config.inventory[self.testhost][c.SWITCH_PHYSNET] = 'rack1'
+        self.mock_port_context.top_bound_segment = {
+            ml2api.ID: 'top', ml2api.NETWORK_TYPE: 'vxlan'}
+        self.mock_port_context.bottom_bound_segment = {
+            ml2api.ID: 'dynamic', ml2api.NETWORK_TYPE: 'vlan',
+            ml2api.PHYSICAL_NETWORK: 'rack1',
+            ml2api.SEGMENTATION_ID: self.testsegid2}
+        mock_levels_exist.return_value = True
+        self.mech.delete_port_postcommit(self.mock_port_context)
+        self.mock_port_context.release_dynamic_segment.assert_not_called()
+
+    @mock.patch.object(ports.PortBindingLevel, 'objects_exist')
+    def test_delete_port_postcommit_static_segment(self,
+                                                   mock_levels_exist,
+                                                   mock_ensure_port):
+        segment = {ml2api.ID: 'static', ml2api.NETWORK_TYPE: 'vlan',
+                   ml2api.PHYSICAL_NETWORK: self.testphysnet,
+                   ml2api.SEGMENTATION_ID: self.testsegid}
+        self.mock_port_context.top_bound_segment = segment
+        self.mock_port_context.bottom_bound_segment = segment
+        self.mech.delete_port_postcommit(self.mock_port_context)
+        mock_levels_exist.assert_not_called()
+        self.mock_port_context.release_dynamic_segment.assert_not_called()
 
     @mock.patch('networking_ansible.ml2.mech_driver.'
                 'AnsibleMechanismDriver._is_port_bound')
@@ -334,6 +574,250 @@ class TestInit(base.NetworkingAnsibleTestCase):
         self.assertEqual(self.mech.kwargs,
                          {self.testhost: {'custom': 'param'}})
 
+    def test_intialize_w_rate_limit(self, m_config, m_coord):
+        m_coord.get_coordinator = lambda *args: mock.create_autospec(
+            coordination.CoordinationDriver).return_value
+        m_config.return_value = base.MockConfig(self.testhost,
+                                                self.testmac)
+        m_config.return_value.inventory[self.testhost]['rate_limit'] = '2'
+        self.mech.initialize()
+        self.assertEqual(self.mech.kwargs, {self.testhost: {}})
+        self.assertEqual(2, self.mech.throttles.get(self.testhost).bucket.rate)
+
+    @mock.patch('networking_ansible.ml2.mech_driver.registry')
+    def test_intialize_lazy(self, m_registry, m_config, m_coord):
+        self.config(lazy_startup=True, group='ml2_ansible')
+        m_config.return_value = base.MockConfig(self.testhost,
+                                                self.testmac)
+        self.mech.initialize()
+        m_coord.get_coordinator.assert_not_called()
+        self.assertFalse(self.mech.is_ready())
+        m_registry.subscribe.assert_any_call(self.mech._warm_up,
+                                             resources.PROCESS,
+                                             events.AFTER_INIT)
+        self.mech.coordinator.get_lock(self.testhost)
+        m_coord.get_coordinator.assert_called_once_with(
+            cfg.CONF.ml2_ansible.coordination_uri, mock.ANY)
+        m_coord.get_coordinator.return_value.start.assert_called_once_with(
+            start_heart=True)
+        self.assertFalse(self.mech.is_ready())
+        self.mech._warm_up_backends()
+        self.assertTrue(self.mech.is_ready())
+
+    @mock.patch('networking_ansible.ml2.mech_driver.registry')
+    def test_intialize_vlan_gc_started_in_worker(self, m_registry, m_config,
+                                                 m_coord):
+        self.config(vlan_gc_interval=60, group='ml2_ansible')
+        m_config.return_value = base.MockConfig(self.testhost,
+                                                self.testmac)
+        self.mech.initialize()
+        m_registry.subscribe.assert_any_call(self.mech._start_vlan_gc,
+                                             resources.PROCESS,
+                                             events.AFTER_INIT)
+        self.assertIsNone(self.mech.vlan_gc._loop)
+
+    @mock.patch.object(desired_state.DesiredStateStore, 'from_uri')
+    def test_intialize_desired_state_without_partitioning(self, m_from_uri,
+                                                          m_config,
+                                                          m_coord):
+        self.config(desired_state_uri='http://127.0.0.1:2379',
+                    group='ml2_ansible')
+        m_config.return_value = base.MockConfig(self.testhost,
+                                                self.testmac)
+        self.mech.initialize()
+        self.assertIsNone(self.mech.desired_state)
+        m_from_uri.assert_not_called()
+
+    def test_warm_up(self, m_config, m_coord):
+        self.config(lazy_startup=True, group='ml2_ansible')
+        m_config.return_value = base.MockConfig(self.testhost,
+                                                self.testmac)
+        self.mech.initialize()
+        self.mech._warm_up_connections()
+        self.assertTrue(self.mech.is_ready())
+
+    def test_warm_up_failure(self, m_config, m_coord):
+        self.config(lazy_startup=True, group='ml2_ansible')
+        m_config.return_value = base.MockConfig(self.testhost,
+                                                self.testmac)
+        m_coord.get_coordinator.return_value.start.side_effect = [
+            Exception('etcd unreachable'), None]
+        self.mech.initialize()
+        self.mech._warm_up_connections()
+        self.assertFalse(self.mech.is_ready())
+        # retried on first use
+        self.mech._switch_locked(self.testhost, mock.Mock())
+        self.assertTrue(self.mech.is_ready())
+
+    @mock.patch('networking_ansible.ml2.mech_driver.threading')
+    def test_warm_up_ready(self, m_threading, m_config, m_coord):
+        m_config.return_value = base.MockConfig(self.testhost,
+                                                self.testmac)
+        self.mech.initialize()
+        self.assertTrue(self.mech.is_ready())
+        self.mech._warm_up(resources.PROCESS, events.AFTER_INIT, None)
+        m_threading.Thread.assert_not_called()
+
+
+class TestDeviceThreadPool(base.NetworkingAnsibleTestCase):
+    def setUp(self):
+        super(TestDeviceThreadPool, self).setUp()
+        self.mech.device_pool = thread_pool.DeviceThreadPool(2)
+
+    @mock.patch.object(api.NetworkRunner, 'create_vlan')
+    def test_device_call(self, mock_create_vlan):
+        self.mech._device_call(self.testhost, 'create_vlan', self.testsegid)
+        mock_create_vlan.assert_called_once_with(self.testhost,
+                                                 self.testsegid)
+        self.assertEqual(1, self.mech.device_pool.stats()['completed'])
+
+    def test_switch_lock(self):
+        lock = self.mech._get_switch_lock(self.testhost)
+        self.assertIsInstance(lock, thread_pool.BlockingLock)
+        with lock:
+            pass
+        self.mech.coordinator.get_lock.return_value.acquire.\
+            assert_called_once_with(blocking=False)
+
+
+class TestDesiredState(base.NetworkingAnsibleTestCase):
+    @mock.patch.object(api.NetworkRunner, 'create_vlan')
+    def test_device_call_published(self, mock_create_vlan):
+        self.mech.desired_state = mock.create_autospec(
+            desired_state.DesiredStateStore, instance=True)
+        self.mech._device_call(self.testhost, 'create_vlan', self.testsegid)
+        self.mech.desired_state.publish.assert_called_once_with(
+            self.testhost, 'create_vlan', self.testsegid)
+        mock_create_vlan.assert_not_called()
+
+    def test_publish_without_switch_lock(self):
+        self.mech.desired_state = mock.create_autospec(
+            desired_state.DesiredStateStore, instance=True)
+        self.mech.coordinator.get_lock.reset_mock()
+        self.mech._switch_locked(self.testhost, self.mech._device_call,
+                                 self.testhost, 'create_vlan',
+                                 self.testsegid)
+        self.mech.desired_state.publish.assert_called_once_with(
+            self.testhost, 'create_vlan', self.testsegid)
+        self.mech.coordinator.get_lock.assert_not_called()
+
+
+class TestSwitchHealth(base.NetworkingAnsibleTestCase):
+    @mock.patch.object(api.NetworkRunner, 'create_vlan')
+    def test_unreachable_switch_fails_fast(self, mock_create_vlan):
+        self.mech.switch_health = mock.create_autospec(
+            health.SwitchHealth, instance=True)
+        self.mech.switch_health.is_healthy.return_value = False
+        self.mech.switch_health.state.return_value = {'error': 'timed out'}
+        e = self.assertRaises(netans_ml2exc.NetworkingAnsibleMechException,
+                              self.mech._switch_locked, self.testhost,
+                              self.mech._device_call, self.testhost,
+                              'create_vlan', self.testsegid)
+        # MechanismDriverError only keeps the message in its attribute
+        self.assertIn('unreachable: timed out', e.message)
+        mock_create_vlan.assert_not_called()
+
+    @mock.patch.object(api.NetworkRunner, 'create_vlan')
+    def test_healthy_switch(self, mock_create_vlan):
+        self.mech.switch_health = mock.create_autospec(
+            health.SwitchHealth, instance=True)
+        self.mech.switch_health.is_healthy.return_value = True
+        self.mech._switch_locked(self.testhost, self.mech._device_call,
+                                 self.testhost, 'create_vlan',
+                                 self.testsegid)
+        mock_create_vlan.assert_called_once()
+
+
+class TestDeadlines(base.NetworkingAnsibleTestCase):
+    @mock.patch.object(api.NetworkRunner, 'create_vlan')
+    def test_lock_timeout(self, mock_create_vlan):
+        self.config(lock_timeout=30, group='ml2_ansible')
+        lock = self.mech.coordinator.get_lock.return_value
+        lock.acquire.return_value = False
+        self.assertRaisesRegex(netans_ml2exc.DeadlineExceededException,
+                               'Timed out after 30.0 seconds acquiring the '
+                               'lock of switch',
+                               self.mech._switch_locked, self.testhost,
+                               self.mech._device_call, self.testhost,
+                               'create_vlan', self.testsegid)
+        lock.acquire.assert_called_once_with(blocking=30)
+        lock.release.assert_not_called()
+        mock_create_vlan.assert_not_called()
+
+    def test_queue_wait_within_budget(self):
+        self.mech.switch_queues = mock.create_autospec(
+            switch_queue.SwitchQueues, instance=True)
+        self.mech.switch_queues.run.side_effect = futures.TimeoutError()
+        self.config(hook_timeout=10, group='ml2_ansible')
+        with deadlines.budget(10):
+            self.assertRaises(netans_ml2exc.DeadlineExceededException,
+                              self.mech._switch_locked, self.testhost,
+                              self.mech._device_call, self.testhost,
+                              'create_vlan', self.testsegid)
+        timeout = self.mech.switch_queues.run.call_args[1]['timeout']
+        self.assertTrue(0 < timeout <= 10)
+
+    def test_batched_vlans_within_budget(self):
+        future = mock.Mock()
+        future.result.side_effect = futures.TimeoutError()
+        with deadlines.budget(10):
+            self.assertRaises(netans_ml2exc.DeadlineExceededException,
+                              self.mech._wait_batched, [future])
+        self.assertTrue(0 < future.result.call_args[0][0] <= 10)
+
+
+class TestCommitAggregation(base.NetworkingAnsibleTestCase):
+    def setUp(self):
+        super(TestCommitAggregation, self).setUp()
+        self.m_config.inventory[self.testhost][c.COMMIT_WINDOW] = '0.5'
+
+    def test_get_committer(self):
+        committer = self.mech._get_committer(self.testhost)
+        self.assertEqual(0.5, committer.window)
+        self.m_config.inventory[self.testhost][c.COMMIT_WINDOW] = 'soon'
+        self.assertIsNone(self.mech._get_committer(self.testhost))
+        del self.m_config.inventory[self.testhost][c.COMMIT_WINDOW]
+        self.assertIsNone(self.mech._get_committer(self.testhost))
+
+    @mock.patch.object(api.NetworkRunner, 'create_vlan')
+    def test_device_call_staged(self, mock_create_vlan):
+        with self.mech._staging(self.testhost) as staged:
+            self.mech._device_call(self.testhost, 'create_vlan',
+                                   self.testsegid)
+        self.assertEqual([('create_vlan', (self.testsegid,))], staged)
+        mock_create_vlan.assert_not_called()
+
+    @mock.patch.object(api.NetworkRunner, 'create_vlan')
+    def test_commit_staged(self, mock_create_vlan):
+        mock_create_vlan.side_effect = [None, Exception('vlan exists')]
+        errors = self.mech._commit_staged(
+            self.testhost, [('create_vlan', (self.testsegid,)),
+                            ('create_vlan', (self.testsegid2,))])
+        self.assertIsNone(errors[0])
+        self.assertIsInstance(errors[1],
+                              netans_ml2exc.NetworkingAnsibleMechException)
+
+    def test_revision_not_recorded_while_staged(self):
+        self.mech.revisions = revisions.AppliedRevisions()
+        port = {'id': 'port1', 'revision_number': 5}
+        with self.mech._staging(self.testhost):
+            self.mech._record_applied(port, self.testhost, self.testport)
+        self.assertFalse(self.mech._is_applied(port, self.testhost,
+                                               self.testport))
+        self.mech._record_applied(port, self.testhost, self.testport)
+        self.assertTrue(self.mech._is_applied(port, self.testhost,
+                                              self.testport))
+
+
+class TestCoordinationProxyLock(base.NetworkingAnsibleTestCase):
+    def test_switch_lock(self):
+        self.mech.coordination_proxy = coordination_proxy.ProxyClient(
+            '/run/proxy.sock')
+        lock = self.mech._get_switch_lock(self.testhost)
+        self.assertIsInstance(lock, coordination_proxy.ProxyLock)
+        self.assertEqual(self.testhost, lock.name)
+        self.mech.coordinator.get_lock.assert_not_called()
+
 
 @mock.patch('networking_ansible.ml2.mech_driver.'
             'AnsibleMechanismDriver._is_port_bound')
@@ -355,6 +839,18 @@ class TestUpdatePortPostCommit(base.NetworkingAnsibleTestCase):
             resources.PORT,
             c.NETWORKING_ENTITY)
 
+    def test_update_port_postcommit_port_bound_batched(self,
+                                                       mock_ensure_port,
+                                                       mock_prov_blocks,
+                                                       mock_port_bound):
+        mock_port_bound.return_value = True
+        self.mech.provisioning = mock.create_autospec(
+            provisioning.ProvisioningBatcher, instance=True)
+        self.mock_port_context.original = self.mock_port_context.current
+        self.mech.update_port_postcommit(self.mock_port_context)
+        self.mech.provisioning.complete.assert_called_once_with(self.testid)
+        mock_prov_blocks.provisioning_complete.assert_not_called()
+
     def test_update_port_postcommit_port_bound_orig(self,
                                                     mock_ensure_port,
                                                     mock_prov_blocks,
@@ -369,7 +865,9 @@ class TestUpdatePortPostCommit(base.NetworkingAnsibleTestCase):
             self.testport,
             self.testphysnet,
             self.mock_port_context,
-            self.testsegid)
+            self.testsegid,
+            priority=c.PRIORITY_DELETE,
+            cache=mock.ANY)
 
     def test_update_port_postcommit_port_not_bound(self,
                                                    mock_ensure_port,
@@ -386,6 +884,9 @@ class TestUpdatePortPostCommit(base.NetworkingAnsibleTestCase):
         mappings = [(self.testhost, self.testport)]
         self.m_config.port_mappings = {self.test_hostid: mappings}
         self.mock_port_context.current = self.mock_port_context.original
+        self.mock_port_context.original = dict(
+            self.mock_port_vm.dict,
+            **{portbindings.VIF_TYPE: portbindings.VIF_TYPE_UNBOUND})
         self.mech.update_port_postcommit(self.mock_port_context)
         mock_ensure_port.assert_called_once_with(
             self.mock_port_context.current,
@@ -394,7 +895,8 @@ class TestUpdatePortPostCommit(base.NetworkingAnsibleTestCase):
             self.testport,
             self.testphysnet,
             self.mock_port_context,
-            self.testsegid)
+            self.testsegid,
+            cache=mock.ANY)
 
     def test_update_port_postcommit_port_w_direct_port(self,
                                                        mock_ensure_port,
@@ -405,7 +907,8 @@ class TestUpdatePortPostCommit(base.NetworkingAnsibleTestCase):
                                        self.test_pci_addr.replace(':', ''))
         self.m_config.port_mappings = {sriov_host_id: mappings}
         self.mock_port_context.current = self.mock_port_dt
-        self.mock_port_context.original = self.mock_port_dt
+        self.mock_port_context.original = dict(
+            self.mock_port_dt.dict, **{portbindings.PROFILE: {}})
         self.mech.update_port_postcommit(self.mock_port_context)
         mock_ensure_port.assert_called_once_with(
             self.mock_port_context.current,
@@ -414,7 +917,74 @@ class TestUpdatePortPostCommit(base.NetworkingAnsibleTestCase):
             self.testport,
             self.testphysnet,
             self.mock_port_context,
-            self.testsegid)
+            self.testsegid,
+            cache=mock.ANY)
+
+    def test_update_port_postcommit_normal_port_unchanged(self,
+                                                          mock_ensure_port,
+                                                          mock_prov_blocks,
+                                                          mock_port_bound):
+        mappings = [(self.testhost, self.testport)]
+        self.m_config.port_mappings = {self.test_hostid: mappings}
+        self.mock_port_context.current = self.mock_port_vm
+        self.mock_port_context.original = self.mock_port_vm
+        self.mech.update_port_postcommit(self.mock_port_context)
+        mock_ensure_port.assert_not_called()
+        mock_prov_blocks.provisioning_complete.assert_not_called()
+
+    def test_update_port_postcommit_normal_port_irrelevant(self,
+                                                           mock_ensure_port,
+                                                           mock_prov_blocks,
+                                                           mock_port_bound):
+        mappings = [(self.testhost, self.testport)]
+        self.m_config.port_mappings = {self.test_hostid: mappings}
+        self.mock_port_context.current = self.mock_port_vm
+        self.mock_port_context.original = dict(self.mock_port_vm.dict,
+                                               name='old-name',
+                                               security_groups=['sg'])
+        self.mech.update_port_postcommit(self.mock_port_context)
+        mock_ensure_port.assert_not_called()
+
+
+class TestIsSwitchRelevantUpdate(base.NetworkingAnsibleTestCase):
+    def setUp(self):
+        super(TestIsSwitchRelevantUpdate, self).setUp()
+        self.port = {
+            'id': self.testid,
+            'name': 'port',
+            'network_id': self.testid2,
+            c.DEVICE_OWNER: c.COMPUTE_NOVA,
+            portbindings.HOST_ID: self.test_hostid,
+            portbindings.VNIC_TYPE: portbindings.VNIC_NORMAL,
+            portbindings.VIF_TYPE: portbindings.VIF_TYPE_OVS,
+            portbindings.PROFILE: {}
+        }
+
+    def test_no_original(self):
+        self.assertTrue(
+            self.mech._is_switch_relevant_update(self.port, None))
+
+    def test_unchanged(self):
+        self.assertFalse(
+            self.mech._is_switch_relevant_update(self.port, dict(self.port)))
+
+    def test_irrelevant_field(self):
+        original = dict(self.port, name='old-name', description='desc')
+        self.assertFalse(
+            self.mech._is_switch_relevant_update(self.port, original))
+
+    def test_relevant_fields(self):
+        changes = {'network_id': 'other-net',
+                   c.DEVICE_OWNER: c.BAREMETAL_NONE,
+                   portbindings.HOST_ID: 'other-host',
+                   portbindings.VNIC_TYPE: portbindings.VNIC_DIRECT,
+                   portbindings.VIF_TYPE: portbindings.VIF_TYPE_UNBOUND,
+                   portbindings.PROFILE: self.profile_pci_slot}
+        for field, value in changes.items():
+            original = dict(self.port, **{field: value})
+            self.assertTrue(
+                self.mech._is_switch_relevant_update(self.port, original),
+                field)
 
 
 class TestLinkInfo(base.NetworkingAnsibleTestCase):
@@ -466,12 +1036,37 @@ class TestLinkInfo(base.NetworkingAnsibleTestCase):
             self.assertEqual(switch_port, self.testport)
             self.assertEqual(segmentation_id, '')
 
+    def test_switch_meta_from_link_info_multiple_links(self):
+        self.mock_port_bm.bindings[0].profile = {
+            c.LLI: [{'switch_info': self.testhost, 'port_id': 'eth1'},
+                    {'switch_info': 'otherhost', 'port_id': 'eth2'},
+                    {'switch_info': self.testhost, 'port_id': 'eth1'}]}
+        mappings, segmentation_id = \
+            self.mech._switch_meta_from_link_info(self.mock_port_bm)
+        self.assertEqual([(self.testhost, 'eth1'), ('otherhost', 'eth2')],
+                         mappings)
+
     def test_switch_meta_from_link_info_context_no_lli(self):
         self.mock_port_bm.bindings[0].profile[c.LLI] = {}
         self.assertRaises(netans_ml2exc.LocalLinkInfoMissingException,
                           self.mech._switch_meta_from_link_info,
                           self.mock_port_bm)
 
+    def test_switch_meta_from_port_host_id_direct(self):
+        mappings = [(self.testhost, self.testport)]
+        sriov_host_id = '{}-{}'.format(self.test_hostid,
+                                       self.test_pci_addr.replace(':', ''))
+        self.m_config.port_mappings = {sriov_host_id: mappings}
+        self.assertEqual(
+            mappings,
+            self.mech._switch_meta_from_port_host_id(self.mock_port_dt)[0])
+
+    def test_switch_meta_from_port_host_id_invalid_pci_slot(self):
+        self.mock_port_dt.dict[portbindings.PROFILE] = {'pci_slot': 'bad'}
+        self.assertRaises(netans_ml2exc.PciSlotInvalidException,
+                          self.mech._switch_meta_from_port_host_id,
+                          self.mock_port_dt)
+
     def test_link_info_from_port_port_not_supported(self):
         # If this test fails from a missing key in the future
         # it's generall safe to just throw the key into this dict
@@ -486,6 +1081,71 @@ class TestLinkInfo(base.NetworkingAnsibleTestCase):
                           port)
 
 
+@mock.patch('networking_ansible.ml2.mech_driver.'
+            'AnsibleMechanismDriver.ensure_port')
+class TestEnsureLinks(base.NetworkingAnsibleTestCase):
+    def setUp(self):
+        super(TestEnsureLinks, self).setUp()
+        self.mappings = [(self.testhost, 'eth1'), ('otherhost', 'eth2')]
+
+    def test_ensure_links_single_link(self, mock_ensure_port):
+        self.mech._ensure_links(self.mock_port_bm, 'db',
+                                [(self.testhost, self.testport)],
+                                self.testphysnet, self.mock_port_context,
+                                self.testsegid, priority=c.PRIORITY_BIND)
+        mock_ensure_port.assert_called_once_with(
+            self.mock_port_bm, 'db', self.testhost, self.testport,
+            self.testphysnet, self.mock_port_context, self.testsegid,
+            priority=c.PRIORITY_BIND)
+
+    def test_ensure_links_no_links(self, mock_ensure_port):
+        self.assertFalse(
+            self.mech._ensure_links(self.mock_port_bm, 'db', [],
+                                    self.testphysnet,
+                                    self.mock_port_context,
+                                    self.testsegid))
+        mock_ensure_port.assert_not_called()
+
+    def test_ensure_links_multiple_links(self, mock_ensure_port):
+        mock_ensure_port.return_value = True
+        self.assertTrue(
+            self.mech._ensure_links(self.mock_port_bm, 'db', self.mappings,
+                                    self.testphysnet,
+                                    self.mock_port_context,
+                                    self.testsegid, delete=True))
+        mock_ensure_port.assert_has_calls(
+            [mock.call(self.mock_port_bm, 'db', switch_name, switch_port,
+                       self.testphysnet, None, self.testsegid, delete=True)
+             for switch_name, switch_port in self.mappings],
+            any_order=True)
+        self.mock_port_context.set_binding.assert_called_once_with(
+            self.testid, portbindings.VIF_TYPE_OTHER, {})
+
+    def test_ensure_links_link_not_applied(self, mock_ensure_port):
+        mock_ensure_port.side_effect = \
+            lambda *args, **kwargs: args[2] == self.testhost
+        self.assertFalse(
+            self.mech._ensure_links(self.mock_port_bm, 'db', self.mappings,
+                                    self.testphysnet,
+                                    self.mock_port_context,
+                                    self.testsegid))
+        self.mock_port_context.set_binding.assert_not_called()
+
+    def test_ensure_links_link_fails(self, mock_ensure_port):
+        def ensure_port(port, db, switch_name, *args, **kwargs):
+            if switch_name == 'otherhost':
+                raise netans_ml2exc.NetworkingAnsibleMechException('fail')
+            return True
+        mock_ensure_port.side_effect = ensure_port
+        self.assertRaises(netans_ml2exc.NetworkingAnsibleMechException,
+                          self.mech._ensure_links,
+                          self.mock_port_bm, 'db', self.mappings,
+                          self.testphysnet, self.mock_port_context,
+                          self.testsegid)
+        self.assertEqual(2, mock_ensure_port.call_count)
+        self.mock_port_context.set_binding.assert_not_called()
+
+
 @mock.patch('network_runner.api.NetworkRunner.delete_port')
 class TestDeleteSwitchPort(base.NetworkingAnsibleTestCase):
     def test_delete_switch_port_fails(self, mock_delete):
@@ -569,21 +1229,40 @@ class TestIsDeletedPortInUse(base.NetworkingAnsibleTestCase):
         self.assertFalse(
             self.mech._is_deleted_port_in_use(self.testphysnet, 2, 3))
 
+    @mock.patch.object(network.NetworkSegment, 'objects_exist')
+    def test_is_in_use_indexed_dynamic_segment(self,
+                                               mock_segment_exists,
+                                               mock_net_get_object,
+                                               mock_port_get_objects):
+        self.mech.topology = mock.create_autospec(
+            topology.TopologyIndex).return_value
+        self.mech.topology.segments.return_value = [
+            topology.Segment('vxlan', None, 1001)]
+        mock_port_get_objects.return_value = [self.mock_port_bm]
+        mock_segment_exists.return_value = True
+        self.assertTrue(
+            self.mech._is_deleted_port_in_use(self.testphysnet, 2, 3))
+        mock_net_get_object.assert_not_called()
+
 
 @mock.patch.object(coordination.CoordinationDriver, 'get_lock')
 @mock.patch.object(ports.Port, 'get_object')
-@mock.patch('network_runner.api.NetworkRunner.has_host')
 class TestEnsurePort(base.NetworkingAnsibleTestCase):
+    def setUp(self):
+        super(TestEnsurePort, self).setUp()
+        self.mock_port_exists = mock.patch.object(
+            ports.Port, 'objects_exist', return_value=True).start()
+        self.mock_net_get_object = mock.patch.object(
+            network.Network, 'get_object').start()
+
     def test_ensure_port_no_host(self,
-                                 mock_has_host,
                                  mock_port_get_object,
                                  mock_get_lock):
-        mock_has_host.return_value = False
         self.assertRaises(ml2_exc.MechanismDriverError,
                           self.mech.ensure_port,
                           self.mock_port_context.current,
                           self.mock_port_context._plugin_context,
-                          self.testhost,
+                          'unknownhost',
                           self.testport,
                           self.testphysnet,
                           self.mock_port_context,
@@ -596,7 +1275,6 @@ class TestEnsurePort(base.NetworkingAnsibleTestCase):
     def test_ensure_port_no_port_delete(self,
                                         mock_is_deleted,
                                         mock_delete_port,
-                                        mock_has_host,
                                         mock_port_get_object,
                                         mock_get_lock):
         mock_port_get_object.return_value = None
@@ -618,7 +1296,6 @@ class TestEnsurePort(base.NetworkingAnsibleTestCase):
     def test_ensure_port_no_port_keep(self,
                                       mock_is_deleted,
                                       mock_delete_port,
-                                      mock_has_host,
                                       mock_port_get_object,
                                       mock_get_lock):
         mock_port_get_object.return_value = None
@@ -637,7 +1314,6 @@ class TestEnsurePort(base.NetworkingAnsibleTestCase):
                 'AnsibleMechanismDriver._set_port_state')
     def test_ensure_port_set_port_state(self,
                                         mock_set_state,
-                                        mock_has_host,
                                         mock_port_get_object,
                                         mock_get_lock):
         mock_port_get_object.return_value = self.mock_port_bm
@@ -653,13 +1329,138 @@ class TestEnsurePort(base.NetworkingAnsibleTestCase):
             self.mock_port_bm,
             self.mock_port_context._plugin_context,
             self.testhost,
-            self.testport)
+            self.testport,
+            cache=mock.ANY)
+
+    @mock.patch('networking_ansible.ml2.mech_driver.'
+                'AnsibleMechanismDriver._set_port_state')
+    def test_ensure_port_prefetched_port_changed(self,
+                                                 mock_set_state,
+                                                 mock_port_get_object,
+                                                 mock_get_lock):
+        updated_port = mock.create_autospec(ports.Port).return_value
+        updated_port.dict = self.mock_port_bm.dict
+        updated_port.__getitem__ = self.mock_port_bm.__getitem__
+        updated_port.bindings = self.mock_port_bm.bindings
+        mock_port_get_object.side_effect = [self.mock_port_bm, updated_port]
+        self.mock_port_exists.return_value = False
+        self.mech.ensure_port(
+            self.mock_port_context.current,
+            self.mock_port_context._plugin_context,
+            self.testhost,
+            self.testport,
+            self.testphysnet,
+            self.mock_port_context,
+            self.testsegid)
+        self.mock_port_exists.assert_called_once_with(
+            self.mock_port_context._plugin_context,
+            id=self.mock_port_context.current['id'],
+            revision_number=self.mock_port_bm.revision_number)
+        mock_set_state.assert_called_once_with(
+            updated_port,
+            self.mock_port_context._plugin_context,
+            self.testhost,
+            self.testport,
+            cache=mock.ANY)
+
+    def test_current_port_deleted(self,
+                                  mock_port_get_object,
+                                  mock_get_lock):
+        self.mock_port_exists.return_value = False
+        self.assertIsNone(self.mech._current_port('db', 'port1', None))
+        self.mock_port_exists.assert_called_once_with('db', id='port1')
+        mock_port_get_object.assert_not_called()
+
+    def test_current_port_recreated(self,
+                                    mock_port_get_object,
+                                    mock_get_lock):
+        self.assertEqual(mock_port_get_object.return_value,
+                         self.mech._current_port('db', 'port1', None))
+        mock_port_get_object.assert_called_once_with('db', id='port1')
+
+    @mock.patch('networking_ansible.ml2.mech_driver.'
+                'AnsibleMechanismDriver._set_port_state')
+    def test_ensure_port_revision_applied(self,
+                                          mock_set_state,
+                                          mock_port_get_object,
+                                          mock_get_lock):
+        self.mech.revisions = revisions.AppliedRevisions()
+        self.mock_port_bm.dict['revision_number'] = 5
+        mock_port_get_object.return_value = self.mock_port_bm
+        mock_set_state.return_value = True
+        for _ in range(2):
+            self.mech.ensure_port(
+                self.mock_port_context.current,
+                self.mock_port_context._plugin_context,
+                self.testhost,
+                self.testport,
+                self.testphysnet,
+                self.mock_port_context,
+                self.testsegid)
+        mock_set_state.assert_called_once_with(
+            self.mock_port_bm,
+            self.mock_port_context._plugin_context,
+            self.testhost,
+            self.testport,
+            cache=mock.ANY)
+        self.assertEqual(2, self.mock_port_context.set_binding.call_count)
+        # the network is only read for the revision not yet applied
+        self.mock_net_get_object.assert_called_once_with(
+            self.mock_port_context._plugin_context,
+            id=self.mock_port_context.current['network_id'])
+
+    @mock.patch('networking_ansible.ml2.mech_driver.'
+                'AnsibleMechanismDriver._set_port_state')
+    def test_ensure_port_revision_failed_not_recorded(self,
+                                                      mock_set_state,
+                                                      mock_port_get_object,
+                                                      mock_get_lock):
+        self.mech.revisions = revisions.AppliedRevisions()
+        self.mock_port_bm.dict['revision_number'] = 5
+        mock_port_get_object.return_value = self.mock_port_bm
+        mock_set_state.side_effect = [
+            netans_ml2exc.NetworkingAnsibleMechException('device error'),
+            True]
+        args = (self.mock_port_context.current,
+                self.mock_port_context._plugin_context,
+                self.testhost,
+                self.testport,
+                self.testphysnet,
+                self.mock_port_context,
+                self.testsegid)
+        self.assertRaises(netans_ml2exc.NetworkingAnsibleMechException,
+                          self.mech.ensure_port, *args)
+        self.mech.ensure_port(*args)
+        self.assertEqual(2, mock_set_state.call_count)
+
+    @mock.patch('networking_ansible.ml2.mech_driver.'
+                'AnsibleMechanismDriver._set_port_state')
+    def test_ensure_port_revision_published_not_recorded(self,
+                                                         mock_set_state,
+                                                         mock_port_get_object,
+                                                         mock_get_lock):
+        self.mech.revisions = revisions.AppliedRevisions()
+        self.mech.desired_state = mock.create_autospec(
+            desired_state.DesiredStateStore, instance=True)
+        self.mock_port_bm.dict['revision_number'] = 5
+        mock_port_get_object.return_value = self.mock_port_bm
+        mock_set_state.return_value = True
+        for _ in range(2):
+            self.mech.ensure_port(
+                self.mock_port_context.current,
+                self.mock_port_context._plugin_context,
+                self.testhost,
+                self.testport,
+                self.testphysnet,
+                self.mock_port_context,
+                self.testsegid)
+        # the revision is only published, not applied on the switch yet
+        self.assertEqual(2, mock_set_state.call_count)
 
     @mock.patch('networking_ansible.ml2.mech_driver.'
                 'AnsibleMechanismDriver._set_port_state')
     def test_ensure_port_set_port_state_binding(self,
                                                 mock_set_state,
-                                                mock_has_host,
                                                 mock_port_get_object,
                                                 mock_get_lock):
         mock_port_get_object.return_value = self.mock_port_bm
@@ -676,14 +1477,14 @@ class TestEnsurePort(base.NetworkingAnsibleTestCase):
             self.mock_port_bm,
             self.mock_port_context._plugin_context,
             self.testhost,
-            self.testport)
+            self.testport,
+            cache=mock.ANY)
         self.mock_port_context.set_binding.assert_called_once()
 
     @mock.patch('networking_ansible.ml2.mech_driver.'
                 'AnsibleMechanismDriver._set_port_state')
     def test_ensure_port_set_port_state_no_binding(self,
                                                    mock_set_state,
-                                                   mock_has_host,
                                                    mock_port_get_object,
                                                    mock_get_lock):
         mock_port_get_object.return_value = self.mock_port_bm
@@ -700,14 +1501,80 @@ class TestEnsurePort(base.NetworkingAnsibleTestCase):
             self.mock_port_bm,
             self.mock_port_context._plugin_context,
             self.testhost,
-            self.testport)
+            self.testport,
+            cache=mock.ANY)
+        self.mock_port_context.set_binding.assert_not_called()
+
+    @mock.patch('networking_ansible.ml2.mech_driver.'
+                'AnsibleMechanismDriver._ensure_port')
+    def test_ensure_port_routed_to_owner(self,
+                                         mock_local_ensure,
+                                         mock_port_get_object,
+                                         mock_get_lock):
+        self.mech.partitioner = mock.Mock()
+        self.mech.partitioner.owns.return_value = False
+        self.mech.partitioner.owner.return_value = 'otherhost-1'
+        self.mech.switch_rpc = mock.Mock()
+        self.mech.switch_rpc.ensure_port.return_value = True
+        self.mech.ensure_port(
+            self.mock_port_context.current,
+            self.mock_port_context._plugin_context,
+            self.testhost,
+            self.testport,
+            self.testphysnet,
+            self.mock_port_context,
+            self.testsegid)
+        self.mech.switch_rpc.ensure_port.assert_called_once_with(
+            self.mock_port_context._plugin_context,
+            'otherhost-1',
+            self.mock_port_context.current,
+            self.testhost,
+            self.testport,
+            self.testphysnet,
+            self.testsegid,
+            delete=False,
+            priority=c.PRIORITY_UPDATE)
+        mock_local_ensure.assert_not_called()
+        mock_get_lock.assert_not_called()
+        self.mock_port_context.set_binding.assert_called_once()
+
+    @mock.patch('networking_ansible.ml2.mech_driver.'
+                'AnsibleMechanismDriver._ensure_port')
+    def test_ensure_port_owner_timeout(self,
+                                       mock_local_ensure,
+                                       mock_port_get_object,
+                                       mock_get_lock):
+        self.mech.partitioner = mock.Mock()
+        self.mech.partitioner.owns.return_value = False
+        self.mech.partitioner.owner.return_value = 'otherhost-1'
+        self.mech.switch_rpc = mock.Mock()
+        self.mech.switch_rpc.ensure_port.side_effect = \
+            oslo_messaging.MessagingTimeout()
+        mock_local_ensure.return_value = False
+        self.mech.ensure_port(
+            self.mock_port_context.current,
+            self.mock_port_context._plugin_context,
+            self.testhost,
+            self.testport,
+            self.testphysnet,
+            self.mock_port_context,
+            self.testsegid)
+        mock_local_ensure.assert_called_once_with(
+            self.mock_port_context.current,
+            self.mock_port_context._plugin_context,
+            self.testhost,
+            self.testport,
+            self.testphysnet,
+            self.testsegid,
+            False,
+            c.PRIORITY_UPDATE,
+            cache=mock.ANY)
         self.mock_port_context.set_binding.assert_not_called()
 
     @mock.patch('networking_ansible.ml2.mech_driver.'
                 'AnsibleMechanismDriver._set_port_state')
     def test_ensure_port_normal_port_delete_false(self,
                                                   mock_set_state,
-                                                  mock_has_host,
                                                   mock_port_get_object,
                                                   mock_get_lock):
         self.mech.ensure_port(self.mock_port_vm,
@@ -721,14 +1588,14 @@ class TestEnsurePort(base.NetworkingAnsibleTestCase):
         mock_set_state.assert_called_with(self.mock_port_vm,
                                           self.mock_port_vm,
                                           self.testhost,
-                                          self.testport)
+                                          self.testport,
+                                          cache=mock.ANY)
 
     @mock.patch('network_runner.api.NetworkRunner.delete_trunk_vlan')
     @mock.patch.object(ports.Port, 'get_objects')
     def test_ensure_port_normal_port_delete_true(self,
                                                  mock_get_objects,
                                                  mock_delete_vlan,
-                                                 mock_has_host,
                                                  mock_port_get_object,
                                                  mock_get_lock):
         self.mech.ensure_port(self.mock_port_vm,
@@ -748,7 +1615,6 @@ class TestEnsurePort(base.NetworkingAnsibleTestCase):
     def test_ensure_port_no_delete_w_active_ports_vm(self,
                                                      mock_get_objects,
                                                      mock_delete_vlan,
-                                                     mock_has_host,
                                                      mock_port_get_object,
                                                      mock_get_lock):
         '''
@@ -774,7 +1640,6 @@ class TestEnsurePort(base.NetworkingAnsibleTestCase):
     def test_ensure_port_direct_port_delete_true(self,
                                                  mock_get_objects,
                                                  mock_delete_vlan,
-                                                 mock_has_host,
                                                  mock_port_get_object,
                                                  mock_get_lock):
         self.mech.ensure_port(self.mock_port_dt,
@@ -796,7 +1661,6 @@ class TestEnsurePort(base.NetworkingAnsibleTestCase):
                                                      mock_get_object,
                                                      mock_get_objects,
                                                      mock_delete_vlan,
-                                                     mock_has_host,
                                                      mock_port_get_object,
                                                      mock_get_lock):
         '''
@@ -838,6 +1702,11 @@ class TestEnsurePort(base.NetworkingAnsibleTestCase):
 
 @mock.patch.object(ports.Port, 'get_object')
 class TestEnsureSubports(base.NetworkingAnsibleTestCase):
+    def setUp(self):
+        super(TestEnsureSubports, self).setUp()
+        self.mock_port_exists = mock.patch.object(
+            ports.Port, 'objects_exist', return_value=True).start()
+
     @mock.patch.object(coordination.CoordinationDriver, 'get_lock')
     def test_ensure_subports_deleted(self,
                                      mock_get_lock,
@@ -856,7 +1725,19 @@ class TestEnsureSubports(base.NetworkingAnsibleTestCase):
         mock_set_state.assert_called_once_with(self.mock_port_bm,
                                                'testdb',
                                                self.testhost,
-                                               self.testport)
+                                               self.testport,
+                                               cache=mock.ANY)
+
+    def test_ensure_subports_routed_to_owner(self, mock_port_get_object):
+        mock_port_get_object.return_value = self.mock_port_bm
+        self.mech.partitioner = mock.Mock()
+        self.mech.partitioner.owns.return_value = False
+        self.mech.partitioner.owner.return_value = 'otherhost-1'
+        self.mech.switch_rpc = mock.Mock()
+        self.mech.ensure_subports(self.testid, 'testdb')
+        self.mech.switch_rpc.ensure_subports.assert_called_once_with(
+            'testdb', 'otherhost-1', self.testid, self.testhost,
+            self.testport)
 
     @mock.patch('networking_ansible.ml2.mech_driver.'
                 'AnsibleMechanismDriver._set_port_state')
@@ -864,6 +1745,7 @@ class TestEnsureSubports(base.NetworkingAnsibleTestCase):
                                      mock_set_state,
                                      mock_port_get_object):
         mock_port_get_object.side_effect = [self.mock_port_bm, None]
+        self.mock_port_exists.return_value = False
         self.mech.ensure_subports(self.testid, 'testdb')
         mock_set_state.assert_not_called()
 
@@ -899,14 +1781,12 @@ class TestSetPortState(base.NetworkingAnsibleTestCase):
 
     @mock.patch('networking_ansible.ml2.mech_driver.'
                 'AnsibleMechanismDriver._switch_meta_from_link_info')
-    @mock.patch('network_runner.api.NetworkRunner.has_host')
-    def test_set_port_state_no_inventory_switch(self, mock_host, mock_link):
+    def test_set_port_state_no_inventory_switch(self, mock_link):
         mock_link.return_value = ([('123', '345')], '')
-        mock_host.return_value = False
         self.assertRaises(ml2_exc.MechanismDriverError,
                           self.mech._set_port_state,
                           self.mock_port_bm,
-                          'db', self.testhost, self.testport)
+                          'db', 'unknownhost', self.testport)
 
     @mock.patch.object(network.Network, 'get_object')
     @mock.patch('networking_ansible.ml2.mech_driver.'
@@ -964,6 +1844,27 @@ class TestSetPortState(base.NetworkingAnsibleTestCase):
                                                       self.testport,
                                                       self.testsegid)
 
+    @mock.patch.object(network.Network, 'get_object')
+    @mock.patch.object(trunk.Trunk, 'get_object')
+    @mock.patch.object(api.NetworkRunner, 'conf_access_port')
+    def test_set_port_state_topology_index(self,
+                                           mock_conf_access_port,
+                                           mock_trunk,
+                                           mock_network):
+        self.mech.topology = topology.TopologyIndex()
+        self.mock_net.id = self.mock_port_bm['network_id']
+        mock_network.return_value = self.mock_net
+        mock_trunk.return_value = None
+        self.mech._set_port_state(self.mock_port_bm, 'db',
+                                  self.testhost, self.testport)
+        self.mech._set_port_state(self.mock_port_bm, 'db',
+                                  self.testhost, self.testport)
+        mock_network.assert_called_once_with(
+            'db', id=self.mock_port_bm['network_id'])
+        mock_conf_access_port.assert_called_with(self.testhost,
+                                                 self.testport,
+                                                 self.testsegid)
+
     @mock.patch.object(network.Network, 'get_object')
     @mock.patch.object(trunk.Trunk, 'get_object')
     @mock.patch.object(ports.Port, 'get_object')
@@ -999,6 +1900,56 @@ class TestSetPortState(base.NetworkingAnsibleTestCase):
                                                     self.testport,
                                                     self.testsegid)
 
+    @mock.patch.object(network.Network, 'get_object')
+    @mock.patch.object(trunk.Trunk, 'get_object')
+    @mock.patch.object(api.NetworkRunner, 'create_vlan')
+    @mock.patch.object(api.NetworkRunner, 'conf_access_port')
+    def test_set_port_state_switch_physnet(self,
+                                           mock_conf_access_port,
+                                           mock_create_vlan,
+                                           mock_trunk,
+                                           mock_network):
+        self.m_config.inventory[self.testhost][c.SWITCH_PHYSNET] = 'rack1'
+        self.mock_netseg2.physical_network = 'rack1'
+        self.mock_net.segments = [self.mock_netseg3, self.mock_netseg2]
+        mock_network.return_value = self.mock_net
+        mock_trunk.return_value = None
+        self.mech._set_port_state(self.mock_port_bm, 'db',
+                                  self.testhost, self.testport)
+        mock_create_vlan.assert_called_once_with(self.testhost,
+                                                 self.testsegid2)
+        mock_conf_access_port.assert_called_once_with(self.testhost,
+                                                      self.testport,
+                                                      self.testsegid2)
+
+    @mock.patch.object(network.NetworkSegment, 'get_objects')
+    @mock.patch.object(network.Network, 'get_object')
+    @mock.patch.object(trunk.Trunk, 'get_object')
+    @mock.patch.object(api.NetworkRunner, 'create_vlan')
+    @mock.patch.object(api.NetworkRunner, 'conf_access_port')
+    def test_set_port_state_switch_physnet_new_segment(self,
+                                                       mock_conf_access_port,
+                                                       mock_create_vlan,
+                                                       mock_trunk,
+                                                       mock_network,
+                                                       mock_segments):
+        self.m_config.inventory[self.testhost][c.SWITCH_PHYSNET] = 'rack1'
+        self.m_config.inventory[self.testhost]['manage_vlans'] = False
+        self.mock_netseg2.physical_network = 'rack1'
+        self.mock_net.segments = [self.mock_netseg3]
+        mock_network.return_value = self.mock_net
+        mock_segments.return_value = [self.mock_netseg2]
+        mock_trunk.return_value = None
+        self.mech._set_port_state(self.mock_port_bm, 'db',
+                                  self.testhost, self.testport)
+        mock_segments.assert_called_once_with(
+            'db', network_id=self.mock_port_bm['network_id'],
+            network_type='vlan', physical_network='rack1')
+        mock_create_vlan.assert_not_called()
+        mock_conf_access_port.assert_called_once_with(self.testhost,
+                                                      self.testport,
+                                                      self.testsegid2)
+
 
 @mock.patch.object(api.NetworkRunner, 'create_vlan')
 class TestML2PluginIntegration(NetAnsibleML2Base):
@@ -0,0 +1,57 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from unittest import mock
+
+from neutron.objects import network
+
+from networking_ansible.ml2 import object_cache
+from networking_ansible.tests.unit import base
+
+
+class TestObjectCache(base.BaseTestCase):
+    def setUp(self):
+        super(TestObjectCache, self).setUp()
+        self.cache = object_cache.ObjectCache('testdb')
+
+    @mock.patch.object(network.Network, 'get_object')
+    def test_get_object(self, mock_get_network):
+        net = self.cache.get_object(network.Network, id='net1')
+        self.assertEqual(net, self.cache.get_object(network.Network,
+                                                    id='net1'))
+        self.assertEqual(mock_get_network.return_value, net)
+        mock_get_network.assert_called_once_with('testdb', id='net1')
+
+    @mock.patch.object(network.Network, 'get_object')
+    def test_get_object_missing(self, mock_get_network):
+        mock_get_network.return_value = None
+        self.assertIsNone(self.cache.get_object(network.Network, id='net1'))
+        self.assertIsNone(self.cache.get_object(network.Network, id='net1'))
+        mock_get_network.assert_called_once_with('testdb', id='net1')
+
+    @mock.patch.object(network.Network, 'get_object')
+    def test_get_object_by_arguments(self, mock_get_network):
+        self.cache.get_object(network.Network, id='net1')
+        self.cache.get_object(network.Network, id='net2')
+        self.assertEqual(2, mock_get_network.call_count)
+
+    @mock.patch.object(network.NetworkSegment, 'get_objects')
+    def test_get_objects(self, mock_get_segments):
+        self.cache.get_objects(network.NetworkSegment, segmentation_id=37)
+        segments = self.cache.get_objects(network.NetworkSegment,
+                                          segmentation_id=37)
+        self.assertEqual(mock_get_segments.return_value, segments)
+        mock_get_segments.assert_called_once_with('testdb',
+                                                  segmentation_id=37)
@@ -0,0 +1,69 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from unittest import mock
+
+from tooz import coordination
+from tooz import partitioner as tooz_partitioner
+
+from networking_ansible.ml2 import partitioner
+from networking_ansible.tests.unit import base
+
+
+@mock.patch('networking_ansible.ml2.partitioner.loopingcall')
+class TestSwitchPartitioner(base.BaseTestCase):
+    def setUp(self):
+        super(TestSwitchPartitioner, self).setUp()
+        self.coordinator = mock.create_autospec(
+            coordination.CoordinationDriver).return_value
+        self.ring = mock.create_autospec(
+            tooz_partitioner.Partitioner).return_value
+        self.coordinator.join_partitioned_group.return_value = self.ring
+        self.partitioner = partitioner.SwitchPartitioner(self.coordinator,
+                                                         b'host-1', 10)
+
+    def test_owns_before_start(self, m_loop):
+        self.assertTrue(self.partitioner.owns(self.testhost))
+        self.assertIsNone(self.partitioner.owner(self.testhost))
+
+    def test_start(self, m_loop):
+        self.partitioner.start()
+        self.coordinator.join_partitioned_group.assert_called_once_with(
+            partitioner.GROUP_ID)
+        m_loop.FixedIntervalLoopingCall.assert_called_once_with(
+            self.partitioner.refresh)
+
+    def test_owns(self, m_loop):
+        self.partitioner.start()
+        self.ring.members_for_object.return_value = {b'host-1'}
+        self.assertTrue(self.partitioner.owns(self.testhost))
+        self.assertEqual('host-1', self.partitioner.owner(self.testhost))
+
+    def test_owned_by_other_member(self, m_loop):
+        self.partitioner.start()
+        self.ring.members_for_object.return_value = {b'host-2'}
+        self.assertFalse(self.partitioner.owns(self.testhost))
+        self.assertEqual('host-2', self.partitioner.owner(self.testhost))
+
+    def test_refresh(self, m_loop):
+        self.partitioner.refresh()
+        self.coordinator.run_watchers.assert_called_once_with()
+
+    def test_stop(self, m_loop):
+        self.partitioner.start()
+        self.partitioner.stop()
+        self.coordinator.leave_partitioned_group.assert_called_once_with(
+            self.ring)
+        self.assertTrue(self.partitioner.owns(self.testhost))
@@ -0,0 +1,114 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from unittest import mock
+
+from neutron_lib.callbacks import events
+from neutron_lib.callbacks import resources
+
+from networking_ansible import constants as c
+from networking_ansible.ml2 import provisioning
+from networking_ansible.tests.unit import base
+
+
+@mock.patch('networking_ansible.ml2.provisioning.registry')
+@mock.patch('networking_ansible.ml2.provisioning.pb_obj')
+@mock.patch('networking_ansible.ml2.provisioning.models_v2')
+@mock.patch('networking_ansible.ml2.provisioning.db_api')
+@mock.patch('networking_ansible.ml2.provisioning.n_context')
+@mock.patch('networking_ansible.ml2.provisioning.provisioning_blocks')
+@mock.patch('networking_ansible.ml2.provisioning.threading.Timer')
+class TestProvisioningBatcher(base.BaseTestCase):
+    def setUp(self):
+        super(TestProvisioningBatcher, self).setUp()
+        self.batcher = provisioning.ProvisioningBatcher(2)
+
+    def test_flush(self, m_timer, m_prov_blocks, m_context, m_db_api,
+                   m_models, m_pb_obj, m_registry):
+        context = m_context.get_admin_context.return_value
+        context.session.query.return_value.filter.return_value = [
+            (11, 'port1'), (12, 'port2'), (13, 'port3')]
+        # port3 still waits for another entity
+        m_pb_obj.ProvisioningBlock.get_objects.return_value = [
+            mock.Mock(standard_attr_id=13)]
+        self.batcher.complete('port2')
+        self.batcher.complete('port1')
+        self.batcher.complete('port1')
+        self.batcher.complete('port3')
+        calls = mock.Mock()
+        calls.attach_mock(m_db_api.CONTEXT_WRITER.using.return_value.__exit__,
+                          'commit')
+        calls.attach_mock(m_pb_obj.ProvisioningBlock.get_objects, 'blocks')
+        # one flush per window
+        m_timer.assert_called_once_with(2, self.batcher.flush)
+        self.batcher.flush()
+        m_db_api.CONTEXT_WRITER.using.assert_called_once_with(context)
+        m_pb_obj.ProvisioningBlock.delete_objects.assert_called_once_with(
+            context, entity=c.NETWORKING_ENTITY,
+            standard_attr_id=[11, 12, 13])
+        m_pb_obj.ProvisioningBlock.get_objects.assert_called_once_with(
+            context, standard_attr_id=[11, 12, 13])
+        # the remaining blocks are read once the transaction is committed
+        self.assertEqual(['commit', 'blocks'],
+                         [name for name, _, _ in calls.mock_calls])
+        self.assertEqual(
+            [mock.call(resources.PORT,
+                       m_prov_blocks.PROVISIONING_COMPLETE,
+                       c.NETWORKING_ENTITY, payload=mock.ANY)] * 2,
+            m_registry.publish.call_args_list)
+        payloads = [call[1]['payload']
+                    for call in m_registry.publish.call_args_list]
+        self.assertEqual(['port1', 'port2'],
+                         [payload.resource_id for payload in payloads])
+        self.assertIsInstance(payloads[0], events.DBEventPayload)
+        m_prov_blocks.provisioning_complete.assert_not_called()
+
+    def test_flush_empty(self, m_timer, m_prov_blocks, m_context,
+                         m_db_api, m_models, m_pb_obj, m_registry):
+        self.batcher.flush()
+        m_db_api.CONTEXT_WRITER.using.assert_not_called()
+        m_registry.publish.assert_not_called()
+
+    def test_flush_deleted_ports(self, m_timer, m_prov_blocks, m_context,
+                                 m_db_api, m_models, m_pb_obj, m_registry):
+        context = m_context.get_admin_context.return_value
+        context.session.query.return_value.filter.return_value = []
+        self.batcher.complete('port1')
+        self.batcher.flush()
+        m_pb_obj.ProvisioningBlock.delete_objects.assert_not_called()
+        m_registry.publish.assert_not_called()
+
+    def test_flush_transaction_failure(self, m_timer, m_prov_blocks,
+                                       m_context, m_db_api, m_models,
+                                       m_pb_obj, m_registry):
+        m_pb_obj.ProvisioningBlock.delete_objects.side_effect = \
+            Exception('deadlock')
+        context = m_context.get_admin_context.return_value
+        context.session.query.return_value.filter.return_value = [
+            (11, 'port1')]
+        self.batcher.complete('port1')
+        self.batcher.flush()
+        # the ports are still completed one by one
+        m_prov_blocks.provisioning_complete.assert_called_once_with(
+            context, 'port1', resources.PORT, c.NETWORKING_ENTITY)
+        m_registry.publish.assert_not_called()
+
+    def test_window_restarts_after_flush(self, m_timer, m_prov_blocks,
+                                         m_context, m_db_api, m_models,
+                                         m_pb_obj, m_registry):
+        self.batcher.complete('port1')
+        self.batcher.flush()
+        self.batcher.complete('port2')
+        self.assertEqual(2, m_timer.call_count)
@@ -0,0 +1,61 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from networking_ansible.ml2 import revisions
+from networking_ansible.tests.unit import base
+
+
+class TestAppliedRevisions(base.BaseTestCase):
+    def setUp(self):
+        super(TestAppliedRevisions, self).setUp()
+        self.revisions = revisions.AppliedRevisions()
+
+    def test_is_applied(self):
+        self.assertFalse(self.revisions.is_applied('p1', 'sw', 'sp', 5))
+        self.revisions.record('p1', 'sw', 'sp', 5)
+        self.assertTrue(self.revisions.is_applied('p1', 'sw', 'sp', 4))
+        self.assertTrue(self.revisions.is_applied('p1', 'sw', 'sp', 5))
+        self.assertFalse(self.revisions.is_applied('p1', 'sw', 'sp', 6))
+        self.assertFalse(self.revisions.is_applied('p1', 'sw', 'sp2', 5))
+
+    def test_no_revision(self):
+        self.revisions.record('p1', 'sw', 'sp', None)
+        self.assertFalse(self.revisions.is_applied('p1', 'sw', 'sp', None))
+
+    def test_record_keeps_newest(self):
+        self.revisions.record('p1', 'sw', 'sp', 5)
+        self.revisions.record('p1', 'sw', 'sp', 3)
+        self.assertTrue(self.revisions.is_applied('p1', 'sw', 'sp', 5))
+
+    def test_forget(self):
+        self.revisions.record('p1', 'sw', 'sp', 5)
+        self.revisions.record('p1', 'sw', 'sp2', 5)
+        self.revisions.record('p2', 'sw', 'sp', 5)
+        self.revisions.forget('p1', 'sw', 'sp')
+        self.assertFalse(self.revisions.is_applied('p1', 'sw', 'sp', 5))
+        self.assertTrue(self.revisions.is_applied('p1', 'sw', 'sp2', 5))
+        self.revisions.forget('p1')
+        self.assertFalse(self.revisions.is_applied('p1', 'sw', 'sp2', 5))
+        self.assertTrue(self.revisions.is_applied('p2', 'sw', 'sp', 5))
+
+    def test_max_entries(self):
+        self.revisions = revisions.AppliedRevisions(max_entries=2)
+        self.revisions.record('p1', 'sw', 'sp', 5)
+        self.revisions.record('p2', 'sw', 'sp', 5)
+        self.revisions.record('p1', 'sw', 'sp', 6)
+        self.revisions.record('p3', 'sw', 'sp', 5)
+        self.assertTrue(self.revisions.is_applied('p1', 'sw', 'sp', 6))
+        self.assertFalse(self.revisions.is_applied('p2', 'sw', 'sp', 5))
+        self.assertTrue(self.revisions.is_applied('p3', 'sw', 'sp', 5))
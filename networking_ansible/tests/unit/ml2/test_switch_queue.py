@@ -0,0 +1,226 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from concurrent import futures
+import contextlib
+import threading
+from tooz import coordination
+from unittest import mock
+
+from networking_ansible import constants as c
+from networking_ansible.ml2 import switch_queue
+from networking_ansible.tests.unit import base
+
+
+class TestSwitchQueues(base.BaseTestCase):
+    def setUp(self):
+        super(TestSwitchQueues, self).setUp()
+        self.get_lock = mock.MagicMock()
+        self.queues = switch_queue.SwitchQueues(self.get_lock, 10, 0)
+
+    def _block(self, sw_queue):
+        """Keep the consumer of a queue busy until the event is set"""
+        started = threading.Event()
+        release = threading.Event()
+
+        def block():
+            started.set()
+            release.wait(10)
+
+        future = sw_queue.submit(c.PRIORITY_BIND, block)
+        started.wait(10)
+        return future, release
+
+    def test_run_returns_result(self):
+        result = self.queues.run(self.testhost, c.PRIORITY_UPDATE,
+                                 lambda x, y: x + y, 1, y=2)
+        self.assertEqual(3, result)
+        self.get_lock.assert_called_once_with(self.testhost)
+
+    def test_run_raises(self):
+        def fail():
+            raise ValueError('switch error')
+
+        self.assertRaises(ValueError, self.queues.run, self.testhost,
+                          c.PRIORITY_UPDATE, fail)
+        # the consumer keeps serving the switch after a failure
+        self.assertEqual(1, self.queues.run(self.testhost,
+                                            c.PRIORITY_UPDATE, lambda: 1))
+
+    def test_run_timeout_drops_operation(self):
+        sw_queue = self.queues.get(self.testhost)
+        blocker, release = self._block(sw_queue)
+        ran = []
+        self.assertRaises(futures.TimeoutError, self.queues.run,
+                          self.testhost, c.PRIORITY_UPDATE, ran.append, 1,
+                          timeout=0.01)
+        release.set()
+        blocker.result(10)
+        self.assertEqual(2, self.queues.run(self.testhost,
+                                            c.PRIORITY_UPDATE, lambda: 2))
+        self.assertEqual([], ran)
+
+    def test_one_queue_per_switch(self):
+        self.assertIs(self.queues.get(self.testhost),
+                      self.queues.get(self.testhost))
+        self.assertIsNot(self.queues.get(self.testhost),
+                         self.queues.get('otherhost'))
+
+    def test_batch_takes_lock_once(self):
+        sw_queue = self.queues.get(self.testhost)
+        blocker, release = self._block(sw_queue)
+        # queued while the consumer is busy, run under the same lock
+        order = []
+        futures = [sw_queue.submit(c.PRIORITY_UPDATE, order.append, i)
+                   for i in range(5)]
+        release.set()
+        blocker.result(10)
+        for future in futures:
+            future.result(10)
+
+        self.assertEqual(list(range(5)), order)
+        self.assertEqual(1, self.get_lock.call_count)
+
+    def test_batch_size(self):
+        self.queues.batch_size = 2
+        sw_queue = self.queues.get(self.testhost)
+        blocker, release = self._block(sw_queue)
+        futures = [sw_queue.submit(c.PRIORITY_UPDATE, lambda: None)
+                   for i in range(3)]
+        release.set()
+        for future in futures:
+            future.result(10)
+        self.assertEqual(2, self.get_lock.call_count)
+
+    def test_priority_order(self):
+        sw_queue = self.queues.get(self.testhost)
+        blocker, release = self._block(sw_queue)
+        order = []
+        futures = [
+            sw_queue.submit(c.PRIORITY_BACKGROUND, order.append, 'gc'),
+            sw_queue.submit(c.PRIORITY_DELETE, order.append, 'delete1'),
+            sw_queue.submit(c.PRIORITY_DELETE, order.append, 'delete2'),
+            sw_queue.submit(c.PRIORITY_BIND, order.append, 'bind'),
+        ]
+        release.set()
+        for future in futures:
+            future.result(10)
+        self.assertEqual(['bind', 'delete1', 'delete2', 'gc'], order)
+
+    @mock.patch('networking_ansible.ml2.switch_queue.time')
+    def test_aging(self, m_time):
+        m_time.monotonic.return_value = 100
+        sw_queue = switch_queue.SwitchQueue(self.testhost, self.get_lock,
+                                            10, 30)
+        blocker, release = self._block(sw_queue)
+        order = []
+        futures = [sw_queue.submit(c.PRIORITY_BACKGROUND, order.append, 'gc')]
+        # the background operation has been waiting for three aging
+        # intervals once the bind is queued
+        m_time.monotonic.return_value = 190
+        futures.append(sw_queue.submit(c.PRIORITY_BIND, order.append, 'bind'))
+        release.set()
+        for future in futures:
+            future.result(10)
+        self.assertEqual(['gc', 'bind'], order)
+
+    def test_lock_failure_fails_operation(self):
+        self.get_lock.return_value.__enter__.side_effect = \
+            coordination.ToozConnectionError('etcd')
+        self.assertRaises(coordination.ToozConnectionError,
+                          self.queues.run, self.testhost,
+                          c.PRIORITY_UPDATE, lambda: 1)
+
+
+class TestSwitchQueueCommitter(base.BaseTestCase):
+    def setUp(self):
+        super(TestSwitchQueueCommitter, self).setUp()
+        self.get_lock = mock.MagicMock()
+        self.staged = None
+        self.commit = mock.Mock(side_effect=lambda switch_name, staged:
+                                [None] * len(staged))
+        self.committer = switch_queue.Committer(0.5, self._staging,
+                                                self.commit)
+        self.queues = switch_queue.SwitchQueues(
+            self.get_lock, 10, 0, lambda switch_name: self.committer)
+
+    @contextlib.contextmanager
+    def _staging(self):
+        self.staged = []
+        yield self.staged
+        self.staged = None
+
+    def _device_op(self, operation, *args):
+        self.staged.append((operation, args))
+        return operation
+
+    def test_single_commit(self):
+        sw_queue = self.queues.get(self.testhost)
+        futures = [sw_queue.submit(c.PRIORITY_UPDATE, self._device_op,
+                                   'create_vlan', vlan) for vlan in (37, 38)]
+        self.assertEqual(['create_vlan', 'create_vlan'],
+                         [future.result(10) for future in futures])
+        self.commit.assert_called_once_with(
+            self.testhost, [('create_vlan', (37,)), ('create_vlan', (38,))])
+        self.assertEqual(1, self.get_lock.call_count)
+
+    def test_lock_not_held_in_commit_window(self):
+        lock = self.get_lock.return_value
+        sw_queue = self.queues.get(self.testhost)
+        first = sw_queue.submit(c.PRIORITY_UPDATE, self._device_op,
+                                'create_vlan', 37)
+        # the first operation waits for others to join its commit
+        self.assertRaises(futures.TimeoutError, first.result, 0.1)
+        lock.__enter__.assert_not_called()
+        second = sw_queue.submit(c.PRIORITY_UPDATE, self._device_op,
+                                 'create_vlan', 38)
+        self.assertEqual('create_vlan', second.result(10))
+        self.assertEqual('create_vlan', first.result(10))
+        lock.__enter__.assert_called_once_with()
+        self.commit.assert_called_once_with(
+            self.testhost, [('create_vlan', (37,)), ('create_vlan', (38,))])
+
+    def test_failed_device_operation(self):
+        self.commit.side_effect = lambda switch_name, staged: [
+            None, ValueError('commit error')]
+        sw_queue = self.queues.get(self.testhost)
+        ok = sw_queue.submit(c.PRIORITY_UPDATE, self._device_op,
+                             'create_vlan', 37)
+        failed = sw_queue.submit(c.PRIORITY_UPDATE, self._device_op,
+                                 'create_vlan', 38)
+        self.assertEqual('create_vlan', ok.result(10))
+        self.assertRaises(ValueError, failed.result, 10)
+
+    def test_failed_operation(self):
+        def fail():
+            self._device_op('create_vlan', 37)
+            raise ValueError('db error')
+
+        self.assertRaises(ValueError, self.queues.run, self.testhost,
+                          c.PRIORITY_UPDATE, fail)
+        # device operations staged before the failure are still committed
+        self.commit.assert_called_once_with(self.testhost,
+                                            [('create_vlan', (37,))])
+
+    def test_commit_failure(self):
+        self.commit.side_effect = ConnectionError('connection lost')
+        self.assertRaises(ConnectionError, self.queues.run, self.testhost,
+                          c.PRIORITY_UPDATE, self._device_op,
+                          'create_vlan', 37)
+
+    def test_nothing_staged(self):
+        self.assertEqual(1, self.queues.run(self.testhost,
+                                            c.PRIORITY_UPDATE, lambda: 1))
+        self.commit.assert_not_called()
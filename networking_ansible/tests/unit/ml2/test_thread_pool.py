@@ -0,0 +1,138 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+from unittest import mock
+
+from networking_ansible.ml2 import thread_pool
+from networking_ansible.tests.unit import base
+
+
+@mock.patch('networking_ansible.ml2.thread_pool._monkey_patched',
+            return_value=False)
+class TestDeviceThreadPool(base.BaseTestCase):
+    def test_execute(self, m_patched):
+        pool = thread_pool.DeviceThreadPool(2)
+        self.assertEqual(3, pool.execute(lambda x, y: x + y, 1, y=2))
+        stats = pool.stats()
+        self.assertEqual(1, stats['completed'])
+        self.assertEqual(0, stats['running'])
+        self.assertEqual(0, stats['waiting'])
+
+    def test_execute_raises(self, m_patched):
+        def fail():
+            raise ValueError('switch error')
+
+        pool = thread_pool.DeviceThreadPool(2)
+        self.assertRaises(ValueError, pool.execute, fail)
+        stats = pool.stats()
+        self.assertEqual(1, stats['completed'])
+        self.assertEqual(0, stats['running'])
+
+    @mock.patch('networking_ansible.ml2.thread_pool.tpool')
+    def test_execute_tpool(self, m_tpool, m_patched):
+        m_patched.return_value = True
+        func = mock.Mock()
+        pool = thread_pool.DeviceThreadPool(4)
+        m_tpool.set_num_threads.assert_called_once_with(8)
+        self.assertEqual(m_tpool.execute.return_value,
+                         pool.execute(func, 'arg', key='value'))
+        m_tpool.execute.assert_called_once_with(func, 'arg', key='value')
+        func.assert_not_called()
+
+    def test_waiting(self, m_patched):
+        pool = thread_pool.DeviceThreadPool(1)
+        started = threading.Event()
+        release = threading.Event()
+
+        def block():
+            started.set()
+            release.wait(10)
+
+        blocker = threading.Thread(target=pool.execute, args=(block,))
+        blocker.start()
+        started.wait(10)
+        waiter = threading.Thread(target=pool.execute, args=(lambda: None,))
+        waiter.start()
+        for i in range(100):
+            if pool.stats()['waiting']:
+                break
+            release.wait(0.01)
+        stats = pool.stats()
+        self.assertEqual(1, stats['running'])
+        self.assertEqual(1, stats['waiting'])
+        release.set()
+        blocker.join(10)
+        waiter.join(10)
+        self.assertEqual(2, pool.stats()['completed'])
+
+
+@mock.patch('networking_ansible.ml2.thread_pool._monkey_patched',
+            return_value=False)
+class TestBlockingLock(base.BaseTestCase):
+    def setUp(self):
+        super(TestBlockingLock, self).setUp()
+        self.pool = thread_pool.DeviceThreadPool(1)
+        self.lock = mock.Mock()
+
+    def test_acquire_free(self, m_patched):
+        self.lock.acquire.return_value = True
+        with self.pool.lock(self.lock):
+            self.lock.release.assert_not_called()
+        self.lock.acquire.assert_called_once_with(blocking=False)
+        self.lock.release.assert_called_once_with()
+        self.assertEqual(0, self.pool.stats()['lock_waits'])
+
+    def test_acquire_blocks(self, m_patched):
+        self.lock.acquire.side_effect = [False, True]
+        with self.pool.lock(self.lock):
+            pass
+        self.assertEqual([mock.call(blocking=False), mock.call(blocking=True)],
+                         self.lock.acquire.call_args_list)
+        self.assertEqual(1, self.pool.stats()['lock_waits'])
+
+    @mock.patch('networking_ansible.ml2.thread_pool.tpool')
+    def test_acquire_blocks_tpool(self, m_tpool, m_patched):
+        m_patched.return_value = True
+        self.lock.acquire.return_value = False
+        m_tpool.execute.return_value = True
+        self.assertTrue(self.pool.lock(self.lock).acquire())
+        m_tpool.execute.assert_called_once_with(self.lock.acquire,
+                                                blocking=True)
+
+    @mock.patch('networking_ansible.ml2.thread_pool.time')
+    def test_acquire_timeout(self, m_time, m_patched):
+        m_time.monotonic.side_effect = [0, 0.25, 1]
+        self.lock.acquire.side_effect = [False, False]
+        self.assertFalse(self.pool.lock(self.lock).acquire(blocking=1))
+        self.lock.acquire.assert_called_with(blocking=0.75)
+        stats = self.pool.stats()
+        self.assertEqual(1, stats['lock_waits'])
+        self.assertEqual(1, stats['lock_wait_time'])
+
+    def test_acquire_non_blocking(self, m_patched):
+        self.lock.acquire.return_value = False
+        self.assertFalse(self.pool.lock(self.lock).acquire(blocking=False))
+        self.lock.acquire.assert_called_once_with(blocking=False)
+
+    def test_released_on_error(self, m_patched):
+        self.lock.acquire.return_value = True
+
+        def locked():
+            with self.pool.lock(self.lock):
+                raise ValueError('switch error')
+
+        self.assertRaises(ValueError, locked)
+        self.lock.release.assert_called_once_with()
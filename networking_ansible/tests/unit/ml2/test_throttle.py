@@ -0,0 +1,119 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from unittest import mock
+
+from networking_ansible.ml2 import throttle
+from networking_ansible.tests.unit import base
+
+
+@mock.patch('networking_ansible.ml2.throttle.time')
+class TestTokenBucket(base.BaseTestCase):
+    def test_acquire_burst(self, m_time):
+        m_time.monotonic.return_value = 0
+        bucket = throttle.TokenBucket(1, 2)
+        bucket.acquire()
+        bucket.acquire()
+        m_time.sleep.assert_not_called()
+
+    def test_acquire_waits(self, m_time):
+        m_time.monotonic.return_value = 0
+        bucket = throttle.TokenBucket(2, 1)
+        bucket.acquire()
+
+        def sleep(seconds):
+            m_time.monotonic.return_value += seconds
+        m_time.sleep.side_effect = sleep
+        bucket.acquire()
+        m_time.sleep.assert_called_once_with(0.5)
+
+    def test_refill_capped_at_burst(self, m_time):
+        m_time.monotonic.return_value = 0
+        bucket = throttle.TokenBucket(1, 2)
+        m_time.monotonic.return_value = 100
+        bucket.acquire()
+        bucket.acquire()
+        # the third token needs a wait
+        m_time.sleep.side_effect = StopIteration
+        self.assertRaises(StopIteration, bucket.acquire)
+        m_time.sleep.assert_called_once_with(1)
+
+
+class TestAdaptiveRate(base.BaseTestCase):
+    def setUp(self):
+        super(TestAdaptiveRate, self).setUp()
+        self.bucket = throttle.TokenBucket(10, 1)
+        self.adaptive = throttle.AdaptiveRate(self.bucket, 10, 5)
+
+    def test_failure_decreases(self):
+        self.adaptive.record(1, failed=True)
+        self.assertEqual(5, self.bucket.rate)
+
+    def test_slow_decreases(self):
+        self.adaptive.record(6)
+        self.assertEqual(5, self.bucket.rate)
+
+    def test_decrease_floor(self):
+        for _ in range(10):
+            self.adaptive.record(1, failed=True)
+        self.assertEqual(1, self.bucket.rate)
+
+    def test_healthy_increases_to_max(self):
+        self.adaptive.record(1, failed=True)
+        self.adaptive.record(1)
+        self.assertEqual(6, self.bucket.rate)
+        for _ in range(10):
+            self.adaptive.record(1)
+        self.assertEqual(10, self.bucket.rate)
+
+
+class TestThrottles(base.BaseTestCase):
+    def setUp(self):
+        super(TestThrottles, self).setUp()
+        self.throttles = throttle.Throttles(
+            {'limited': {'rate_limit': '2', 'rate_burst': '3',
+                         'adaptive_rate': True},
+             'unlimited': {},
+             'invalid': {'rate_limit': 'fast'}},
+            5)
+
+    def test_throttles(self):
+        limited = self.throttles.get('limited')
+        self.assertEqual(2, limited.bucket.rate)
+        self.assertEqual(3, limited.bucket.burst)
+        self.assertIsNotNone(limited.adaptive)
+        self.assertIsNone(self.throttles.get('unlimited'))
+        self.assertIsNone(self.throttles.get('invalid'))
+
+    def test_call_unlimited(self):
+        func = mock.Mock()
+        self.assertEqual(func.return_value,
+                         self.throttles.call('unlimited', func, 1, a=2))
+        func.assert_called_once_with(1, a=2)
+
+    @mock.patch.object(throttle.TokenBucket, 'acquire')
+    def test_call_limited(self, m_acquire):
+        func = mock.Mock()
+        self.assertEqual(func.return_value,
+                         self.throttles.call('limited', func, 1))
+        m_acquire.assert_called_once_with()
+        func.assert_called_once_with(1)
+
+    @mock.patch.object(throttle.AdaptiveRate, 'record')
+    @mock.patch.object(throttle.TokenBucket, 'acquire')
+    def test_call_failure_recorded(self, m_acquire, m_record):
+        func = mock.Mock(side_effect=ValueError('device error'))
+        self.assertRaises(ValueError, self.throttles.call, 'limited', func)
+        m_record.assert_called_once_with(mock.ANY, failed=True)
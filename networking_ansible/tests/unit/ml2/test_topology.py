@@ -0,0 +1,104 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from unittest import mock
+
+from neutron.objects import network
+from neutron_lib.api.definitions import provider_net
+from neutron_lib.callbacks import events
+from neutron_lib.callbacks import resources
+
+from networking_ansible.ml2 import topology
+from networking_ansible.tests.unit import base
+
+
+class TestTopologyIndex(base.BaseTestCase):
+    def setUp(self):
+        super(TestTopologyIndex, self).setUp()
+        self.index = topology.TopologyIndex()
+        self.segment = topology.Segment('vlan', self.testphysnet, 37)
+        self.network = {'id': 'net1',
+                        provider_net.NETWORK_TYPE: 'vlan',
+                        provider_net.PHYSICAL_NETWORK: self.testphysnet,
+                        provider_net.SEGMENTATION_ID: 37}
+
+    @mock.patch('networking_ansible.ml2.topology.registry')
+    def test_subscribe(self, m_registry):
+        self.index.subscribe()
+        m_registry.subscribe.assert_any_call(self.index._network_created,
+                                             resources.NETWORK,
+                                             events.AFTER_CREATE)
+        m_registry.subscribe.assert_any_call(self.index._segment_changed,
+                                             resources.SEGMENT,
+                                             events.AFTER_DELETE)
+
+    def test_add_network(self):
+        net = mock.create_autospec(network.Network).return_value
+        net.id = 'net1'
+        seg = mock.create_autospec(network.NetworkSegment).return_value
+        seg.network_type = 'vlan'
+        seg.physical_network = self.testphysnet
+        seg.segmentation_id = 37
+        seg.is_dynamic = False
+        net.segments = [seg]
+        self.assertEqual([self.segment], self.index.add_network(net))
+        self.assertEqual([self.segment], self.index.segments('net1'))
+
+    def test_add_network_dynamic_segment(self):
+        net = mock.create_autospec(network.Network).return_value
+        net.id = 'net1'
+        seg = mock.create_autospec(network.NetworkSegment).return_value
+        seg.network_type = 'vlan'
+        seg.physical_network = self.testphysnet
+        seg.segmentation_id = 37
+        seg.is_dynamic = False
+        dynamic = mock.create_autospec(network.NetworkSegment).return_value
+        dynamic.is_dynamic = True
+        net.segments = [seg, dynamic]
+        self.assertEqual([self.segment], self.index.add_network(net))
+        self.assertEqual([self.segment], self.index.segments('net1'))
+
+    def test_network_created_payload(self):
+        payload = mock.Mock(latest_state=self.network)
+        self.index._network_created(resources.NETWORK, events.AFTER_CREATE,
+                                    None, payload=payload)
+        self.assertEqual([self.segment], self.index.segments('net1'))
+
+    def test_network_created_kwargs(self):
+        self.index._network_created(resources.NETWORK, events.AFTER_CREATE,
+                                    None, network=self.network)
+        self.assertEqual([self.segment], self.index.segments('net1'))
+
+    def test_network_created_multi_segment(self):
+        net = {'id': 'net1', 'segments': [self.network, self.network]}
+        self.index._network_created(resources.NETWORK, events.AFTER_CREATE,
+                                    None, network=net)
+        self.assertEqual([self.segment, self.segment],
+                         self.index.segments('net1'))
+
+    def test_network_deleted(self):
+        self.index._network_created(resources.NETWORK, events.AFTER_CREATE,
+                                    None, network=self.network)
+        self.index._network_deleted(resources.NETWORK, events.AFTER_DELETE,
+                                    None, network=self.network)
+        self.assertIsNone(self.index.segments('net1'))
+
+    def test_segment_changed(self):
+        self.index._network_created(resources.NETWORK, events.AFTER_CREATE,
+                                    None, network=self.network)
+        payload = mock.Mock(latest_state={'network_id': 'net1'})
+        self.index._segment_changed(resources.SEGMENT, events.AFTER_CREATE,
+                                    None, payload=payload)
+        self.assertIsNone(self.index.segments('net1'))
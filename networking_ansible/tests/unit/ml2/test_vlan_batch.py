@@ -0,0 +1,108 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from unittest import mock
+
+from network_runner import api
+from neutron.objects import network
+
+from networking_ansible import exceptions
+from networking_ansible.ml2 import vlan_batch
+from networking_ansible.tests.unit import base
+
+
+@mock.patch('networking_ansible.ml2.vlan_batch.n_context')
+@mock.patch.object(network.NetworkSegment, 'get_objects')
+@mock.patch.object(network.Network, 'get_object')
+class TestVlanBatcher(base.NetworkingAnsibleTestCase):
+    def setUp(self):
+        super(TestVlanBatcher, self).setUp()
+        self.batcher = vlan_batch.VlanBatcher(self.mech, 60)
+        timer = mock.patch('networking_ansible.ml2.vlan_batch.threading.'
+                           'Timer').start()
+        self.addCleanup(mock.patch.stopall)
+        self.timer = timer
+
+    @mock.patch.object(api.NetworkRunner, 'create_vlan')
+    def test_create_vlans(self, mock_create_vlan, mock_get_net,
+                          mock_get_segments, mock_context):
+        self.mock_net.segments = [self.mock_netseg, self.mock_netseg2]
+        mock_get_net.return_value = self.mock_net
+        futures = [self.batcher.submit(self.testhost, vlan_batch.CREATE,
+                                       self.testid, segid)
+                   for segid in (self.testsegid2, self.testsegid)]
+        # one flush timer per switch and window
+        self.timer.assert_called_once_with(60, self.batcher.flush,
+                                           [self.testhost])
+        self.batcher.flush(self.testhost)
+        self.assertEqual([True, True], [f.result(0) for f in futures])
+        mock_create_vlan.assert_has_calls([
+            mock.call(self.testhost, self.testsegid),
+            mock.call(self.testhost, self.testsegid2)])
+
+    @mock.patch.object(api.NetworkRunner, 'create_vlan')
+    def test_create_vlans_network_gone(self, mock_create_vlan, mock_get_net,
+                                       mock_get_segments, mock_context):
+        mock_get_net.return_value = None
+        future = self.batcher.submit(self.testhost, vlan_batch.CREATE,
+                                     self.testid, self.testsegid)
+        self.batcher.flush(self.testhost)
+        self.assertFalse(future.result(0))
+        mock_create_vlan.assert_not_called()
+
+    @mock.patch.object(api.NetworkRunner, 'create_vlan')
+    def test_create_vlans_failure_per_network(self, mock_create_vlan,
+                                              mock_get_net,
+                                              mock_get_segments,
+                                              mock_context):
+        self.mock_net.segments = [self.mock_netseg, self.mock_netseg2]
+        mock_get_net.return_value = self.mock_net
+        mock_create_vlan.side_effect = [None, Exception('vlan in use')]
+        ok = self.batcher.submit(self.testhost, vlan_batch.CREATE,
+                                 self.testid, self.testsegid)
+        failed = self.batcher.submit(self.testhost, vlan_batch.CREATE,
+                                     self.testid, self.testsegid2)
+        self.batcher.flush(self.testhost)
+        self.assertTrue(ok.result(0))
+        self.assertRaises(exceptions.NetworkingAnsibleMechException,
+                          failed.result, 0)
+
+    @mock.patch.object(api.NetworkRunner, 'delete_vlan')
+    def test_delete_vlans(self, mock_delete_vlan, mock_get_net,
+                          mock_get_segments, mock_context):
+        mock_get_segments.side_effect = lambda *args, **kwargs: (
+            [self.mock_netseg]
+            if kwargs['segmentation_id'] == self.testsegid else [])
+        recreated = self.batcher.submit(self.testhost, vlan_batch.DELETE,
+                                        self.testid, self.testsegid,
+                                        self.testphysnet)
+        deleted = self.batcher.submit(self.testhost, vlan_batch.DELETE,
+                                      self.testid, self.testsegid2,
+                                      self.testphysnet)
+        self.batcher.flush(self.testhost)
+        self.assertFalse(recreated.result(0))
+        self.assertTrue(deleted.result(0))
+        mock_delete_vlan.assert_called_once_with(self.testhost,
+                                                 self.testsegid2)
+
+    def test_flush_lock_failure(self, mock_get_net, mock_get_segments,
+                                mock_context):
+        future = self.batcher.submit(self.testhost, vlan_batch.CREATE,
+                                     self.testid, self.testsegid)
+        with mock.patch.object(self.mech, '_switch_locked',
+                               side_effect=Exception('etcd')):
+            self.batcher.flush(self.testhost)
+        self.assertRaises(exceptions.NetworkingAnsibleMechException,
+                          future.result, 0)
@@ -0,0 +1,134 @@
+# Copyright (c) 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from unittest import mock
+
+from network_runner import api
+from neutron.objects import network
+
+from networking_ansible.ml2 import vlan_gc
+from networking_ansible.tests.unit import base
+
+
+@mock.patch('networking_ansible.ml2.vlan_gc.n_context')
+@mock.patch.object(network.NetworkSegment, 'get_objects')
+@mock.patch.object(api.NetworkRunner, 'delete_vlan')
+class TestVlanGarbageCollector(base.NetworkingAnsibleTestCase):
+    def setUp(self):
+        super(TestVlanGarbageCollector, self).setUp()
+        self.gc = vlan_gc.VlanGarbageCollector(self.mech, 60, 0)
+
+    def test_collect_unused_vlan(self, mock_delete_vlan, mock_get_segments,
+                                 mock_context):
+        mock_get_segments.return_value = []
+        self.gc.schedule(self.testhost, self.testsegid, self.testphysnet)
+        self.gc.schedule(self.testhost, self.testsegid2, self.testphysnet)
+        self.gc.collect()
+        mock_delete_vlan.assert_has_calls(
+            [mock.call(self.testhost, self.testsegid),
+             mock.call(self.testhost, self.testsegid2)])
+        self.assertEqual({}, self.gc.pending(self.testhost))
+
+    def test_collect_recreated_vlan(self, mock_delete_vlan, mock_get_segments,
+                                    mock_context):
+        mock_get_segments.return_value = [self.mock_netseg]
+        self.gc.schedule(self.testhost, self.testsegid, self.testphysnet)
+        self.gc.collect()
+        mock_delete_vlan.assert_not_called()
+        self.assertEqual({}, self.gc.pending(self.testhost))
+
+    def test_collect_other_physnet(self, mock_delete_vlan, mock_get_segments,
+                                   mock_context):
+        mock_get_segments.return_value = [self.mock_netseg]
+        self.m_config.inventory[self.testhost]['physnet'] = 'otherphysnet'
+        self.gc.schedule(self.testhost, self.testsegid, 'otherphysnet')
+        self.gc.collect()
+        mock_delete_vlan.assert_called_once_with(self.testhost,
+                                                 self.testsegid)
+
+    def test_collect_used_by_other_physnet(self, mock_delete_vlan,
+                                           mock_get_segments, mock_context):
+        # the switch carries the VLANs of every physical network
+        mock_get_segments.return_value = [self.mock_netseg]
+        self.gc.schedule(self.testhost, self.testsegid, 'otherphysnet')
+        self.gc.collect()
+        mock_delete_vlan.assert_not_called()
+        self.assertEqual({}, self.gc.pending(self.testhost))
+
+    def test_schedule_per_physnet(self, mock_delete_vlan, mock_get_segments,
+                                  mock_context):
+        self.gc.grace_period = 3600
+        self.gc.schedule(self.testhost, self.testsegid, self.testphysnet)
+        self.gc.schedule(self.testhost, self.testsegid, 'otherphysnet')
+        self.assertEqual({(self.testphysnet, self.testsegid),
+                          ('otherphysnet', self.testsegid)},
+                         set(self.gc.pending(self.testhost)))
+
+    def test_collect_within_grace_period(self, mock_delete_vlan,
+                                         mock_get_segments, mock_context):
+        self.gc.grace_period = 3600
+        self.gc.schedule(self.testhost, self.testsegid, self.testphysnet)
+        self.gc.collect()
+        mock_delete_vlan.assert_not_called()
+        self.assertIn((self.testphysnet, self.testsegid),
+                      self.gc.pending(self.testhost))
+
+    def test_collect_failure_is_retried(self, mock_delete_vlan,
+                                        mock_get_segments, mock_context):
+        mock_get_segments.return_value = []
+        mock_delete_vlan.side_effect = Exception()
+        self.gc.schedule(self.testhost, self.testsegid, self.testphysnet)
+        self.gc.collect()
+        mock_delete_vlan.assert_called_once_with(self.testhost,
+                                                 self.testsegid)
+        self.assertIn((self.testphysnet, self.testsegid),
+                      self.gc.pending(self.testhost))
+
+    def test_collect_vlans_removed_from_db(self, mock_delete_vlan,
+                                           mock_get_segments, mock_context):
+        # the network was deleted through another worker
+        mock_get_segments.return_value = [self.mock_netseg]
+        self.gc.collect()
+        mock_delete_vlan.assert_not_called()
+        mock_get_segments.return_value = []
+        self.gc.collect()
+        mock_delete_vlan.assert_called_once_with(self.testhost,
+                                                 self.testsegid)
+
+    def test_collect_nothing_on_first_run(self, mock_delete_vlan,
+                                          mock_get_segments, mock_context):
+        mock_get_segments.return_value = []
+        self.gc.collect()
+        mock_delete_vlan.assert_not_called()
+        self.assertEqual({}, self.gc.pending(self.testhost))
+
+    def test_collect_switch_physnet(self, mock_delete_vlan,
+                                    mock_get_segments, mock_context):
+        mock_get_segments.return_value = [self.mock_netseg]
+        self.m_config.inventory[self.testhost]['physnet'] = 'otherphysnet'
+        self.gc.collect()
+        mock_get_segments.return_value = []
+        self.gc.collect()
+        mock_delete_vlan.assert_not_called()
+
+    def test_collect_switch_owned_elsewhere(self, mock_delete_vlan,
+                                            mock_get_segments,
+                                            mock_context):
+        mock_get_segments.return_value = []
+        self.mech.partitioner = mock.Mock()
+        self.mech.partitioner.owns.return_value = False
+        self.gc.schedule(self.testhost, self.testsegid, self.testphysnet)
+        self.gc.collect()
+        mock_delete_vlan.assert_not_called()
@@ -15,6 +15,8 @@
 
 from unittest import mock
 
+from networking_ansible import config
+from networking_ansible import exceptions
 from networking_ansible.tests.unit import base
 
 
@@ -37,6 +39,13 @@ class MockedConfigParser(mock.Mock):
                 'ansible:h2': {'manage_vlans': ['true']},
                 'ansible:h3': {'manage_vlans': ['false']},
             }
+        elif self.conffile == 'sriov_port_mappings':
+            section_data = {'ansible:port_mappings':
+                            {'compute-1': ['testhost::testport'],
+                             'compute-1-370b': ['testhost::testport2']},
+                            'ansible:testhost':
+                            {'mac': ['01:23:45:67:89:ab']}
+                            }
         elif self.conffile == 'invalid_port_mapping':
             section_data = {'ansible:port_mappings':
                             {'localhost': ['invalid']},
@@ -104,3 +113,57 @@ class TestConfig(base.BaseTestCase):
         self.assertEqual({'manage_vlans': True}, hosts['h2'])
         self.assertEqual({'manage_vlans': False}, hosts['h3'])
         self.assertEqual({}, self.ansconfig.Config().mac_map)
+
+    @mock.patch('networking_ansible.config.cfg.ConfigParser',
+                MockedConfigParser)
+    def test_config_sriov_port_mappings(self):
+        self.test_config_files = ['sriov_port_mappings']
+        self.setup_config()
+
+        self.assertEqual({('compute-1', '370b'): [('testhost', 'testport2')]},
+                         self.ansconfig.Config().sriov_port_mappings)
+
+
+class TestParsePciSlot(base.BaseTestCase):
+    parse_config = False
+
+    def test_parse_pci_slot(self):
+        self.assertEqual('0300', config.parse_pci_slot('0000:03:00.1'))
+
+    def test_parse_pci_slot_no_function(self):
+        self.assertEqual('370b', config.parse_pci_slot('0000:37:0b'))
+
+    def test_parse_pci_slot_no_domain(self):
+        self.assertEqual('0300', config.parse_pci_slot('03:00.1'))
+
+    def test_parse_pci_slot_cached(self):
+        config.parse_pci_slot.cache_clear()
+        config.parse_pci_slot('0000:03:00.1')
+        config.parse_pci_slot('0000:03:00.1')
+        self.assertEqual(1, config.parse_pci_slot.cache_info().hits)
+
+    def test_parse_pci_slot_missing(self):
+        self.assertRaises(exceptions.PciSlotInvalidException,
+                          config.parse_pci_slot, None)
+
+    def test_parse_pci_slot_malformed(self):
+        for pci_slot in ('', 'pci', '0000:03', '0000:03:00.9', 12):
+            self.assertRaises(exceptions.PciSlotInvalidException,
+                              config.parse_pci_slot, pci_slot)
+
+
+class TestBuildSriovIndex(base.BaseTestCase):
+    parse_config = False
+
+    def test_build_sriov_index(self):
+        mappings = [('testhost', 'testport')]
+        port_mappings = {'compute-1': [('testhost', 'p1')],
+                         'compute-1-0300': mappings,
+                         'compute-1-0301': mappings,
+                         'compute-1-00010300': mappings,
+                         'compute-1-030': mappings,
+                         '-0300': mappings}
+        self.assertEqual({('compute-1', '0300'): mappings,
+                          ('compute-1', '0301'): mappings,
+                          ('compute-1', '00010300'): mappings},
+                         config.build_sriov_index(port_mappings))